@@ -2,11 +2,13 @@
 
 import argparse
 from time import sleep
-from prometheus_client import start_http_server, Summary,Gauge
+from prometheus_client import start_http_server, Summary,Gauge, REGISTRY
 import board
 import busio
 import adafruit_bmp3xx
 
+from moda.collector import ScrapeCollector
+
 i2c = board.I2C()
 bmp = adafruit_bmp3xx.BMP3XX_I2C(i2c,0x76)
 
@@ -20,26 +22,35 @@ parser.add_argument('--listen', action='store', default='0.0.0.0', help='bind to
 parser.add_argument('--port', action='store', type=int, default=8001, help='bind to port, default: 8002')
 parser.add_argument('--polling_interval', action='store', type=int, default=3, help='sensor polling interval, seconds, default: 1')
 parser.add_argument('--verbose', action="store_true", help='print every poll result to stdout')
+parser.add_argument('--lazy', action="store_true", help='read the sensor when scraped instead of polling it')
+parser.add_argument('--ttl', action='store', type=float, default=1, help='seconds a reading is reused for in --lazy mode, default: 1')
 
 args = parser.parse_args()
 
+METRICS = (
+    ('temp', 'bmp390_temp', 'temp level, ppm'),
+    ('pressure', 'bmp390_pressure', 'Total Volatile Organic Compounds level, ppm'),
+)
 
-temp = Gauge('bmp390_temp', 'temp level, ppm')
-pressure = Gauge('bmp390_pressure', 'Total Volatile Organic Compounds level, ppm')
-
-def get_data():
+def read_sensor():
     #print("temp: ", ccs.getetemp(), "ppm, pressure: ", ccs.getpressure(), " temp: ", temp)
     bmp390_temp = bmp.temperature
     bmp390_pressure = bmp.pressure
-    temp_value=bmp390_temp
-    pressure_value=bmp390_pressure
-    temp.set(temp_value)
-    pressure.set(pressure_value)
     if args.verbose:
-        print("temp = %d C \t pressure = %d hPa" % (temp, pressure))
+        print("temp = %d C \t pressure = %d hPa" % (bmp390_temp, bmp390_pressure))
+    return {'temp': bmp390_temp, 'pressure': bmp390_pressure}
+
+def get_data():
+    for field, value in read_sensor().items():
+        gauges[field].set(value)
 
 if __name__ == '__main__':
+    if args.lazy:
+        REGISTRY.register(ScrapeCollector('bmp390', read_sensor, METRICS, ttl=args.ttl))
+    else:
+        gauges = {field: Gauge(name, documentation) for field, name, documentation in METRICS}
     start_http_server(args.port, args.listen)
     while True:
-        get_data()
+        if not args.lazy:
+            get_data()
         sleep(args.polling_interval)
@@ -1,22 +1,20 @@
 #!/usr/bin/env python3
 import os
-import random
-import requests
 import time
 import logging
 import argparse
-import subprocess
-import aqi
 from threading import Thread
 
-from prometheus_client import start_http_server, Gauge, Histogram
+from prometheus_client import start_http_server, Gauge, Histogram, Counter, REGISTRY
 
 from bme280 import BME280
-from enviroplus import gas
-from pms5003 import PMS5003, ReadTimeoutError as pmsReadTimeoutError
 
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+from moda.scheduler import Scheduler
+from moda.snapshot import SnapshotStore, SnapshotCollector
+
+# The gas sensor, PMS5003, InfluxDB and Luftdaten modules (and requests, the AQI tables)
+# are imported in __main__ only when those features are turned on, so an
+# Enviro without them starts, and is serving again after a restart, sooner.
 
 
 try:
@@ -48,20 +46,26 @@ DEBUG = os.getenv('DEBUG', 'false') == 'true'
 
 bus = SMBus(1)
 bme280 = BME280(i2c_dev=bus)
-pms5003 = PMS5003()
-
-TEMPERATURE = Gauge('temperature','Temperature measured (*C)')
-PRESSURE = Gauge('pressure','Pressure measured (hPa)')
-HUMIDITY = Gauge('humidity','Relative humidity measured (%)')
-OXIDISING = Gauge('oxidising','Mostly nitrogen dioxide but could include NO and Hydrogen (Ohms)')
-REDUCING = Gauge('reducing', 'Mostly carbon monoxide but could include H2S, Ammonia, Ethanol, Hydrogen, Methane, Propane, Iso-butane (Ohms)')
-NH3 = Gauge('NH3', 'mostly Ammonia but could also include Hydrogen, Ethanol, Propane, Iso-butane (Ohms)') 
-LUX = Gauge('lux', 'current ambient light level (lux)')
-PROXIMITY = Gauge('proximity', 'proximity, with larger numbers being closer proximity and vice versa')
-PM1 = Gauge('PM1', 'Particulate Matter of diameter less than 1 micron. Measured in micrograms per cubic metre (ug/m3)')
-PM25 = Gauge('PM25', 'Particulate Matter of diameter less than 2.5 microns. Measured in micrograms per cubic metre (ug/m3)')
-PM10 = Gauge('PM10', 'Particulate Matter of diameter less than 10 microns. Measured in micrograms per cubic metre (ug/m3)')
-AQI = Gauge('AQI', 'AQI value')
+
+# Every reading goes into one snapshot that Prometheus and the posting
+# threads read, so they never see a half-updated set of values.
+METRICS = (
+    ('temperature', 'temperature', 'Temperature measured (*C)'),
+    ('pressure', 'pressure', 'Pressure measured (hPa)'),
+    ('humidity', 'humidity', 'Relative humidity measured (%)'),
+    ('oxidising', 'oxidising', 'Mostly nitrogen dioxide but could include NO and Hydrogen (Ohms)'),
+    ('reducing', 'reducing', 'Mostly carbon monoxide but could include H2S, Ammonia, Ethanol, Hydrogen, Methane, Propane, Iso-butane (Ohms)'),
+    ('nh3', 'NH3', 'mostly Ammonia but could also include Hydrogen, Ethanol, Propane, Iso-butane (Ohms)'),
+    ('lux', 'lux', 'current ambient light level (lux)'),
+    ('proximity', 'proximity', 'proximity, with larger numbers being closer proximity and vice versa'),
+    ('pm1', 'PM1', 'Particulate Matter of diameter less than 1 micron. Measured in micrograms per cubic metre (ug/m3)'),
+    ('pm25', 'PM25', 'Particulate Matter of diameter less than 2.5 microns. Measured in micrograms per cubic metre (ug/m3)'),
+    ('pm10', 'PM10', 'Particulate Matter of diameter less than 10 microns. Measured in micrograms per cubic metre (ug/m3)'),
+    ('aqi', 'AQI', 'AQI value'),
+)
+SNAPSHOT = SnapshotStore(field for field, _, _ in METRICS)
+COLLECTOR = SnapshotCollector(METRICS, SNAPSHOT)
+REGISTRY.register(COLLECTOR)
 
 OXIDISING_HIST = Histogram('oxidising_measurements', 'Histogram of oxidising measurements', buckets=(0, 10000, 15000, 20000, 25000, 30000, 35000, 40000, 45000, 50000, 55000, 60000, 65000, 70000, 75000, 80000, 85000, 90000, 100000))
 REDUCING_HIST = Histogram('reducing_measurements', 'Histogram of reducing measurements', buckets=(0, 100000, 200000, 300000, 400000, 500000, 600000, 700000, 800000, 900000, 1000000, 1100000, 1200000, 1300000, 1400000, 1500000))
@@ -71,6 +75,14 @@ PM1_HIST = Histogram('pm1_measurements', 'Histogram of Particulate Matter of dia
 PM25_HIST = Histogram('pm25_measurements', 'Histogram of Particulate Matter of diameter less than 2.5 micron measurements', buckets=(0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100))
 PM10_HIST = Histogram('pm10_measurements', 'Histogram of Particulate Matter of diameter less than 10 micron measurements', buckets=(0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100))
 
+# Ring buffers of every gas and particulate read, when --window is given
+GAS_WINDOW = None
+PM_WINDOW = None
+
+SCHEDULE_LAG = Gauge('scheduler_lag_seconds', 'How late the last read of each sensor started (s)', ['sensor'])
+SCHEDULE_MISSED = Counter('scheduler_missed_ticks', 'Sensor reads skipped because the previous one overran', ['sensor'])
+READ_TIME = Gauge('sensor_read_seconds', 'Time taken by the last read of each sensor (s)', ['sensor'])
+
 # Setup InfluxDB
 # You can generate an InfluxDB Token from the Tokens Tab in the InfluxDB Cloud UI
 INFLUXDB_URL = os.getenv('INFLUXDB_URL', '')
@@ -79,14 +91,23 @@ INFLUXDB_ORG_ID = os.getenv('INFLUXDB_ORG_ID', '')
 INFLUXDB_BUCKET = os.getenv('INFLUXDB_BUCKET', '')
 INFLUXDB_SENSOR_LOCATION = os.getenv('INFLUXDB_SENSOR_LOCATION', 'Adelaide')
 INFLUXDB_TIME_BETWEEN_POSTS = int(os.getenv('INFLUXDB_TIME_BETWEEN_POSTS', '5'))
-influxdb_client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG_ID)
-influxdb_api = influxdb_client.write_api(write_options=SYNCHRONOUS)
+# Points are queued and written in batches by a background thread, batches
+# that can't be delivered wait in the spool directory until InfluxDB is back
+INFLUXDB_BATCH_SIZE = int(os.getenv('INFLUXDB_BATCH_SIZE', '500'))
+INFLUXDB_FLUSH_INTERVAL = int(os.getenv('INFLUXDB_FLUSH_INTERVAL', '30'))
+INFLUXDB_SPOOL_DIR = os.getenv('INFLUXDB_SPOOL_DIR', 'influxdb_spool')
+INFLUXDB_SPOOL_MAX_BYTES = int(os.getenv('INFLUXDB_SPOOL_MAX_BYTES', str(16 * 1024 * 1024)))
+INFLUXDB_REPLAY_RATE = int(os.getenv('INFLUXDB_REPLAY_RATE', '1000'))
 
 # Setup Luftdaten
 LUFTDATEN_TIME_BETWEEN_POSTS = int(os.getenv('LUFTDATEN_TIME_BETWEEN_POSTS', '30'))
+# What to do with samples that couldn't be uploaded: 'coalesce' sends the mean
+# of the outage window once the API is back, 'drop' only ever sends fresh data
+LUFTDATEN_STALE_SAMPLES = os.getenv('LUFTDATEN_STALE_SAMPLES', 'coalesce')
 
 # Sometimes the sensors can't be read. Resetting the i2c 
 def reset_i2c():
+    import subprocess
     subprocess.run(['i2cdetect', '-y', '1'])
     time.sleep(2)
 
@@ -114,22 +135,20 @@ def get_temperature(factor):
     else:
         temperature = raw_temp
 
-    TEMPERATURE.set(temperature)   # Set to a given value
+    return temperature
 
 def get_pressure():
-    """Get pressure from the weather sensor"""
+    """Get pressure from the weather sensor, None if it failed"""
     try:
-        pressure = bme280.get_pressure()
-        PRESSURE.set(pressure)
+        return bme280.get_pressure()
     except IOError:
         logging.error("Could not get pressure readings. Resetting i2c.")
         reset_i2c()
 
 def get_humidity():
-    """Get humidity from the weather sensor"""
+    """Get humidity from the weather sensor, None if it failed"""
     try:
-        humidity = bme280.get_humidity()
-        HUMIDITY.set(humidity)
+        return bme280.get_humidity()
     except IOError:
         logging.error("Could not get humidity readings. Resetting i2c.")
         reset_i2c()
@@ -138,14 +157,14 @@ def get_gas():
     """Get all gas readings"""
     try:
         readings = gas.read_all()
+        values = {'oxidising': readings.oxidising, 'reducing': readings.reducing, 'nh3': readings.nh3}
 
-        OXIDISING.set(readings.oxidising)
-        OXIDISING_HIST.observe(readings.oxidising)
+        SNAPSHOT.update(values)
+        if GAS_WINDOW is not None:
+            GAS_WINDOW.append(values)
 
-        REDUCING.set(readings.reducing)
+        OXIDISING_HIST.observe(readings.oxidising)
         REDUCING_HIST.observe(readings.reducing)
-
-        NH3.set(readings.nh3)
         NH3_HIST.observe(readings.nh3)
     except IOError:
         logging.error("Could not get gas readings. Resetting i2c.")
@@ -157,8 +176,7 @@ def get_light():
        lux = ltr559.get_lux()
        prox = ltr559.get_proximity()
 
-       LUX.set(lux)
-       PROXIMITY.set(prox)
+       SNAPSHOT.update({'lux': lux, 'proximity': prox})
     except IOError:
         logging.error("Could not get lux and proximity readings. Resetting i2c.")
         reset_i2c()
@@ -169,17 +187,22 @@ def get_particulates():
         pms_data = pms5003.read()
         current_pm25 = pms_data.pm_ug_per_m3(2.5)
         current_pm10 = pms_data.pm_ug_per_m3(10)
-        current_aqi = aqi.to_aqi([(aqi.POLLUTANT_PM25, current_pm25), (aqi.POLLUTANT_PM10, current_pm10)])
-    except pmsReadTimeoutError:
+        current_aqi = EPA.aqi(current_pm25, current_pm10)
+    except TimeoutError:
         logging.warning("Failed to read PMS5003")
     except IOError:
         logging.error("Could not get particulate matter readings. Resetting i2c.")
         reset_i2c()
     else:
-        PM1.set(pms_data.pm_ug_per_m3(1.0))
-        PM25.set(pms_data.pm_ug_per_m3(2.5))
-        PM10.set(pms_data.pm_ug_per_m3(10))
-        AQI.set(current_aqi)
+        values = {
+            'pm1': pms_data.pm_ug_per_m3(1.0),
+            'pm25': pms_data.pm_ug_per_m3(2.5),
+            'pm10': pms_data.pm_ug_per_m3(10),
+            'aqi': current_aqi,
+        }
+        SNAPSHOT.update(values)
+        if PM_WINDOW is not None:
+            PM_WINDOW.append(values)
 
         PM1_HIST.observe(pms_data.pm_ug_per_m3(1.0))
         PM25_HIST.observe(pms_data.pm_ug_per_m3(2.5) - pms_data.pm_ug_per_m3(1.0))
@@ -187,90 +210,60 @@ def get_particulates():
 
 def collect_all_data():
     """Collects all the data currently set"""
-    sensor_data = {}
-    sensor_data['temperature'] = TEMPERATURE.collect()[0].samples[0].value
-    sensor_data['humidity'] = HUMIDITY.collect()[0].samples[0].value
-    sensor_data['pressure'] = PRESSURE.collect()[0].samples[0].value
-    sensor_data['oxidising'] = OXIDISING.collect()[0].samples[0].value
-    sensor_data['reducing'] = REDUCING.collect()[0].samples[0].value
-    sensor_data['nh3'] = NH3.collect()[0].samples[0].value
-    sensor_data['lux'] = LUX.collect()[0].samples[0].value
-    sensor_data['proximity'] = PROXIMITY.collect()[0].samples[0].value
-    sensor_data['pm1'] = PM1.collect()[0].samples[0].value
-    sensor_data['pm25'] = PM25.collect()[0].samples[0].value
-    sensor_data['pm10'] = PM10.collect()[0].samples[0].value
-    sensor_data['aqi'] = AQI.collect()[0].samples[0].value
-    return sensor_data
+    return SNAPSHOT.snapshot().as_dict()
 
 def post_to_influxdb():
-    """Post all sensor data to InfluxDB"""
-    name = 'enviroplus'
-    tag = ['location', 'adelaide']
+    """Queue all sensor data for InfluxDB"""
+    last_sequence = 0
     while True:
         time.sleep(INFLUXDB_TIME_BETWEEN_POSTS)
-        data_points = []
-        epoch_time_now = round(time.time())
-        sensor_data = collect_all_data()
-        for field_name in sensor_data:
-            data_points.append(Point('enviroplus').tag('location', INFLUXDB_SENSOR_LOCATION).field(field_name, sensor_data[field_name]))
-        try:
-            influxdb_api.write(bucket=INFLUXDB_BUCKET, record=data_points)
-            if DEBUG:
-                logging.info('InfluxDB response: OK')
-        except Exception as exception:
-            logging.warning('Exception sending to InfluxDB: {}'.format(exception))
+        snapshot = SNAPSHOT.snapshot()
+        if snapshot.sequence == last_sequence:
+            continue
+        last_sequence = snapshot.sequence
+        # All fields of the snapshot go out as a single line-protocol record
+        record = influxdb_lines.snapshot(snapshot)
+        if record is None:
+            continue
+        influxdb_writer.write(record)
+        if DEBUG:
+            logging.info('InfluxDB queued: {}'.format(record))
 
 def post_to_luftdaten():
     """Post relevant sensor data to luftdaten.info"""
     """Code from: https://github.com/sepulworld/balena-environ-plus"""
-    LUFTDATEN_SENSOR_UID = 'raspi-' + get_serial_number()
+    client = LuftdatenClient('raspi-' + get_serial_number(), stale=LUFTDATEN_STALE_SAMPLES)
     while True:
         time.sleep(LUFTDATEN_TIME_BETWEEN_POSTS)
         sensor_data = collect_all_data()
-        values = {}
-        values["P2"] = sensor_data['pm25']
-        values["P1"] = sensor_data['pm10']
-        values["temperature"] = "{:.2f}".format(sensor_data['temperature'])
-        values["pressure"] = "{:.2f}".format(sensor_data['pressure'] * 100)
-        values["humidity"] = "{:.2f}".format(sensor_data['humidity'])
-        pm_values = dict(i for i in values.items() if i[0].startswith('P'))
-        temperature_values = dict(i for i in values.items() if not i[0].startswith('P'))
-        try:
-            response_pin_1 = requests.post('https://api.luftdaten.info/v1/push-sensor-data/',
-                json={
-                    "software_version": "enviro-plus 0.0.1",
-                    "sensordatavalues": [{"value_type": key, "value": val} for
-                                        key, val in pm_values.items()]
-                },
-                headers={
-                    "X-PIN":    "1",
-                    "X-Sensor": LUFTDATEN_SENSOR_UID,
-                    "Content-Type": "application/json",
-                    "cache-control": "no-cache"
-                }
-            )
-
-            response_pin_11 = requests.post('https://api.luftdaten.info/v1/push-sensor-data/',
-                    json={
-                        "software_version": "enviro-plus 0.0.1",
-                        "sensordatavalues": [{"value_type": key, "value": val} for
-                                            key, val in temperature_values.items()]
-                    },
-                    headers={
-                        "X-PIN":    "11",
-                        "X-Sensor": LUFTDATEN_SENSOR_UID,
-                        "Content-Type": "application/json",
-                        "cache-control": "no-cache"
-                    }
-            )
-
-            if response_pin_1.ok and response_pin_11.ok:
-                if DEBUG:
-                    logging.info('Luftdaten response: OK')
-            else:
-                logging.warning('Luftdaten response: Failed')
-        except Exception as exception:
-            logging.warning('Exception sending to Luftdaten: {}'.format(exception))
+        if not all(field in sensor_data for field in ('pm25', 'pm10', 'temperature', 'pressure', 'humidity')):
+            continue
+        pm_values = {"P2": sensor_data['pm25'], "P1": sensor_data['pm10']}
+        temperature_values = {
+            "temperature": sensor_data['temperature'],
+            "pressure": sensor_data['pressure'] * 100,
+            "humidity": sensor_data['humidity'],
+        }
+        # PIN 1 and PIN 11 are uploaded concurrently over one pooled session
+        if client.push({"1": pm_values, "11": temperature_values}):
+            if DEBUG:
+                logging.info('Luftdaten response: OK')
+        else:
+            logging.warning('Luftdaten response: Failed')
+
+def get_weather(factor):
+    """Read everything from the BME280"""
+    values = {'temperature': get_temperature(factor), 'pressure': get_pressure(), 'humidity': get_humidity()}
+    # Under the store lock in one go, so a snapshot never mixes two weather reads
+    SNAPSHOT.update({name: value for name, value in values.items() if value is not None})
+
+def observe_task(task):
+    """Publish what a sensor read and export its scheduling health"""
+    SNAPSHOT.publish()
+    SCHEDULE_LAG.labels(task.name).set(task.lag)
+    READ_TIME.labels(task.name).set(task.duration)
+    if task.skipped:
+        SCHEDULE_MISSED.labels(task.name).inc(task.skipped)
 
 def get_serial_number():
     """Get Raspberry Pi serial number to use as LUFTDATEN_SENSOR_UID"""
@@ -294,12 +287,24 @@ if __name__ == '__main__':
     parser.add_argument("-f", "--factor", metavar='FACTOR', type=float, help="The compensation factor to get better temperature results when the Enviro+ pHAT is too close to the Raspberry Pi board")
     parser.add_argument("-e", "--enviro", metavar='ENVIRO', type=str_to_bool, help="Device is an Enviro (not Enviro+) so don't fetch data from gas and particulate sensors as they don't exist")
     parser.add_argument("-d", "--debug", metavar='DEBUG', type=str_to_bool, help="Turns on more verbose logging, showing sensor output and post responses [default: false]")
+    parser.add_argument("--weather-interval", metavar='SECONDS', type=float, default=5, help="Seconds between BME280 temperature, pressure and humidity reads [default: 5]")
+    parser.add_argument("--light-interval", metavar='SECONDS', type=float, default=1, help="Seconds between light and proximity reads [default: 1]")
+    parser.add_argument("--gas-interval", metavar='SECONDS', type=float, default=1, help="Seconds between gas sensor reads [default: 1]")
+    parser.add_argument("-w", "--window", metavar='SECONDS', type=float, default=0, help="Also export the min, max, mean, stddev and p95 of every gas and particulate read over the last SECONDS, set it to the scrape interval and lower --gas-interval to catch short spikes [default: 0, off]")
+    parser.add_argument("--store", metavar='DIR', help="Keep the readings in ring files in DIR and serve them on /query next to /metrics")
+    parser.add_argument("--store-interval", metavar='SECONDS', type=float, default=15, help="Seconds between two readings kept by --store [default: 15]")
+    parser.add_argument("--retention", metavar='DAYS', type=float, default=7, help="Days of readings --store keeps [default: 7]")
     parser.add_argument("-i", "--influxdb", metavar='INFLUXDB', type=str_to_bool, default='false', help="Post sensor data to InfluxDB [default: false]")
     parser.add_argument("-l", "--luftdaten", metavar='LUFTDATEN', type=str_to_bool, default='false', help="Post sensor data to Luftdaten [default: false]")
     args = parser.parse_args()
 
     # Start up the server to expose the metrics.
-    start_http_server(addr=args.bind, port=args.port)
+    if args.store:
+        from moda import ringstore
+        store = ringstore.RingStore(args.store, args.retention * 86400, args.store_interval)
+        ringstore.start_http_server(args.port, args.bind, store)
+    else:
+        start_http_server(addr=args.bind, port=args.port)
     # Generate some requests.
 
     if args.debug:
@@ -308,13 +313,40 @@ if __name__ == '__main__':
     if args.factor:
         logging.info("Using compensating algorithm (factor={}) to account for heat leakage from Raspberry Pi board".format(args.factor))
 
+    if not args.enviro:
+        from moda.airquality import EPA
+        from enviroplus import gas
+        from pms5003 import PMS5003
+        from moda.frames import SerialFrames, PMS5003Decoder
+        # The library sets up the enable and reset pins and the port,
+        # moda.frames decodes the frames and resyncs after corrupt bytes
+        pms5003 = SerialFrames(PMS5003()._serial, PMS5003Decoder('pms5003'))
+
+        if args.window:
+            from moda.window import WindowBuffer, WindowCollector
+            GAS_WINDOW = WindowBuffer(('oxidising', 'reducing', 'nh3'))
+            PM_WINDOW = WindowBuffer(('pm1', 'pm25', 'pm10', 'aqi'))
+            REGISTRY.register(WindowCollector(METRICS, (GAS_WINDOW, PM_WINDOW), args.window))
+
     if args.influxdb:
+        from moda.influx import InfluxWriter
+        from moda.lineprotocol import LineSerializer
+
+        influxdb_writer = InfluxWriter(INFLUXDB_URL, INFLUXDB_TOKEN, INFLUXDB_ORG_ID, INFLUXDB_BUCKET,
+                                       batch_size=INFLUXDB_BATCH_SIZE, flush_interval=INFLUXDB_FLUSH_INTERVAL,
+                                       spool_dir=INFLUXDB_SPOOL_DIR or None, spool_max_bytes=INFLUXDB_SPOOL_MAX_BYTES,
+                                       replay_rate=INFLUXDB_REPLAY_RATE)
+        influxdb_lines = LineSerializer('enviroplus', {'location': INFLUXDB_SENSOR_LOCATION}, SNAPSHOT.fields)
+
         # Post to InfluxDB in another thread
         logging.info("Sensor data will be posted to InfluxDB every {} seconds".format(INFLUXDB_TIME_BETWEEN_POSTS))
+        influxdb_writer.start()
         influx_thread = Thread(target=post_to_influxdb)
         influx_thread.start()
 
     if args.luftdaten:
+        from moda.luftdaten import LuftdatenClient
+
         # Post to Luftdaten in another thread
         LUFTDATEN_SENSOR_UID = 'raspi-' + get_serial_number()
         logging.info("Sensor data will be posted to Luftdaten every {} seconds for the UID {}".format(LUFTDATEN_TIME_BETWEEN_POSTS, LUFTDATEN_SENSOR_UID))
@@ -323,13 +355,16 @@ if __name__ == '__main__':
 
     logging.info("Listening on http://{}:{}".format(args.bind, args.port))
 
-    while True:
-        get_temperature(args.factor)
-        get_pressure()
-        get_humidity()
-        get_light()
-        if not args.enviro:
-            get_gas()
-            get_particulates()
-        if DEBUG:
-            logging.info('Sensor data: {}'.format(collect_all_data()))
+    scheduler = Scheduler(observer=observe_task)
+    scheduler.every(args.weather_interval, lambda: get_weather(args.factor), name='bme280')
+    scheduler.every(args.light_interval, get_light, name='ltr559')
+    if not args.enviro:
+        scheduler.every(args.gas_interval, get_gas, name='gas')
+        # pms5003.read() blocks until the sensor pushes its next frame
+        scheduler.stream(get_particulates, name='pms5003')
+    if args.store:
+        scheduler.every(args.store_interval, lambda: store.record([COLLECTOR]), name='store')
+    if DEBUG:
+        scheduler.every(args.weather_interval, lambda: logging.info('Sensor data: {}'.format(collect_all_data())), name='debug')
+
+    scheduler.run_forever()
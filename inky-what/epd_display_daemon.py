@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Resident e-paper display service
+
+Refreshes the Inky panel on a schedule from one long-running process
+instead of a cold start per refresh: PIL, the fonts, the Inky driver, the
+Prometheus connection and the frame buffers are set up once and kept. The
+layouts listed in the config are shown in turn, one per refresh; a single
+layout is only redrawn when its text changes. Fetch, render and panel
+update times are exported on /metrics.
+"""
+
+import argparse
+import configparser
+import datetime
+import functools
+import logging
+import os
+import time
+
+from PIL import ImageFont
+from inky.inky_uc8159 import Inky
+from prometheus_client import start_http_server, Counter, Gauge
+
+from font_source_serif_pro import SourceSerifProSemibold
+
+from moda.epaper import Panel
+from moda.palette import Quantizer
+from moda.prometheus import PrometheusClient
+from moda.scheduler import Scheduler
+
+from layouts import FIELDS, LAYOUTS, METRIC_FONT_SIZE, texts
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+
+FETCH_TIME = Gauge('epd_fetch_seconds', 'Time taken by the last Prometheus query of each layout (s)', ['layout'])
+RENDER_TIME = Gauge('epd_render_seconds', 'Time taken to draw the last frame of each layout (s)', ['layout'])
+REFRESH_TIME = Gauge('epd_refresh_seconds', 'Time taken by the last panel update of each layout (s)', ['layout'])
+VALUE_AGE = Gauge('epd_value_age_seconds', 'Age of the oldest value shown by each layout (s)', ['layout'])
+REFRESHES = Counter('epd_refreshes', 'Scheduled refreshes of each layout, by whether the panel was updated', ['layout', 'result'])
+
+
+def quiet_hours(spec):
+    """(start, end) hours from "23-7", or None for an empty spec"""
+    if not spec.strip():
+        return None
+    start, end = (int(hour) for hour in spec.split('-'))
+    return start, end
+
+
+def is_quiet(hours, now=None) -> bool:
+    if hours is None:
+        return False
+    hour = (now or datetime.datetime.now()).hour
+    start, end = hours
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+class Display:
+    def __init__(self, config):
+        """The panel and a Panel per layout listed in the [display] section of config"""
+        display = config['display']
+        self.names = [name.strip() for name in display.get('layouts', 'air').split(',') if name.strip()]
+        for name in self.names:
+            if name not in LAYOUTS:
+                raise ValueError("Unknown layout {}, expected one of {}".format(name, ', '.join(LAYOUTS)))
+        self.quiet = quiet_hours(display.get('quiet_hours', ''))
+        timeout = display.getfloat('timeout', fallback=3)
+        saturation = display.getfloat('saturation', fallback=1.0)
+        # floyd-steinberg leaves the conversion to the Inky driver
+        dither = display.get('dither', 'floyd-steinberg')
+        quantizer = None
+        if dither != 'floyd-steinberg':
+            quantizer = Quantizer(saturation, dither, cache=os.path.join(PATH, 'cache'))
+
+        # One client, and so one kept-alive connection, per Prometheus
+        clients = {}
+        # One Inky and one font shared by every layout, made on first use
+        inky = functools.lru_cache(maxsize=None)(Inky)
+        font = functools.lru_cache(maxsize=None)(lambda: ImageFont.truetype(SourceSerifProSemibold, METRIC_FONT_SIZE))
+
+        self.layouts = []
+        for name in self.names:
+            section = config[name] if config.has_section(name) else display
+            url = section.get('prometheus', display.get('prometheus', 'http://localhost:9090'))
+            if url not in clients:
+                clients[url] = PrometheusClient(url, timeout=timeout)
+            layout = LAYOUTS[name]
+            panel = Panel(
+                inky,
+                os.path.join(PATH, "resources", layout.background),
+                font,
+                FIELDS,
+                fills=layout.fills,
+                saturation=saturation,
+                quantizer=quantizer,
+            )
+            self.layouts.append((name, layout, clients[url], panel))
+            for result in ('updated', 'unchanged', 'quiet'):
+                REFRESHES.labels(name, result)
+        self.next = 0
+        self.shown = None
+
+    def refresh(self):
+        name, layout, prom, panel = self.layouts[self.next]
+        self.next = (self.next + 1) % len(self.layouts)
+        if is_quiet(self.quiet):
+            REFRESHES.labels(name, 'quiet').inc()
+            return
+
+        start = time.perf_counter()
+        values = prom.get_values(layout.queries)
+        FETCH_TIME.labels(name).set(time.perf_counter() - start)
+        if values:
+            VALUE_AGE.labels(name).set(max(prom.age(key) for key in values))
+
+        # The panel holds another layout's frame: redraw even if ours is unchanged
+        if panel.update(texts(values), force=self.shown != name):
+            self.shown = name
+            RENDER_TIME.labels(name).set(panel.render_seconds)
+            REFRESH_TIME.labels(name).set(panel.refresh_seconds)
+            REFRESHES.labels(name, 'updated').inc()
+        else:
+            REFRESHES.labels(name, 'unchanged').inc()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the Inky e-paper display on a schedule")
+    parser.add_argument("-c", "--config", metavar='FILE', default='/etc/moda/epd-display.ini', help="Display config file [default: /etc/moda/epd-display.ini]")
+    parser.add_argument("-d", "--debug", action='store_true', help="Turns on more verbose logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
+        level=logging.DEBUG if args.debug else logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    config = configparser.ConfigParser()
+    with open(args.config) as f:
+        config.read_file(f)
+    if not config.has_section('display'):
+        config.add_section('display')
+    display = Display(config)
+
+    section = config['display']
+    start_http_server(addr=section.get('bind', '0.0.0.0'), port=section.getint('port', fallback=8010))
+
+    scheduler = Scheduler()
+    scheduler.every(section.getfloat('interval', fallback=60), display.refresh, name='refresh')
+    logging.info("Showing {} every {:g}s".format(', '.join(display.names), section.getfloat('interval', fallback=60)))
+    scheduler.run_forever()
+
+
+if __name__ == '__main__':
+    main()
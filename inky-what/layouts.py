@@ -0,0 +1,67 @@
+"""What the e-paper displays show, for the one-shot scripts and the display daemon"""
+
+from collections import namedtuple
+
+from moda.airquality import EPA
+from moda.epaper import quantize
+
+# background is a file in resources/, queries maps each value to its
+# (metric, labels) and fills the fields not drawn in the default colour
+Layout = namedtuple('Layout', 'background queries fills')
+
+deck_label_config = {'location': 'deck'}
+living_label_config = {'location': 'living_room'}
+
+FIELDS = {
+    'aqi': (150, 20),
+    'pm1': (150, 120),
+    'pm25': (150, 230),
+    'pm10': (150, 330),
+    'co2': (375, 20),
+    'voc': (375, 120),
+    'tf_in': (375, 230),
+    'tf_out': (375, 330),
+}
+
+METRIC_FONT_SIZE = 74
+
+AIR_QUERIES = {
+    'pm1': ('PM1', deck_label_config),
+    'pm25': ('PM25', deck_label_config),
+    'pm10': ('PM10', deck_label_config),
+    'co2': ('co2', living_label_config),
+    'voc': ('tvoc', living_label_config),
+    't_in': ('temperature', living_label_config),
+    't_out': ('temperature', deck_label_config),
+}
+
+# The Inky palette index for black
+BLACK = 0
+
+LAYOUTS = {
+    'air': Layout('darkblue.png', AIR_QUERIES, {}),
+    'air_backup': Layout('bluegreentable.png', dict(
+        AIR_QUERIES,
+        co2=('sgp30_eco2', living_label_config),
+        voc=('sgp30_tvoc', living_label_config),
+    ), {'aqi': BLACK, 'pm10': BLACK, 'voc': BLACK}),
+    'power': Layout('darkblue.png', AIR_QUERIES, {}),
+}
+
+
+def fahrenheit(celsius):
+    return None if celsius is None else celsius * 1.8 + 32
+
+
+def texts(values) -> dict:
+    """Text of each field, at the precision it is shown with, so noise below it doesn't refresh the panel"""
+    return {
+        'aqi': str(EPA.aqi(values['pm25'], values['pm10'])) if 'pm25' in values and 'pm10' in values else '--',
+        'pm1': quantize(values.get('pm1'), 1),
+        'pm25': quantize(values.get('pm25'), 1),
+        'pm10': quantize(values.get('pm10'), 1),
+        'co2': quantize(values.get('co2')),
+        'voc': quantize(values.get('voc')),
+        'tf_in': quantize(fahrenheit(values.get('t_in')), 1, '{:.1f}'),
+        'tf_out': quantize(fahrenheit(values.get('t_out')), 1, '{:.1f}'),
+    }
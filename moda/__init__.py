@@ -0,0 +1,5 @@
+"""Shared building blocks for the moda exporters
+
+Deploy next to the exporters (/usr/src/moda) and run them with
+PYTHONPATH=/usr/src, as the units in services/ do.
+"""
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Single-process agent running every sensor driver of a host
+
+Each config section loads one driver from moda.drivers (see
+services/moda-agent.ini). All drivers share one interpreter, one I2C bus
+handle and one /metrics endpoint instead of one exporter process per
+sensor. The agent exports its own footprint: process_resident_memory_bytes
+from the default process collector, agent_peak_resident_memory_bytes, and
+CPU time per driver.
+
+With asyncio = true in [agent], serial drivers that support it (sds011,
+pms5003, pzem) share one event loop thread instead of a thread each, so a
+particulate sensor waiting on its fan never holds up the power meter.
+
+With store = DIR in [agent], every reading is also kept on the device in
+moda.ringstore ring files (every store_interval seconds, for
+retention_days) and served on /query next to /metrics.
+
+    PYTHONPATH=/usr/src python3 -m moda.agent --config /etc/moda/agent.ini
+"""
+
+import argparse
+import asyncio
+import configparser
+import logging
+import resource
+import signal
+import sys
+import threading
+import time
+
+from prometheus_client import start_http_server, Counter, Gauge, REGISTRY
+
+from moda.drivers import SharedI2C, load_driver
+from moda.scheduler import Scheduler
+
+DRIVER_UP = Gauge('agent_driver_up', 'Whether the driver set up its sensor (boolean)', ['driver'])
+DRIVER_CPU = Counter('agent_driver_cpu_seconds', 'CPU time spent in each driver (s)', ['driver'])
+DRIVER_ERRORS = Counter('agent_driver_errors', 'Driver polls that raised', ['driver'])
+READ_TIME = Gauge('agent_driver_read_seconds', 'Time taken by the last poll of each driver (s)', ['driver'])
+SCHEDULE_LAG = Gauge('agent_driver_lag_seconds', 'How late the last poll of each driver started (s)', ['driver'])
+SCHEDULE_MISSED = Counter('agent_driver_missed_ticks', 'Driver polls skipped because the previous one overran', ['driver'])
+PEAK_RSS = Gauge('agent_peak_resident_memory_bytes', 'Peak resident memory size of the agent (bytes)')
+# ru_maxrss is in kilobytes on Linux
+PEAK_RSS.set_function(lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+def timed(driver):
+    """Wrap driver.poll to account its CPU time and errors"""
+    def poll():
+        start = time.thread_time()
+        try:
+            driver.poll()
+        except Exception:
+            DRIVER_ERRORS.labels(driver.name).inc()
+            raise
+        finally:
+            DRIVER_CPU.labels(driver.name).inc(time.thread_time() - start)
+    return poll
+
+
+class _Timed:
+    """Await a coroutine, adding the CPU time of each of its steps to counter
+
+    Coroutines of other drivers run between the steps, so timing the await
+    as a whole would charge their CPU time to this driver too.
+    """
+
+    def __init__(self, coroutine, counter):
+        self.coroutine = coroutine
+        self.counter = counter
+
+    def __await__(self):
+        send, error = None, None
+        while True:
+            start = time.thread_time()
+            try:
+                if error is None:
+                    future = self.coroutine.send(send)
+                else:
+                    future = self.coroutine.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.counter.inc(time.thread_time() - start)
+            try:
+                send, error = (yield future), None
+            except BaseException as exception:
+                send, error = None, exception
+
+
+async def run_async(driver):
+    """Await driver.apoll() forever, accounting it like the scheduler does"""
+    cpu = DRIVER_CPU.labels(driver.name)
+    while True:
+        start = time.monotonic()
+        try:
+            await _Timed(driver.apoll(), cpu)
+        except Exception:
+            logging.exception("Driver {} failed".format(driver.name))
+            DRIVER_ERRORS.labels(driver.name).inc()
+            # Don't spin on a sensor that fails straight away
+            await asyncio.sleep(1)
+        READ_TIME.labels(driver.name).set(time.monotonic() - start)
+
+
+async def run_all_async(drivers):
+    await asyncio.gather(*(run_async(driver) for driver in drivers))
+
+
+def observe_task(task):
+    READ_TIME.labels(task.name).set(task.duration)
+    SCHEDULE_LAG.labels(task.name).set(task.lag)
+    if task.skipped:
+        SCHEDULE_MISSED.labels(task.name).inc(task.skipped)
+
+
+def load_config(path):
+    config = configparser.ConfigParser()
+    with open(path) as f:
+        config.read_file(f)
+    if not config.has_section('agent'):
+        config.add_section('agent')
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every sensor driver of a host in one process")
+    parser.add_argument("-c", "--config", metavar='FILE', default='/etc/moda/agent.ini', help="Driver config file [default: /etc/moda/agent.ini]")
+    parser.add_argument("-p", "--port", metavar='PORT', type=int, help="Port to serve /metrics on, overriding the config")
+    parser.add_argument("-d", "--debug", action='store_true', help="Turns on more verbose logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
+        level=logging.DEBUG if args.debug else logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    config = load_config(args.config)
+    agent = config['agent']
+    # Extra directories for drivers that live next to an exporter (pzem needs bus.py)
+    for path in agent.get('path', '').split(':'):
+        if path and path not in sys.path:
+            sys.path.append(path)
+
+    i2c = SharedI2C(agent.getint('i2c_bus', fallback=1))
+    scheduler = Scheduler(observer=observe_task)
+    use_asyncio = agent.getboolean('asyncio', fallback=False)
+    drivers = []
+    async_drivers = []
+    # Snapshot collectors of every driver, for the store
+    readings = []
+    for name in config.sections():
+        if name == 'agent':
+            continue
+        try:
+            driver = load_driver(name, config[name], i2c)
+            driver.use_asyncio = use_asyncio and hasattr(driver, 'apoll')
+            driver.setup()
+        except Exception:
+            # One missing sensor shouldn't take the others down with it
+            logging.exception("Could not set up driver {}".format(name))
+            DRIVER_UP.labels(name).set(0)
+            continue
+        for collector in driver.collectors():
+            REGISTRY.register(collector)
+        readings.append(driver.collector())
+        drivers.append(driver)
+        DRIVER_UP.labels(name).set(1)
+        DRIVER_CPU.labels(name)
+        DRIVER_ERRORS.labels(name)
+        if driver.use_asyncio:
+            async_drivers.append(driver)
+        elif driver.blocking:
+            scheduler.stream(timed(driver), name=name)
+        else:
+            scheduler.every(driver.interval, timed(driver), name=name)
+        logging.info("Loaded driver {} ({})".format(name, type(driver).__module__))
+
+    bind = agent.get('bind', '0.0.0.0')
+    port = args.port or agent.getint('port', fallback=8000)
+    if agent.get('store'):
+        from moda import ringstore
+        interval = agent.getfloat('store_interval', fallback=15)
+        store = ringstore.RingStore(agent['store'], agent.getfloat('retention_days', fallback=7) * 86400, interval)
+        scheduler.every(interval, lambda: store.record(readings), name='store')
+        ringstore.start_http_server(port, bind, store)
+    else:
+        start_http_server(addr=bind, port=port)
+    logging.info("Listening on http://{}:{}, peak RSS {:.1f} MB".format(
+        bind, port, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    if async_drivers:
+        threading.Thread(target=asyncio.run, args=(run_all_async(async_drivers),), name='asyncio', daemon=True).start()
+    # systemctl stop sends SIGTERM: exit through the finally below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        scheduler.run_forever()
+    finally:
+        for driver in drivers:
+            try:
+                driver.close()
+            except Exception:
+                logging.exception("Could not close driver {}".format(driver.name))
+
+
+if __name__ == '__main__':
+    main()
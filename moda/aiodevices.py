@@ -0,0 +1,110 @@
+"""asyncio drivers for the UART particulate sensors
+
+Coroutine counterparts of sds011.SDS011 and pms5003.PMS5003 on top of
+moda.aioserial.SerialPort, so a sensor waiting for its next frame never
+holds up anything else on the event loop. Frames are cut out of the byte
+stream by the decoders in moda.frames.
+"""
+
+import asyncio
+from collections import deque
+
+from moda.aioserial import SerialPort
+from moda.frames import SDS011Decoder, PMS5003Decoder, PMS5003Data
+
+# Decoded frames kept for the next reads before the oldest are dropped
+MAX_PENDING = 64
+
+
+class _UARTSensor:
+    def __init__(self, path, decoder, timeout):
+        """Sensor on the UART at path; name labels its frame counters"""
+        self.port = SerialPort(path, 9600)
+        self.decoder = decoder
+        self.timeout = timeout
+        self._pending = deque(maxlen=MAX_PENDING)
+
+    def close(self):
+        self.port.close()
+
+    def reset_input_buffer(self):
+        self.port.reset_input_buffer()
+        self.decoder.reset()
+        self._pending.clear()
+
+    async def _next_frame(self, deadline):
+        """Oldest decoded frame, raising asyncio.TimeoutError at deadline (loop time)"""
+        loop = asyncio.get_running_loop()
+        while not self._pending:
+            self._pending.extend(self.decoder.feed(await self.port.read_some(deadline - loop.time())))
+        return self._pending.popleft()
+
+    def _deadline(self):
+        return asyncio.get_running_loop().time() + self.timeout
+
+
+class SDS011(_UARTSensor):
+    """Nova SDS011, as sds011.SDS011 plus reading pushed frames in active mode"""
+
+    DATA = 0xC0
+    REPLY = 0xC5
+
+    CMD_REPORT_MODE = 2
+    CMD_QUERY = 4
+    CMD_SLEEP = 6
+
+    def __init__(self, path, timeout=2.0, name='sds011'):
+        super().__init__(path, SDS011Decoder(name), timeout)
+
+    @staticmethod
+    def command(cmd, data=()):
+        """19 byte command frame addressed to every sensor (id FFFF)"""
+        body = bytes([cmd]) + bytes(data).ljust(12, b'\x00') + b'\xff\xff'
+        return b'\xaa\xb4' + body + bytes([sum(body) & 0xFF]) + b'\xab'
+
+    async def _frame(self, kind):
+        deadline = self._deadline()
+        while True:
+            frame = await self._next_frame(deadline)
+            if frame[0] == kind:
+                return frame
+
+    async def _request(self, cmd, data, kind):
+        self.reset_input_buffer()
+        await self.port.write(self.command(cmd, data))
+        return await self._frame(kind)
+
+    async def set_report_mode(self, active=False):
+        await self._request(self.CMD_REPORT_MODE, (1, 0 if active else 1), self.REPLY)
+
+    async def sleep(self, sleep=True):
+        """Stop (or with sleep=False, start) the fan and laser"""
+        await self._request(self.CMD_SLEEP, (1, 0 if sleep else 1), self.REPLY)
+
+    @staticmethod
+    def _values(frame):
+        _, pm25, pm10 = frame
+        return pm25 / 10.0, pm10 / 10.0
+
+    async def query(self):
+        """(PM2.5, PM10) in ug/m3"""
+        return self._values(await self._request(self.CMD_QUERY, (), self.DATA))
+
+    async def read(self):
+        """(PM2.5, PM10) of the next frame the sensor pushes in active reporting mode"""
+        return self._values(await self._frame(self.DATA))
+
+
+class PMS5003(_UARTSensor):
+    """Plantower PMS5003 in active mode, as pms5003.PMS5003
+
+    The sensor pushes a frame about every second. The enable and reset pins
+    are left as they are: the pms5003 library (or the pull-ups on the board)
+    keep the sensor running.
+    """
+
+    def __init__(self, path='/dev/ttyAMA0', timeout=5.0, name='pms5003'):
+        super().__init__(path, PMS5003Decoder(name), timeout)
+
+    async def read(self) -> PMS5003Data:
+        return await self._next_frame(self._deadline())
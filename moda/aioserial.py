@@ -0,0 +1,115 @@
+"""Non-blocking serial ports for asyncio
+
+SerialPort opens a UART (or pty) raw and non-blocking and waits for data
+with event loop readiness (add_reader) instead of parking a thread in
+read(). Every read takes its own timeout; a read that times out or is
+cancelled leaves whatever arrived in the buffer, for the next read or
+reset_input_buffer(). Frame sync is left to the decoders in moda.frames.
+"""
+
+import asyncio
+import os
+import termios
+
+BAUDRATES = {
+    1200: termios.B1200,
+    2400: termios.B2400,
+    4800: termios.B4800,
+    9600: termios.B9600,
+    19200: termios.B19200,
+    38400: termios.B38400,
+    57600: termios.B57600,
+    115200: termios.B115200,
+}
+
+
+class SerialPort:
+    def __init__(self, path, baudrate=9600):
+        """Open path raw at baudrate, 8N1 without flow control"""
+        self.path = path
+        self.baudrate = baudrate
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        self._buffer = bytearray()
+
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(self.fd)
+        iflag = 0
+        oflag = 0
+        lflag = 0
+        cflag = (cflag & ~(termios.CSIZE | termios.PARENB | termios.CSTOPB | termios.CRTSCTS)) | termios.CS8 | termios.CREAD | termios.CLOCAL
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+        speed = BAUDRATES[baudrate]
+        termios.tcsetattr(self.fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+        termios.tcflush(self.fd, termios.TCIOFLUSH)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_available(self):
+        try:
+            while True:
+                data = os.read(self.fd, 4096)
+                if not data:
+                    return
+                self._buffer += data
+        except BlockingIOError:
+            pass
+
+    async def _wait_readable(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(self.fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(self.fd)
+
+    async def _fill(self, count):
+        self._read_available()
+        while len(self._buffer) < count:
+            await self._wait_readable()
+            self._read_available()
+
+    async def read(self, count, timeout=None) -> bytes:
+        """Exactly count bytes, raising asyncio.TimeoutError after timeout seconds"""
+        await asyncio.wait_for(self._fill(count), timeout)
+        data = bytes(self._buffer[:count])
+        del self._buffer[:count]
+        return data
+
+    async def read_some(self, timeout=None) -> bytes:
+        """Everything received so far, waiting up to timeout seconds for at least a byte"""
+        await asyncio.wait_for(self._fill(1), timeout)
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def reset_input_buffer(self):
+        """Drop anything received so far, before sending a request"""
+        self._buffer.clear()
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    async def write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.fd, view)
+            except BlockingIOError:
+                written = 0
+            view = view[written:]
+            if view:
+                loop = asyncio.get_running_loop()
+                ready = loop.create_future()
+                loop.add_writer(self.fd, lambda: ready.done() or ready.set_result(None))
+                try:
+                    await ready
+                finally:
+                    loop.remove_writer(self.fd)
@@ -0,0 +1,177 @@
+"""Air quality indices from particulate matter concentrations
+
+Table driven, memoized replacement for python-aqi's to_aqi() for PM2.5
+and PM10, on the US EPA AQI and the European CAQI (hourly grid).
+
+A concentration is first truncated to the resolution of its breakpoints
+(0.1 ug/m3 for PM2.5 and 1 ug/m3 for EPA PM10) exactly, as python-aqi's
+Decimal(float).quantize(ROUND_DOWN) does, so EPA results match python-aqi
+for every input it accepts. The truncated value, an integer key, picks its
+segment from precomputed breakpoint arrays with bisect; the index for
+each key is worked out once with python-aqi's Decimal formula and kept in
+a bounded memo cache. Sensors report in steps of 0.1 ug/m3, so the cache
+turns almost every call into a dict lookup.
+
+Above its last breakpoint EPA is capped at 500 (python-aqi raises
+IndexError there) and CAQI carries on along its last segment.
+"""
+
+import bisect
+import functools
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_EVEN
+from fractions import Fraction
+
+POLLUTANT_PM25 = 'pm25'
+POLLUTANT_PM10 = 'pm10'
+
+# Keys worked out for all scales and pollutants, a few days of distinct readings
+CACHE_SIZE = 8192
+
+Level = namedtuple('Level', 'name color')
+
+
+class Scale:
+    def __init__(self, name, breakpoints, levels, extend=False):
+        """An index defined by linear segments between breakpoints
+
+        breakpoints maps a pollutant to its resolution and its segments
+        as (low, high concentration, low, high index) strings; levels is
+        a list of (highest index, name, (r, g, b)), the last one open. A
+        scale with extend carries on along its last segment instead of
+        capping at its top.
+        """
+        self.name = name
+        self.extend = extend
+        self.pollutants = {}
+        for pollutant, (resolution, segments) in breakpoints.items():
+            scale = int(1 / Decimal(resolution))
+            lows = [int(Decimal(low) * scale) for low, _, _, _ in segments]
+            top = int(Decimal(segments[-1][1]) * scale)
+            formulas = [
+                (Decimal(low), int(index_low), (int(index_high) - int(index_low)) / (Decimal(high) - Decimal(low)))
+                for low, high, index_low, index_high in segments
+            ]
+            self.pollutants[pollutant] = (scale, lows, top, formulas)
+        self.bounds = [high for high, _, _ in levels[:-1]]
+        self.levels = [Level(name, color) for _, name, color in levels]
+
+    def __repr__(self):
+        return 'Scale({!r})'.format(self.name)
+
+    def key(self, pollutant, concentration) -> int:
+        """concentration truncated to the resolution of pollutant, in steps of it"""
+        try:
+            numerator, denominator = concentration.as_integer_ratio()
+        except AttributeError:
+            # Strings, as returned by the Prometheus API
+            numerator, denominator = Fraction(concentration).as_integer_ratio()
+        if numerator < 0:
+            raise ValueError("Negative {} concentration {}".format(pollutant, concentration))
+        return numerator * self.pollutants[pollutant][0] // denominator
+
+    def iaqi(self, pollutant, concentration) -> int:
+        """Index for one pollutant"""
+        return _iaqi(self, pollutant, self.key(pollutant, concentration))
+
+    def aqi(self, pm25=None, pm10=None) -> int:
+        """Index for the pollutants given: the highest of theirs"""
+        values = []
+        if pm25 is not None:
+            values.append(self.iaqi(POLLUTANT_PM25, pm25))
+        if pm10 is not None:
+            values.append(self.iaqi(POLLUTANT_PM10, pm10))
+        return max(values)
+
+    def level(self, index) -> Level:
+        return self.levels[bisect.bisect_left(self.bounds, index)]
+
+    def iaqi_array(self, pollutant, concentrations):
+        """Index for every concentration of an array, NaN where it is NaN
+
+        Each distinct value is looked up once, so recomputing a history
+        costs about as many scalar calls as it has distinct readings.
+        """
+        import numpy as np
+        concentrations = np.asarray(concentrations, dtype=float)
+        result = np.full(concentrations.shape, np.nan)
+        valid = np.isfinite(concentrations)
+        values, inverse = np.unique(concentrations[valid], return_inverse=True)
+        table = np.fromiter((self.iaqi(pollutant, value) for value in values.tolist()), float, len(values))
+        result[valid] = table[inverse.reshape(-1)]
+        return result
+
+    def aqi_array(self, pm25=None, pm10=None):
+        """aqi() over arrays of readings, NaN where every given one is NaN"""
+        import numpy as np
+        arrays = []
+        if pm25 is not None:
+            arrays.append(self.iaqi_array(POLLUTANT_PM25, pm25))
+        if pm10 is not None:
+            arrays.append(self.iaqi_array(POLLUTANT_PM10, pm10))
+        return functools.reduce(np.fmax, arrays)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _iaqi(scale, pollutant, key):
+    steps, lows, top, formulas = scale.pollutants[pollutant]
+    if key > top and not scale.extend:
+        key = top
+    low, index_low, slope = formulas[bisect.bisect_right(lows, key) - 1]
+    # python-aqi's formula, with the same Decimal rounding
+    value = slope * (Decimal(key) / steps - low) + index_low
+    return int(value.quantize(Decimal('1.'), rounding=ROUND_HALF_EVEN))
+
+
+EPA = Scale('EPA', {
+    POLLUTANT_PM25: ('.1', [
+        ('0.0', '12.0', 0, 50),
+        ('12.1', '35.4', 51, 100),
+        ('35.5', '55.4', 101, 150),
+        ('55.5', '150.4', 151, 200),
+        ('150.5', '250.4', 201, 300),
+        ('250.5', '350.4', 301, 400),
+        ('350.5', '500.4', 401, 500),
+    ]),
+    POLLUTANT_PM10: ('1', [
+        ('0', '54', 0, 50),
+        ('55', '154', 51, 100),
+        ('155', '254', 101, 150),
+        ('255', '354', 151, 200),
+        ('355', '424', 201, 300),
+        ('425', '504', 301, 400),
+        ('505', '604', 401, 500),
+    ]),
+}, [
+    (50, 'Good', (0, 228, 0)),
+    (100, 'Moderate', (255, 255, 0)),
+    (150, 'Unhealthy for Sensitive Groups', (255, 126, 0)),
+    (200, 'Unhealthy', (255, 0, 0)),
+    (300, 'Very Unhealthy', (143, 63, 151)),
+    (None, 'Hazardous', (126, 0, 35)),
+])
+
+# Common Air Quality Index, hourly background grid
+CAQI = Scale('CAQI', {
+    POLLUTANT_PM25: ('.1', [
+        ('0', '15', 0, 25),
+        ('15', '30', 25, 50),
+        ('30', '55', 50, 75),
+        ('55', '110', 75, 100),
+    ]),
+    POLLUTANT_PM10: ('.1', [
+        ('0', '25', 0, 25),
+        ('25', '50', 25, 50),
+        ('50', '90', 50, 75),
+        ('90', '180', 75, 100),
+    ]),
+}, [
+    (25, 'Very low', (121, 188, 106)),
+    (50, 'Low', (187, 207, 76)),
+    (75, 'Medium', (238, 194, 11)),
+    (100, 'High', (242, 147, 5)),
+    (None, 'Very high', (232, 65, 111)),
+], extend=True)
+
+# By the country codes of sds011-exporter's --country
+SCALES = {'US': EPA, 'EU': CAQI}
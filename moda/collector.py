@@ -0,0 +1,102 @@
+"""Read-on-scrape Prometheus collector
+
+Instead of polling a sensor on a fixed loop, a ScrapeCollector reads it
+when Prometheus scrapes. The reading is cached for ttl seconds, measured
+from when the read started, so a scrape never sees a value older than the
+TTL. Scrapes that arrive while a read is in flight (an HA Prometheus pair
+scraping at the same moment, say) wait for that read instead of starting
+their own. When nothing scrapes, nothing touches the bus.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from prometheus_client import Counter, Summary
+from prometheus_client.core import GaugeMetricFamily
+
+READ_TIME = Summary('sensor_read_seconds', 'Time taken by on-scrape sensor reads', ['sensor'])
+SCRAPES = Counter('sensor_scrapes', 'Scrapes served by read-on-scrape collectors, by how they were served', ['sensor', 'result'])
+
+
+class _Flight:
+    __slots__ = ('started', 'done', 'values')
+
+    def __init__(self, started):
+        self.started = started
+        self.done = threading.Event()
+        self.values = None
+
+
+class ScrapeCollector:
+    def __init__(self, name, read, metrics, ttl=1.0, clock=time.monotonic):
+        """Collector calling read() at most once per ttl seconds
+
+        read returns a dict of field values. metrics is a sequence of (field,
+        metric name, help) tuples as for moda.snapshot.SnapshotCollector;
+        fields missing from the reading, or NaN, are left out.
+        """
+        self.name = name
+        self.read = read
+        self.metrics = tuple(metrics)
+        self.ttl = ttl
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._values = None
+        self._taken = 0.0
+        self._flight = None
+
+        for result in ('read', 'cached', 'coalesced', 'error'):
+            SCRAPES.labels(name, result)
+
+    def values(self):
+        """The cached reading if it is fresh enough, otherwise a new one, None if the read failed"""
+        with self._lock:
+            now = self.clock()
+            if self._values is not None and now - self._taken < self.ttl:
+                SCRAPES.labels(self.name, 'cached').inc()
+                return self._values
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight(now)
+
+        if not leader:
+            flight.done.wait()
+            SCRAPES.labels(self.name, 'coalesced').inc()
+            return flight.values
+
+        try:
+            with READ_TIME.labels(self.name).time():
+                values = self.read()
+            SCRAPES.labels(self.name, 'read').inc()
+        except Exception as exception:
+            logging.warning('Reading {} failed: {}'.format(self.name, exception))
+            SCRAPES.labels(self.name, 'error').inc()
+            values = None
+
+        with self._lock:
+            if values is not None:
+                self._values = values
+                self._taken = flight.started
+            self._flight = None
+        flight.values = values
+        flight.done.set()
+        return values
+
+    def describe(self):
+        # Without describe() the registry would collect, and so read the sensor, on register()
+        return [GaugeMetricFamily(name, documentation) for _, name, documentation in self.metrics]
+
+    def collect(self):
+        values = self.values() or {}
+        families = []
+        for field, name, documentation in self.metrics:
+            family = GaugeMetricFamily(name, documentation)
+            value = values.get(field)
+            if value is not None and not math.isnan(value):
+                family.add_metric([], value)
+            families.append(family)
+        return families
@@ -0,0 +1,134 @@
+"""Sensor drivers for the moda agent
+
+A driver module defines a Driver subclass named Driver. The agent
+creates one per config section, calls setup() once and then poll() every
+interval seconds, or in a loop on its own thread for blocking drivers
+(ones that wait on a serial port). Hardware libraries are imported in
+setup(), so a config only pays for the sensors it lists. close() is
+called when the agent stops.
+
+With a window option (seconds), every reading published also goes into a
+ring buffer and the min, max, mean, stddev and p95 of each field over the
+last window are exported next to the instant value (see moda.window).
+
+Serial drivers may also define an apoll() coroutine. With asyncio on in
+the agent config, use_asyncio is set before setup() and apoll() is awaited
+in a loop on the agent's event loop instead of giving the driver a thread.
+"""
+
+import importlib
+import threading
+
+from moda.snapshot import SnapshotStore, SnapshotCollector
+
+
+class SharedI2C:
+    def __init__(self, bus=1):
+        """One I2C bus for every driver in the process
+
+        Drivers hold lock for the whole of a read, so transactions from
+        different drivers (and threads) never interleave. The Blinka and
+        smbus handles are opened on first use.
+        """
+        self.number = bus
+        self.lock = threading.RLock()
+        self._bus = None
+        self._smbus = None
+
+    @property
+    def bus(self):
+        """busio.I2C handle, for the Adafruit CircuitPython drivers"""
+        with self.lock:
+            if self._bus is None:
+                import board
+                self._bus = board.I2C()
+            return self._bus
+
+    @property
+    def smbus(self):
+        """SMBus handle, for the Pimoroni drivers"""
+        with self.lock:
+            if self._smbus is None:
+                try:
+                    from smbus2 import SMBus
+                except ImportError:
+                    from smbus import SMBus
+                self._smbus = SMBus(self.number)
+            return self._smbus
+
+
+class Driver:
+    # (field, metric name, help) tuples, as for moda.snapshot.SnapshotCollector
+    METRICS = ()
+    interval = 5.0
+    blocking = False
+    use_asyncio = False
+
+    def __init__(self, name, options, i2c):
+        """Driver for the sensor configured in one config section
+
+        options is the configparser section; interval and prefix (put in
+        front of every metric name) are understood by all drivers, window
+        by those that publish() their readings.
+        """
+        self.name = name
+        self.options = options
+        self.i2c = i2c
+        self.interval = options.getfloat('interval', fallback=self.interval)
+        self.prefix = options.get('prefix', '')
+        self.store = SnapshotStore(field for field, _, _ in self.METRICS)
+        self.window = options.getfloat('window', fallback=0)
+        self.samples = None
+        if self.window:
+            from moda.window import WindowBuffer
+            self.samples = WindowBuffer(field for field, _, _ in self.METRICS)
+
+    def setup(self):
+        """Open the sensor, called once before the first poll"""
+
+    def read(self) -> dict:
+        raise NotImplementedError
+
+    def close(self):
+        """Save or release what the driver holds, called once when the agent stops"""
+
+    def publish(self, values):
+        if values:
+            self.store.update(values)
+            self.store.publish()
+            if self.samples is not None:
+                self.samples.append(values)
+
+    def poll(self):
+        """Read the sensor and publish its values"""
+        self.publish(self.read())
+
+    def metrics(self):
+        return [(field, self.prefix + name, documentation) for field, name, documentation in self.METRICS]
+
+    def collector(self):
+        return SnapshotCollector(self.metrics(), self.store)
+
+    def collectors(self):
+        """Every collector the agent registers for this driver"""
+        collectors = [self.collector()]
+        if self.samples is not None:
+            from moda.window import WindowCollector
+            collectors.append(WindowCollector(self.metrics(), [self.samples], self.window))
+        return collectors
+
+
+def load_driver(name, options, i2c) -> Driver:
+    """Create the driver for a config section
+
+    The driver option names a module in moda.drivers or any other importable
+    module (a plugin on the agent's path); it defaults to the section name.
+    """
+    module_name = options.get('driver', name)
+    try:
+        module = importlib.import_module('moda.drivers.' + module_name)
+    except ModuleNotFoundError as exception:
+        if exception.name != 'moda.drivers.' + module_name:
+            raise
+        module = importlib.import_module(module_name)
+    return module.Driver(name, options, i2c)
@@ -0,0 +1,42 @@
+"""APDS9960 colour and light sensor, as apds9960_exporter"""
+
+import time
+
+from moda.drivers import Driver as BaseDriver
+
+
+class Driver(BaseDriver):
+    METRICS = (
+        ('red', 'apds9960_red', 'Red, value'),
+        ('green', 'apds9960_green', 'Green, value'),
+        ('blue', 'apds9960_blue', 'Blue, value'),
+        ('clear', 'apds9960_clear', 'Clear, value'),
+        ('color_temp', 'apds9960_color_temp', 'Color Temp, kelvin'),
+        ('lux', 'apds9960_lux', 'Lux, value'),
+    )
+    interval = 1.5
+
+    def setup(self):
+        from adafruit_apds9960.apds9960 import APDS9960
+        from adafruit_apds9960 import colorutility
+        self.colorutility = colorutility
+        with self.i2c.lock:
+            self.apds = APDS9960(self.i2c.bus)
+            self.apds.enable_color = True
+
+    def read(self):
+        while True:
+            with self.i2c.lock:
+                if self.apds.color_data_ready:
+                    r, g, b, c = self.apds.color_data
+                    break
+            time.sleep(0.005)
+
+        return {
+            'red': r,
+            'green': g,
+            'blue': b,
+            'clear': c,
+            'color_temp': self.colorutility.calculate_color_temperature(r, g, b),
+            'lux': self.colorutility.calculate_lux(r, g, b),
+        }
@@ -0,0 +1,22 @@
+"""BMP390 temperature and pressure sensor, as bmp390-exporter"""
+
+from moda.drivers import Driver as BaseDriver
+
+
+class Driver(BaseDriver):
+    METRICS = (
+        ('temp', 'bmp390_temp', 'temp level, ppm'),
+        ('pressure', 'bmp390_pressure', 'Total Volatile Organic Compounds level, ppm'),
+    )
+    interval = 3.0
+
+    def setup(self):
+        import adafruit_bmp3xx
+        with self.i2c.lock:
+            self.bmp = adafruit_bmp3xx.BMP3XX_I2C(self.i2c.bus, int(self.options.get('address', '0x76'), 0))
+            self.bmp.pressure_oversampling = 8
+            self.bmp.temperature_oversampling = 2
+
+    def read(self):
+        with self.i2c.lock:
+            return {'temp': self.bmp.temperature, 'pressure': self.bmp.pressure}
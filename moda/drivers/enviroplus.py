@@ -0,0 +1,76 @@
+"""BME280, LTR559 and gas sensor of the Pimoroni Enviro+, as enviroplus-exporter
+
+The PMS5003 is a separate, blocking driver (pms5003). The BME280 and LTR559
+use the shared SMBus handle. The gas sensor's ADS1015 can't: enviroplus.gas
+opens its own handle in gas.setup() and takes none. It only talks on the bus
+from read(), under the shared lock like the rest, so it never interleaves
+with another driver.
+"""
+
+import logging
+
+from moda.drivers import Driver as BaseDriver
+
+
+def get_cpu_temperature():
+    with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+        return int(f.read()) / 1000.0
+
+
+class Driver(BaseDriver):
+    METRICS = (
+        ('temperature', 'temperature', 'Temperature measured (*C)'),
+        ('pressure', 'pressure', 'Pressure measured (hPa)'),
+        ('humidity', 'humidity', 'Relative humidity measured (%)'),
+        ('oxidising', 'oxidising', 'Mostly nitrogen dioxide but could include NO and Hydrogen (Ohms)'),
+        ('reducing', 'reducing', 'Mostly carbon monoxide but could include H2S, Ammonia, Ethanol, Hydrogen, Methane, Propane, Iso-butane (Ohms)'),
+        ('nh3', 'NH3', 'mostly Ammonia but could also include Hydrogen, Ethanol, Propane, Iso-butane (Ohms)'),
+        ('lux', 'lux', 'current ambient light level (lux)'),
+        ('proximity', 'proximity', 'proximity, with larger numbers being closer proximity and vice versa'),
+    )
+
+    def setup(self):
+        from bme280 import BME280
+        try:
+            # Transitional fix for breaking change in LTR559
+            from ltr559 import LTR559
+            self.ltr559 = LTR559(i2c_dev=self.i2c.smbus)
+        except ImportError:
+            # The old module-level API opens its own handle
+            import ltr559
+            self.ltr559 = ltr559
+        self.bme280 = BME280(i2c_dev=self.i2c.smbus)
+
+        # Compensation for heat leaking from the Pi, see enviroplus-exporter --factor
+        self.factor = self.options.getfloat('factor', fallback=0)
+        # An Enviro (not Enviro+) has no gas sensor
+        self.gas = None
+        if not self.options.getboolean('enviro', fallback=False):
+            # Opens its own SMBus handle, see the module docstring
+            from enviroplus import gas
+            self.gas = gas
+
+    def read(self):
+        values = {}
+        with self.i2c.lock:
+            try:
+                temperature = self.bme280.get_temperature()
+                values['pressure'] = self.bme280.get_pressure()
+                values['humidity'] = self.bme280.get_humidity()
+                if self.factor:
+                    temperature -= (get_cpu_temperature() - temperature) / self.factor
+                values['temperature'] = temperature
+            except IOError:
+                logging.error("Could not get weather readings")
+            try:
+                values['lux'] = self.ltr559.get_lux()
+                values['proximity'] = self.ltr559.get_proximity()
+            except IOError:
+                logging.error("Could not get lux and proximity readings")
+            if self.gas is not None:
+                try:
+                    readings = self.gas.read_all()
+                    values.update(oxidising=readings.oxidising, reducing=readings.reducing, nh3=readings.nh3)
+                except IOError:
+                    logging.error("Could not get gas readings")
+        return values
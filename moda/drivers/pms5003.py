@@ -0,0 +1,54 @@
+"""PMS5003 particulate sensor of the Enviro+, as enviroplus-exporter"""
+
+import asyncio
+import logging
+
+from moda.drivers import Driver as BaseDriver
+
+
+class Driver(BaseDriver):
+    METRICS = (
+        ('pm1', 'PM1', 'Particulate Matter of diameter less than 1 micron. Measured in micrograms per cubic metre (ug/m3)'),
+        ('pm25', 'PM25', 'Particulate Matter of diameter less than 2.5 microns. Measured in micrograms per cubic metre (ug/m3)'),
+        ('pm10', 'PM10', 'Particulate Matter of diameter less than 10 microns. Measured in micrograms per cubic metre (ug/m3)'),
+        ('aqi', 'AQI', 'AQI value'),
+    )
+    # read() blocks until the sensor pushes its next frame
+    blocking = True
+
+    def setup(self):
+        from moda.airquality import SCALES
+        self.scale = SCALES[self.options.get('country', 'US')]
+        if self.use_asyncio:
+            from moda.aiodevices import PMS5003
+            self.timeout_error = asyncio.TimeoutError
+            self.pms5003 = PMS5003(self.options.get('device', '/dev/ttyAMA0'), name=self.name)
+        else:
+            from pms5003 import PMS5003
+            from moda.frames import SerialFrames, PMS5003Decoder
+            self.timeout_error = TimeoutError
+            # The library sets up the pins and the port, moda.frames decodes the frames
+            self.pms5003 = SerialFrames(PMS5003()._serial, PMS5003Decoder(self.name))
+
+    def values(self, data):
+        pm25 = data.pm_ug_per_m3(2.5)
+        pm10 = data.pm_ug_per_m3(10)
+        return {
+            'pm1': data.pm_ug_per_m3(1.0),
+            'pm25': pm25,
+            'pm10': pm10,
+            'aqi': float(self.scale.aqi(pm25, pm10)),
+        }
+
+    def read(self):
+        try:
+            return self.values(self.pms5003.read())
+        except self.timeout_error:
+            logging.warning("Failed to read PMS5003")
+            return None
+
+    async def apoll(self):
+        try:
+            self.publish(self.values(await self.pms5003.read()))
+        except self.timeout_error:
+            logging.warning("Failed to read PMS5003")
@@ -0,0 +1,97 @@
+"""PZEM energy meters on an RS485 bus, as pzem-exporter
+
+Needs the pzem-exporter directory (bus.py, pzem.py) on the agent's path.
+With a ledger option (a directory), each meter also keeps its hourly,
+daily and monthly energy totals there (see moda.energy).
+"""
+
+import logging
+import os
+import time
+
+from prometheus_client import Counter, Gauge
+
+from moda.drivers import Driver as BaseDriver
+from moda.energy import EnergyLedger, LedgerCollector
+from moda.snapshot import SnapshotStore, SnapshotCollector
+
+UP = Gauge('pzem_up', 'Whether the meter answered its last poll (boolean)', ['slave'])
+ERRORS = Counter('pzem_errors', 'Polls the meter did not answer', ['slave'])
+
+
+class Driver(BaseDriver):
+    METRICS = (
+        ('volts', 'volts', 'Volts measured (V)'),
+        ('amps', 'amps', 'Amps measured in amps (A)'),
+        ('watts', 'watts', 'Power measured (W)'),
+        ('energy', 'energy', 'Energy consumption measured (W-hr)'),
+        ('frequency', 'frequency', 'AC frequency measured (Hz)'),
+        ('power_factor', 'power_factor', 'Power effeciency (%)'),
+        ('alarm', 'alarm', 'alarm status (boolean)'),
+    )
+    # The bus keeps its own per-slave schedule
+    blocking = True
+
+    def setup(self):
+        if self.samples is not None:
+            # One buffer would mix the meters, and the window stats carry no slave label
+            logging.warning("pzem doesn't support the window option, ignoring it")
+            self.samples = None
+        if self.use_asyncio:
+            from pzem_async import AsyncBus as Bus
+        else:
+            from bus import Bus
+        self.bus = Bus(self.options.get('device', '/dev/ttyUSB0'),
+                       gap=self.options.getfloat('gap', fallback=0.005),
+                       timeout=self.options.getfloat('timeout', fallback=0.1))
+        self.stores = {}
+        self.ledgers = {}
+        ledger = self.options.get('ledger')
+        if ledger:
+            os.makedirs(ledger, exist_ok=True)
+        for slave in self.options.get('slaves', '1').split(','):
+            address, _, priority = slave.strip().partition(':')
+            self.bus.add(int(address), interval=self.interval, priority=int(priority or 0))
+            self.stores[(str(int(address)),)] = SnapshotStore(field for field, _, _ in self.METRICS)
+            if ledger:
+                self.ledgers[(str(int(address)),)] = EnergyLedger(os.path.join(ledger, 'pzem-{}.json'.format(int(address))))
+
+    def collector(self):
+        return SnapshotCollector(self.metrics(), self.stores, ['slave'])
+
+    def collectors(self):
+        collectors = super().collectors()
+        if self.ledgers:
+            collectors.append(LedgerCollector(self.ledgers, ['slave'], prefix=self.prefix + 'energy'))
+        return collectors
+
+    def poll(self):
+        """Poll the next slave that is due, or wait for it"""
+        slave, due = self.bus.next_slave(time.monotonic())
+        if slave is None:
+            time.sleep(max(0.0, due - time.monotonic()))
+            return
+
+        self.on_reading(slave, self.bus.poll(slave))
+
+    async def apoll(self):
+        await self.bus.step(self.on_reading)
+
+    def on_reading(self, slave, reading):
+        label = str(slave.address)
+        if reading is None:
+            UP.labels(label).set(0)
+            ERRORS.labels(label).inc()
+            return
+        UP.labels(label).set(1)
+        store = self.stores[(label,)]
+        store.update(dict(reading, alarm=reading["alarm_status"]))
+        ledger = self.ledgers.get((label,))
+        if ledger is not None:
+            ledger.update(time.time(), reading["watts"], reading["energy"])
+        store.publish(reading["timestamp"])
+
+    def close(self):
+        # Save what was booked since the last periodic save
+        for ledger in self.ledgers.values():
+            ledger.close()
@@ -0,0 +1,77 @@
+"""SDS011 particulate sensor on a serial port, as sds011-exporter"""
+
+import asyncio
+import time
+
+from moda.drivers import Driver as BaseDriver
+
+
+class Driver(BaseDriver):
+    METRICS = (
+        ('pm25', 'PM25', 'Particulate Matter of diameter less than 2.5 microns. Measured in micrograms per cubic metre (ug/m3)'),
+        ('pm10', 'PM10', 'Particulate Matter of diameter less than 10 microns. Measured in micrograms per cubic metre (ug/m3)'),
+        ('aqi', 'AQI', 'AQI value'),
+    )
+    interval = 15.0
+    # A cycle wakes the fan, waits for it and takes several measures
+    blocking = True
+
+    def setup(self):
+        from moda.airquality import SCALES
+        self.scale = SCALES[self.options.get('country', 'US')]
+        if self.use_asyncio:
+            from moda.aiodevices import SDS011
+            self.sensor = SDS011(self.options.get('device', '/dev/ttyUSB0'), name=self.name)
+        else:
+            from sds011 import SDS011
+            self.sensor = SDS011(self.options.get('device', '/dev/ttyUSB0'))
+        self.measures = self.options.getint('measures', fallback=3)
+        self.start_delay = self.options.getfloat('start_delay', fallback=1)
+        self.operation_delay = self.options.getfloat('operation_delay', fallback=10)
+
+    def values(self, pm25_total, pm10_total):
+        pm25 = round(pm25_total / self.measures, 1)
+        pm10 = round(pm10_total / self.measures, 1)
+        return {
+            'pm25': pm25,
+            'pm10': pm10,
+            'aqi': float(self.scale.aqi(pm25, pm10)),
+        }
+
+    def read(self):
+        self.sensor.sleep(sleep=False)
+        time.sleep(self.start_delay)
+
+        pm25 = pm10 = 0.0
+        for _ in range(self.measures):
+            x = self.sensor.query()
+            pm25 += x[0]
+            pm10 += x[1]
+            time.sleep(self.operation_delay)
+
+        self.sensor.sleep(sleep=True)
+        time.sleep(self.operation_delay)
+        return self.values(pm25, pm10)
+
+    def poll(self):
+        super().poll()
+        time.sleep(self.interval)
+
+    async def aread(self):
+        await self.sensor.sleep(sleep=False)
+        await asyncio.sleep(self.start_delay)
+
+        pm25 = pm10 = 0.0
+        for _ in range(self.measures):
+            x = await self.sensor.query()
+            pm25 += x[0]
+            pm10 += x[1]
+            await asyncio.sleep(self.operation_delay)
+
+        await self.sensor.sleep(sleep=True)
+        await asyncio.sleep(self.operation_delay)
+        return self.values(pm25, pm10)
+
+    async def apoll(self):
+        self.publish(await self.aread())
+        await asyncio.sleep(self.interval)
@@ -0,0 +1,23 @@
+"""SGP30 eCO2 and TVOC sensor, as sgp30-exporter"""
+
+from moda.drivers import Driver as BaseDriver
+
+
+class Driver(BaseDriver):
+    METRICS = (
+        ('eco2', 'sgp30_eco2', 'CO2 level, ppm'),
+        ('tvoc', 'sgp30_tvoc', 'Total Volatile Organic Compounds level, ppm'),
+    )
+    interval = 3.0
+
+    def setup(self):
+        import adafruit_sgp30
+        with self.i2c.lock:
+            self.sgp30 = adafruit_sgp30.Adafruit_SGP30(self.i2c.bus)
+            self.sgp30.iaq_init()
+            self.sgp30.set_iaq_baseline(0x8973, 0x8AAE)
+
+    def read(self):
+        with self.i2c.lock:
+            eco2, tvoc = self.sgp30.iaq_measure()
+        return {'eco2': eco2, 'tvoc': tvoc}
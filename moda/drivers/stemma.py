@@ -0,0 +1,46 @@
+"""CCS811, BME680 and SGP40 STEMMA boards, as stemma-exporter"""
+
+import time
+
+from moda.drivers import Driver as BaseDriver
+
+
+class Driver(BaseDriver):
+    METRICS = (
+        ('co2', 'ccs811_co2', 'CO2 level, ppm'),
+        ('tvoc', 'ccs811_tvoc', 'Total Volatile Organic Compounds level, ppm'),
+        ('temperature', 'bme680_temp', 'Air Temperature, C'),
+        ('humidity', 'bme680_humidity', 'Relative Humidity %'),
+        ('voc_index', 'sgp40_voc_index', 'Volatile Organic Compounds Index, int'),
+        ('compensated_raw_gas', 'sgp40_raw_gas', 'Compensated voc index resistance readings, ohms'),
+    )
+    interval = 2.0
+
+    def setup(self):
+        import adafruit_ccs811
+        import adafruit_bme680
+        import adafruit_sgp40
+        with self.i2c.lock:
+            self.ccs811 = adafruit_ccs811.CCS811(self.i2c.bus)
+            self.bme680 = adafruit_bme680.Adafruit_BME680_I2C(self.i2c.bus, debug=False)
+            self.sgp40 = adafruit_sgp40.SGP40(self.i2c.bus)
+
+        # Wait for the sensor to be ready, without holding the bus meanwhile
+        while True:
+            with self.i2c.lock:
+                if self.ccs811.data_ready:
+                    break
+            time.sleep(0.1)
+
+    def read(self):
+        with self.i2c.lock:
+            temperature = self.bme680.temperature
+            humidity = self.bme680.relative_humidity
+            return {
+                'co2': self.ccs811.eco2,
+                'tvoc': self.ccs811.tvoc,
+                'temperature': temperature,
+                'humidity': humidity,
+                'voc_index': self.sgp40.measure_index(temperature=temperature, relative_humidity=humidity),
+                'compensated_raw_gas': self.sgp40.measure_raw(temperature=temperature, relative_humidity=humidity),
+            }
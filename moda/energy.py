@@ -0,0 +1,194 @@
+"""Energy accounting on the device, from a power meter's readings
+
+An EnergyLedger books the energy between every two readings of a meter
+into hourly, daily and monthly totals (local time), so "kWh today" is a
+dict lookup instead of a PromQL increase() over a long range.
+
+The energy between two readings is the trapezoid of their power. That
+splits consumption finely between periods, but drifts; the meter's own
+energy register counts exactly, in whole Wh. So the register is the
+reference: whenever the energy booked falls more than a register step
+behind what the register counted, the difference is booked too; when it
+runs ahead, the following intervals are booked short (never below zero,
+so no total goes down) until the register catches up. A register going
+backwards was reset (kwh-reset.py) or wrapped at its top; the interval
+then falls back to the trapezoid, or the wrapped difference. Over a gap
+in the readings (a restart) the register counts what was missed and is
+booked whole.
+
+The ledger is saved as a small JSON file, written to a temporary file,
+synced and renamed over the old one, so a power cut leaves either the
+previous or the new ledger. It is saved every save_interval seconds: the
+register catches up whatever a crash lost on the next reading.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# PZEM-004T/014/016 registers count to 9999.99 kWh, then start over
+PZEM_WRAP = 10000000
+
+PERIODS = {
+    'hour': ('%Y-%m-%dT%H', 7 * 24),
+    'day': ('%Y-%m-%d', 2 * 366),
+    'month': ('%Y-%m', None),
+}
+
+
+def period_key(period, timestamp) -> str:
+    return time.strftime(PERIODS[period][0], time.localtime(timestamp))
+
+
+class EnergyLedger:
+    def __init__(self, path=None, wrap=PZEM_WRAP, resolution=1.0, gap=300, save_interval=60):
+        """Ledger of a meter with an energy register counting Wh up to wrap
+
+        resolution is the register step (Wh); readings further apart than
+        gap seconds are not integrated. path is the ledger file, loaded if
+        it exists.
+        """
+        self.path = path
+        self.wrap = wrap
+        self.resolution = resolution
+        self.gap = gap
+        self.save_interval = save_interval
+        self.totals = {period: {} for period in PERIODS}
+        # Energy booked and counted by the register since the ledger started (Wh)
+        self.booked = 0.0
+        self.counted = 0.0
+        self.resets = 0
+        self.wraps = 0
+        # Previous reading: timestamp, watts, register
+        self.last = None
+        self._saved = 0.0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as f:
+            state = json.load(f)
+        self.totals = {period: dict(state['totals'].get(period, {})) for period in PERIODS}
+        self.booked = state['booked']
+        self.counted = state['counted']
+        self.resets = state.get('resets', 0)
+        self.wraps = state.get('wraps', 0)
+        self.last = tuple(state['last']) if state.get('last') else None
+
+    def save(self):
+        if not self.path:
+            return
+        state = {
+            'totals': self.totals, 'booked': self.booked, 'counted': self.counted,
+            'resets': self.resets, 'wraps': self.wraps, 'last': self.last,
+        }
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            logging.warning("Could not save the energy ledger {}: {}".format(self.path, e))
+
+    def _register_delta(self, register, expected):
+        """Wh the register counted since the last reading, given expected Wh"""
+        previous = self.last[2]
+        if register >= previous:
+            return register - previous
+        wrapped = self.wrap - previous + register
+        # A wrap lands close to what the meter should have counted
+        if abs(wrapped - expected) <= max(10 * self.resolution, expected):
+            self.wraps += 1
+            logging.info("Energy register wrapped from {} to {} Wh".format(previous, register))
+            return wrapped
+        self.resets += 1
+        logging.info("Energy register reset from {} to {} Wh".format(previous, register))
+        return None
+
+    def _book(self, timestamp, wh):
+        self.booked += wh
+        for period, (_, keep) in PERIODS.items():
+            totals = self.totals[period]
+            key = period_key(period, timestamp)
+            totals[key] = totals.get(key, 0.0) + wh
+            if keep is not None and len(totals) > keep:
+                # Keys sort by time; only one is ever added at a time
+                del totals[min(totals)]
+
+    def update(self, timestamp, watts, register):
+        """Book the energy since the previous reading of watts (W) and register (Wh)"""
+        with self._lock:
+            if self.last is None:
+                self.last = (timestamp, watts, register)
+                return
+            previous_time, previous_watts, _ = self.last
+            elapsed = timestamp - previous_time
+            if elapsed <= 0:
+                return
+
+            integrated = (previous_watts + watts) / 2 * elapsed / 3600 if elapsed <= self.gap else None
+            counted = self._register_delta(register, integrated or 0.0)
+            if counted is None:
+                # Reset: the register holds what was counted since, at most
+                counted = integrated if integrated is not None else register
+            self.counted += counted
+            self.last = (timestamp, watts, register)
+
+            wh = integrated if integrated is not None else counted
+            # Keep within a register step of what the register counted
+            residual = self.counted - (self.booked + wh)
+            if abs(residual) >= self.resolution:
+                wh += residual
+            # Never book negative energy (booked is exported as a counter):
+            # an overshoot stays in the residual and comes off the next
+            # intervals instead
+            self._book(timestamp, max(0.0, wh))
+
+            if timestamp - self._saved >= self.save_interval:
+                self._saved = timestamp
+                self.save()
+
+    def total(self, period, timestamp=None) -> float:
+        """Wh booked in the hour, day or month of timestamp (now)"""
+        timestamp = time.time() if timestamp is None else timestamp
+        return self.totals[period].get(period_key(period, timestamp), 0.0)
+
+    def close(self):
+        with self._lock:
+            self.save()
+
+
+class LedgerCollector:
+    def __init__(self, ledgers, labelnames=(), prefix='energy'):
+        """Export ledgers, a dict of label value tuples to EnergyLedgers"""
+        self.ledgers = ledgers
+        self.labelnames = tuple(labelnames)
+        self.prefix = prefix
+
+    def collect(self):
+        current = {
+            period: GaugeMetricFamily('{}_{}_wh'.format(self.prefix, 'today' if period == 'day' else 'this_' + period),
+                                      'Energy used so far this {} (Wh)'.format(period), labels=self.labelnames)
+            for period in PERIODS
+        }
+        booked = CounterMetricFamily(self.prefix + '_booked_wh', 'Energy booked by the ledger (Wh)', labels=self.labelnames)
+        residual = GaugeMetricFamily(self.prefix + '_register_residual_wh', 'Energy counted by the meter register but not booked yet (Wh)', labels=self.labelnames)
+        resets = CounterMetricFamily(self.prefix + '_register_resets', 'Meter energy register resets seen', labels=self.labelnames)
+        wraps = CounterMetricFamily(self.prefix + '_register_wraps', 'Meter energy register wraps seen', labels=self.labelnames)
+
+        now = time.time()
+        for labels, ledger in list(self.ledgers.items()):
+            labels = list(labels)
+            for period, family in current.items():
+                family.add_metric(labels, ledger.total(period, now))
+            booked.add_metric(labels, ledger.booked)
+            residual.add_metric(labels, ledger.counted - ledger.booked)
+            resets.add_metric(labels, ledger.resets)
+            wraps.add_metric(labels, ledger.wraps)
+        return list(current.values()) + [booked, residual, resets, wraps]
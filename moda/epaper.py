@@ -0,0 +1,134 @@
+"""Change-driven rendering for the Inky e-paper displays
+
+A full refresh of the 7-colour UC8159 panel takes tens of seconds and
+flickers, so a Panel only refreshes it when the text shown would change.
+The values are turned into text at the precision they are displayed with
+(quantize()), and that text is compared with the last frame, kept in a
+small JSON file so the cron-run display scripts can compare across runs.
+An unchanged frame costs no image, font or display setup at all.
+
+The background, with any static labels drawn on it, is loaded once into a
+base layer that every frame is copied from, into the same frame buffer.
+Render and refresh times are logged and kept on the panel.
+"""
+
+import json
+import logging
+import os
+import time
+
+
+def quantize(value, decimals=0, template='{:g}'):
+    """value rounded to the decimals shown, as text; '--' for None"""
+    if value is None:
+        return '--'
+    return template.format(round(value, decimals) + 0.0)
+
+
+class Panel:
+    def __init__(self, display, background, font, fields, labels=(), fills=None, saturation=1.0, state=None, quantizer=None):
+        """A display showing text fields over a background image
+
+        display is the display class (or any factory), created on the first
+        refresh; font is a callable returning the ImageFont to draw with;
+        fields maps each field to its (x, y) position and labels is a list
+        of static ((x, y), text) drawn into the base layer. fills maps the
+        fields not drawn in the default colour to theirs. state is the file
+        the last frame is kept in. quantizer, a moda.palette.Quantizer,
+        converts frames to the panel palette instead of the display driver.
+        """
+        self.display_factory = display
+        self.display = None
+        self.background = background
+        self.font_factory = font
+        self.fields = dict(fields)
+        self.labels = list(labels)
+        self.fills = dict(fills or {})
+        self.saturation = saturation
+        self.state = state
+        self.quantizer = quantizer
+        self.font = None
+        self.base = None
+        self.image = None
+        self.render_seconds = None
+        self.refresh_seconds = None
+        self.last = self._load()
+
+    def _load(self):
+        if self.state is None:
+            return None
+        try:
+            with open(self.state) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, frame):
+        self.last = frame
+        if self.state is None:
+            return
+        try:
+            with open(self.state + '.tmp', 'w') as f:
+                json.dump(frame, f)
+            os.replace(self.state + '.tmp', self.state)
+        except OSError as e:
+            logging.warning("Could not save the last frame to {}: {}".format(self.state, e))
+
+    def _frame(self, texts) -> dict:
+        # A new background has to be drawn even if the values are the same
+        try:
+            background = '{}@{}'.format(self.background, os.stat(self.background).st_mtime)
+        except OSError:
+            background = self.background
+        return {'background': background, 'texts': {field: texts.get(field, '--') for field in self.fields}}
+
+    def changed(self, texts) -> bool:
+        """Whether texts would show anything other than the last frame"""
+        return self._frame(texts) != self.last
+
+    def render(self, texts):
+        """The frame for texts, drawn over a copy of the base layer"""
+        from PIL import Image, ImageDraw
+        if self.base is None:
+            self.font = self.font_factory()
+            self.base = Image.open(self.background)
+            self.base.load()
+            draw = ImageDraw.Draw(self.base)
+            for position, label in self.labels:
+                draw.text(position, label, font=self.font)
+        if self.image is None:
+            self.image = self.base.copy()
+        else:
+            self.image.paste(self.base)
+        draw = ImageDraw.Draw(self.image)
+        for field, position in self.fields.items():
+            draw.text(position, texts.get(field, '--'), self.fills.get(field), font=self.font)
+        return self.image
+
+    def update(self, texts, force=False) -> bool:
+        """Render texts and refresh the display, unless the frame is unchanged
+
+        force refreshes it anyway, e.g. when another panel has been shown
+        on the display since. Returns whether the display was refreshed.
+        """
+        frame = self._frame(texts)
+        if frame == self.last and not force:
+            logging.debug("Display unchanged, not refreshing")
+            return False
+
+        start = time.perf_counter()
+        img = self.render(texts)
+        if self.quantizer is not None:
+            img = self.quantizer.quantize(img)
+        self.render_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if self.display is None:
+            self.display = self.display_factory()
+        self.display.set_image(img, saturation=self.saturation)
+        self.display.show()
+        self.refresh_seconds = time.perf_counter() - start
+
+        self._save(frame)
+        logging.info("Rendered in {:.3f}s, refreshed the display in {:.1f}s".format(self.render_seconds, self.refresh_seconds))
+        return True
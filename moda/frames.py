@@ -0,0 +1,164 @@
+"""Frame decoders for the UART particulate sensors
+
+A decoder is fed whatever bytes the serial port had and returns every
+complete, valid frame in its buffer in one pass. Headers are found with
+bytearray.find, checksums summed over memoryview slices and fields
+unpacked in place with struct.unpack_from, so nothing is copied until a
+frame is decoded. Garbage and frames failing their checksum are skipped
+byte by byte until the next header (a resync); a partial frame stays in
+the buffer for the next feed.
+"""
+
+import struct
+import time
+
+from prometheus_client import Counter
+
+FRAMES = Counter('serial_frames', 'Valid frames decoded from a UART sensor', ['sensor'])
+CHECKSUM_ERRORS = Counter('serial_frame_checksum_errors', 'Frames from a UART sensor that failed their checksum', ['sensor'])
+RESYNCS = Counter('serial_frame_resyncs', 'Times bytes were skipped to find the next frame header', ['sensor'])
+
+
+class PMS5003Data:
+    """Decoded PMS5003 frame, with the methods of pms5003.PMS5003Data"""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def pm_ug_per_m3(self, size, atmospheric_environment=False):
+        index = {1.0: 0, 2.5: 1, 10: 2, None: 2}[size]
+        return self.data[index + 3 if atmospheric_environment else index]
+
+    def pm_per_1l_air(self, size):
+        return self.data[{0.3: 6, 0.5: 7, 1.0: 8, 2.5: 9, 5: 10, 10: 11}[size]]
+
+
+class FrameDecoder:
+    HEADER = b''
+    SIZE = 0
+
+    def __init__(self, sensor):
+        """Decoder for the frames of one sensor, labelled sensor in the counters"""
+        self.buffer = bytearray()
+        self.frames = 0
+        self.checksum_errors = 0
+        self.resyncs = 0
+        self.skipped = 0
+        self._frames = FRAMES.labels(sensor)
+        self._checksum_errors = CHECKSUM_ERRORS.labels(sensor)
+        self._resyncs = RESYNCS.labels(sensor)
+
+    def valid(self, view, start) -> bool:
+        raise NotImplementedError
+
+    def unpack(self, buffer, start):
+        raise NotImplementedError
+
+    def reset(self):
+        """Drop the buffered bytes, along with the request they answered"""
+        self.buffer.clear()
+
+    def feed(self, data) -> list:
+        """Append data and return the frames decoded from the buffer"""
+        self.buffer += data
+        return self.decode()
+
+    def decode(self) -> list:
+        buffer = self.buffer
+        header = self.HEADER
+        size = self.SIZE
+        end = len(buffer)
+        frames = []
+        errors = resyncs = skipped = 0
+        start = 0
+        with memoryview(buffer) as view:
+            while True:
+                index = buffer.find(header, start)
+                if index < 0:
+                    # Keep a tail that may be the start of a split header
+                    index = max(start, end - len(header) + 1)
+                if index > start:
+                    resyncs += 1
+                    skipped += index - start
+                    start = index
+                if end - start < size:
+                    break
+                if self.valid(view, start):
+                    frames.append(self.unpack(buffer, start))
+                    start += size
+                else:
+                    errors += 1
+                    start += 1
+        del buffer[:start]
+
+        if frames:
+            self.frames += len(frames)
+            self._frames.inc(len(frames))
+        if errors:
+            self.checksum_errors += errors
+            self._checksum_errors.inc(errors)
+        if resyncs:
+            self.resyncs += resyncs
+            self.skipped += skipped
+            self._resyncs.inc(resyncs)
+        return frames
+
+
+class SDS011Decoder(FrameDecoder):
+    """AA kind b2..b7 checksum AB frames, decoded as (kind, b2 b3, b4 b5)
+
+    For data frames (kind 0xC0) the two words are PM2.5 and PM10 in tenths
+    of ug/m3; for command replies (0xC5) the first is the command and its
+    first data byte.
+    """
+
+    HEADER = b'\xaa'
+    SIZE = 10
+    FRAME = struct.Struct('<xBHH')
+
+    def valid(self, view, start):
+        return view[start + 9] == 0xAB and sum(view[start + 2:start + 8]) & 0xFF == view[start + 8]
+
+    def unpack(self, buffer, start):
+        return self.FRAME.unpack_from(buffer, start)
+
+
+class PMS5003Decoder(FrameDecoder):
+    """BM frames of 13 big endian words and their checksum, decoded as PMS5003Data"""
+
+    HEADER = b'\x42\x4d'
+    SIZE = 32
+    FRAME = struct.Struct('>4x13H')
+    LENGTH_AND_CHECKSUM = struct.Struct('>2xH26xH')
+
+    def valid(self, view, start):
+        length, checksum = self.LENGTH_AND_CHECKSUM.unpack_from(view, start)
+        return length == 28 and sum(view[start:start + 30]) == checksum
+
+    def unpack(self, buffer, start):
+        return PMS5003Data(self.FRAME.unpack_from(buffer, start))
+
+
+class SerialFrames:
+    def __init__(self, port, decoder, timeout=5.0):
+        """Blocking reads of decoded frames from a pyserial port
+
+        Frames that arrive together are queued and handed out one per
+        read(), oldest first.
+        """
+        self.port = port
+        self.decoder = decoder
+        self.timeout = timeout
+        self._pending = []
+
+    def read(self):
+        """Next frame, raising TimeoutError when none is complete in timeout seconds"""
+        deadline = time.monotonic() + self.timeout
+        while not self._pending:
+            if time.monotonic() > deadline:
+                raise TimeoutError("No valid frame in {}s".format(self.timeout))
+            # in_waiting bytes are there already, otherwise block (up to the port timeout) for one
+            self._pending = self.decoder.feed(self.port.read(max(1, self.port.in_waiting)))
+        return self._pending.pop(0)
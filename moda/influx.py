@@ -0,0 +1,246 @@
+"""Background InfluxDB v2 writer with batching and an on-disk spool
+
+Callers hand line-protocol records (with their own timestamps) to
+InfluxWriter.write(), which only appends to a queue. A worker thread posts
+the queue to /api/v2/write once it holds batch_size records or its oldest
+record is flush_interval seconds old. Batches that cannot be delivered are
+gzipped into a bounded spool directory and replayed, oldest first and at
+a capped rate, once the server accepts writes again.
+"""
+
+import gzip
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from prometheus_client import Counter, Gauge, Histogram
+
+QUEUE_DEPTH = Gauge('influxdb_queue_points', 'Points waiting in memory to be written to InfluxDB')
+SPOOL_BYTES = Gauge('influxdb_spool_bytes', 'Size of the InfluxDB on-disk spool (bytes)')
+SPOOL_POINTS = Gauge('influxdb_spool_points', 'Points waiting in the InfluxDB on-disk spool')
+FLUSH_TIME = Histogram('influxdb_flush_seconds', 'Time taken by InfluxDB write requests', buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+WRITTEN = Counter('influxdb_written_points', 'Points accepted by InfluxDB')
+DROPPED = Counter('influxdb_dropped_points', 'Points dropped because the queue or spool was full', ['reason'])
+FAILURES = Counter('influxdb_write_failures', 'InfluxDB write requests that failed, and writer errors (spool I/O)')
+
+# Longest pause of the worker after an error of its own
+MAX_ERROR_BACKOFF = 60
+
+
+class InfluxWriter:
+    def __init__(self, url, token, org, bucket, precision='s', batch_size=500, flush_interval=10,
+                 max_queue=10000, spool_dir=None, spool_max_bytes=8 * 1024 * 1024,
+                 replay_rate=1000, timeout=(5, 15)):
+        """Batching writer for one bucket
+
+        spool_dir keeps undelivered batches on disk, at most spool_max_bytes
+        of gzipped line protocol; without it failed batches are dropped.
+        replay_rate caps how many spooled points per second are replayed.
+        timeout is the (connect, read) timeout of each request.
+        """
+        self.endpoint = url.rstrip('/') + '/api/v2/write'
+        self.params = {'org': org, 'bucket': bucket, 'precision': precision}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self.replay_rate = replay_rate
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': 'Token {}'.format(token),
+            'Content-Type': 'text/plain; charset=utf-8',
+        })
+
+        self._queue = deque()
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._next_replay = 0.0
+        self._sequence = 0
+        self._thread = None
+        self._running = False
+
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            spooled = self._spooled()
+            if spooled:
+                self._sequence = int(spooled[-1].split('-')[0])
+            self._update_spool_metrics()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='influxdb-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, flush=True):
+        """Stop the worker, spooling or sending whatever is still queued"""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if flush and self._queue:
+            self._flush(self._take(len(self._queue)))
+
+    def write(self, records):
+        """Queue one line-protocol record or a list of them"""
+        if isinstance(records, str):
+            records = [records]
+        with self._condition:
+            for record in records:
+                if len(self._queue) >= self.max_queue:
+                    self._queue.popleft()
+                    DROPPED.labels('queue').inc()
+                self._queue.append(record)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            QUEUE_DEPTH.set(len(self._queue))
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+
+    def _take(self, count):
+        with self._condition:
+            batch = [self._queue.popleft() for _ in range(min(count, len(self._queue)))]
+            self._oldest = time.monotonic() if self._queue else None
+            QUEUE_DEPTH.set(len(self._queue))
+        return batch
+
+    def _due(self):
+        if len(self._queue) >= self.batch_size:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+
+    def _wait(self):
+        now = time.monotonic()
+        wait = self.flush_interval
+        if self._oldest is not None:
+            wait = self._oldest + self.flush_interval - now
+        if self.spool_dir and self._spooled():
+            wait = min(wait, self._next_replay - now)
+        return max(0.01, wait)
+
+    def _run(self):
+        errors = 0
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                if not self._due():
+                    self._condition.wait(self._wait())
+                due = self._due()
+
+            try:
+                if due:
+                    self._flush(self._take(self.batch_size))
+                self._replay()
+                errors = 0
+            except Exception:
+                # A full or read-only disk under the spool: keep the worker
+                # alive, points queue in memory meanwhile
+                logging.exception('InfluxDB writer error')
+                FAILURES.inc()
+                errors += 1
+                with self._condition:
+                    if self._running:
+                        self._condition.wait(min(2 ** (errors - 1), MAX_ERROR_BACKOFF))
+
+    def _post(self, body, points):
+        """Send one gzipped body, returning True once InfluxDB has accepted it"""
+        start = time.monotonic()
+        try:
+            response = self.session.post(self.endpoint, params=self.params, data=body,
+                                         headers={'Content-Encoding': 'gzip'}, timeout=self.timeout)
+        except requests.RequestException as exception:
+            logging.warning('Exception sending to InfluxDB: {}'.format(exception))
+            FAILURES.inc()
+            return False
+        finally:
+            FLUSH_TIME.observe(time.monotonic() - start)
+
+        if response.status_code == 204:
+            WRITTEN.inc(points)
+            return True
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            # The server will never take these points, retrying only clogs the spool
+            logging.warning('InfluxDB rejected {} points: {} {}'.format(points, response.status_code, response.text[:200]))
+            DROPPED.labels('rejected').inc(points)
+            return True
+        logging.warning('InfluxDB write failed: {} {}'.format(response.status_code, response.text[:200]))
+        FAILURES.inc()
+        return False
+
+    def _flush(self, batch):
+        if not batch:
+            return True
+        body = gzip.compress('\n'.join(batch).encode('utf-8'))
+        if self._post(body, len(batch)):
+            return True
+        try:
+            self._spool(body, len(batch))
+        except OSError:
+            DROPPED.labels('unsent').inc(len(batch))
+            raise
+        # The server is struggling, leave the backlog alone for a while
+        self._next_replay = time.monotonic() + self.flush_interval
+        return False
+
+    def _spooled(self):
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.lp.gz'))
+
+    def _spool(self, body, points):
+        if not self.spool_dir:
+            DROPPED.labels('unsent').inc(points)
+            return
+        self._sequence += 1
+        name = '{:012d}-{}.lp.gz'.format(self._sequence, points)
+        path = os.path.join(self.spool_dir, name)
+        # Write then rename, so a power cut never leaves a torn batch behind
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+
+        spooled = self._spooled()
+        total = sum(os.path.getsize(os.path.join(self.spool_dir, name)) for name in spooled)
+        while total > self.spool_max_bytes and len(spooled) > 1:
+            oldest = spooled.pop(0)
+            total -= os.path.getsize(os.path.join(self.spool_dir, oldest))
+            os.remove(os.path.join(self.spool_dir, oldest))
+            DROPPED.labels('spool').inc(self._points(oldest))
+        self._update_spool_metrics(spooled)
+
+    @staticmethod
+    def _points(name):
+        return int(name.split('-')[1].split('.')[0])
+
+    def _replay(self):
+        """Send the oldest spooled batch if the replay rate allows it"""
+        if not self.spool_dir or time.monotonic() < self._next_replay:
+            return
+        spooled = self._spooled()
+        if not spooled:
+            return
+        path = os.path.join(self.spool_dir, spooled[0])
+        with open(path, 'rb') as f:
+            body = f.read()
+        points = self._points(spooled[0])
+        if self._post(body, points):
+            os.remove(path)
+            self._next_replay = time.monotonic() + points / self.replay_rate
+            self._update_spool_metrics()
+        else:
+            # Still down, wait a full flush interval before trying the backlog again
+            self._next_replay = time.monotonic() + self.flush_interval
+
+    def _update_spool_metrics(self, spooled=None):
+        if spooled is None:
+            spooled = self._spooled()
+        SPOOL_BYTES.set(sum(os.path.getsize(os.path.join(self.spool_dir, name)) for name in spooled))
+        SPOOL_POINTS.set(sum(self._points(name) for name in spooled))
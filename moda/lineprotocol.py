@@ -0,0 +1,101 @@
+"""InfluxDB line protocol serialization for snapshots
+
+A LineSerializer escapes the measurement, tags and field keys once, so
+turning a snapshot into a record is a single join over its values: one
+line per snapshot carrying every field, instead of one Point per field.
+"""
+
+import math
+
+PRECISIONS = {'s': 1, 'ms': 1000, 'us': 1000000, 'ns': 1000000000}
+
+
+def _escape(text, characters):
+    text = str(text)
+    for character in characters:
+        text = text.replace(character, '\\' + character)
+    return text
+
+
+def escape_measurement(name):
+    return _escape(name, '\\, ')
+
+
+def escape_key(name):
+    """Escape a tag key, tag value or field key"""
+    return _escape(name, '\\,= ')
+
+
+def _format_float(value):
+    # Integral floats go out without their '.0', InfluxDB still reads a float
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def format_value(value):
+    """Format a field value, None for values line protocol can't carry"""
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, int):
+        return '{}i'.format(value)
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return None
+        return _format_float(value)
+    return '"{}"'.format(_escape(value, '\\"'))
+
+
+class LineSerializer:
+    def __init__(self, measurement, tags=None, fields=(), precision='s'):
+        """Serializer for one measurement and fixed set of tags
+
+        fields pre-escapes known field keys, others are escaped on first use.
+        """
+        self.prefix = escape_measurement(measurement) + ''.join(
+            ',{}={}'.format(escape_key(key), escape_key(value))
+            for key, value in sorted((tags or {}).items())
+            if value != ''
+        ) + ' '
+        self.scale = PRECISIONS[precision]
+        self._keys = {name: escape_key(name) + '=' for name in fields}
+
+    def _key(self, name):
+        key = self._keys.get(name)
+        if key is None:
+            key = self._keys[name] = escape_key(name) + '='
+        return key
+
+    def _line(self, body, timestamp):
+        if not body:
+            return None
+        if timestamp is None:
+            return self.prefix + body
+        return '{}{} {}'.format(self.prefix, body, int(timestamp * self.scale))
+
+    def line(self, fields, timestamp=None):
+        """One record for a dict of fields, None when none can be written"""
+        key = self._key
+        parts = []
+        for name, value in fields.items():
+            text = format_value(value)
+            if text is not None:
+                parts.append(key(name) + text)
+        return self._line(','.join(parts), timestamp)
+
+    def snapshot(self, snapshot):
+        """One record holding every field set in a moda.snapshot.Snapshot"""
+        key = self._key
+        values = snapshot.values
+        parts = []
+        for name, i in snapshot.index.items():
+            value = values[i]
+            if not math.isnan(value) and not math.isinf(value):
+                parts.append(key(name) + _format_float(value))
+        return self._line(','.join(parts), snapshot.timestamp)
+
+    def snapshots(self, snapshots):
+        """A request body with one record per snapshot"""
+        return '\n'.join(line for line in map(self.snapshot, snapshots) if line is not None)
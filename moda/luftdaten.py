@@ -0,0 +1,123 @@
+"""Sensor.Community (Luftdaten) push client
+
+Uploads for each X-PIN go out concurrently over one keep-alive session,
+with connect/read timeouts and jittered exponential backoff between
+retries. When an upload still fails, the sample is either coalesced with
+the following ones (the next successful upload carries the mean of the
+whole outage window) or dropped, in which case only fresh data is sent.
+"""
+
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from prometheus_client import Counter, Histogram
+
+DEFAULT_URL = 'https://api.luftdaten.info/v1/push-sensor-data/'
+
+REQUEST_TIME = Histogram('luftdaten_request_seconds', 'Time taken by Luftdaten uploads', ['pin'], buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+REQUESTS = Counter('luftdaten_requests', 'Luftdaten upload attempts by outcome', ['pin', 'result'])
+DROPPED = Counter('luftdaten_dropped_samples', 'Samples never uploaded to Luftdaten', ['pin'])
+
+
+class LuftdatenClient:
+    def __init__(self, sensor_uid, url=DEFAULT_URL, software_version='enviro-plus 0.0.1',
+                 timeout=(3.05, 10), retries=2, backoff=1.0, max_backoff=10.0,
+                 stale='coalesce', max_age=600):
+        """Client pushing for one sensor UID
+
+        timeout is the (connect, read) timeout of each attempt, retries how
+        many times a failed attempt is repeated within one push. stale is
+        'coalesce' or 'drop' and max_age bounds, in seconds, how old a
+        coalesced window may get before it is dropped.
+        """
+        if stale not in ('coalesce', 'drop'):
+            raise ValueError('stale must be coalesce or drop, not {}'.format(stale))
+        self.url = url
+        self.software_version = software_version
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stale = stale
+        self.max_age = max_age
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'X-Sensor': sensor_uid,
+            'Content-Type': 'application/json',
+            'cache-control': 'no-cache',
+        })
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='luftdaten')
+
+        # pin -> [first sample time, sample count, {value_type: sum}]
+        self._pending = {}
+
+    def _accumulate(self, pin, values, now):
+        pending = self._pending.get(pin)
+        if pending is not None and now - pending[0] > self.max_age:
+            DROPPED.labels(pin).inc(pending[1])
+            pending = None
+        if pending is None:
+            self._pending[pin] = [now, 1, dict(values)]
+            return
+        pending[1] += 1
+        sums = pending[2]
+        for key, value in values.items():
+            sums[key] = sums.get(key, 0.0) + value
+
+    def _send(self, pin, values):
+        """True once uploaded, None if the API refused the sample, False if it couldn't be reached"""
+        payload = {
+            'software_version': self.software_version,
+            'sensordatavalues': [{'value_type': key, 'value': '{:.2f}'.format(value)} for key, value in values.items()],
+        }
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+            start = time.monotonic()
+            try:
+                response = self.session.post(self.url, json=payload, headers={'X-PIN': pin}, timeout=self.timeout)
+            except requests.RequestException as exception:
+                REQUEST_TIME.labels(pin).observe(time.monotonic() - start)
+                REQUESTS.labels(pin, 'error').inc()
+                logging.warning('Exception sending to Luftdaten (PIN {}): {}'.format(pin, exception))
+                continue
+            REQUEST_TIME.labels(pin).observe(time.monotonic() - start)
+
+            if response.ok:
+                REQUESTS.labels(pin, 'success').inc()
+                return True
+            REQUESTS.labels(pin, 'failure').inc()
+            logging.warning('Luftdaten response (PIN {}): {} {}'.format(pin, response.status_code, response.text[:200]))
+            if response.status_code < 500 and response.status_code != 429:
+                # Retrying a request the API refused won't change its mind
+                return None
+        return False
+
+    def push(self, pins):
+        """Upload {pin: {value_type: value}} concurrently, True if every PIN went through"""
+        now = time.time()
+        for pin, values in pins.items():
+            self._accumulate(pin, values, now)
+
+        futures = {}
+        for pin, (_, count, sums) in self._pending.items():
+            futures[pin] = self.executor.submit(self._send, pin, {key: total / count for key, total in sums.items()})
+
+        ok = True
+        for pin, future in futures.items():
+            result = future.result()
+            if result:
+                del self._pending[pin]
+                continue
+            ok = False
+            if result is None or self.stale == 'drop':
+                DROPPED.labels(pin).inc(self._pending.pop(pin)[1])
+        return ok
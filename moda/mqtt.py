@@ -0,0 +1,300 @@
+"""Long-lived MQTT publisher with an offline queue
+
+Exporters hand messages to Publisher.publish(), which only queues them.
+One paho client per broker stays connected (and reconnects by itself,
+backing off up to a minute), and a feeder thread hands it the queue as
+long as fewer than max_inflight messages wait for their PUBACK, so QoS 1
+messages are pipelined instead of sent one round trip at a time. paho
+calls back with its own locks held, so the callbacks only record what
+happened and wake the feeder, the one thread calling into paho.
+
+While the broker is away new messages go straight to a spool directory
+of JSON lines segments, at most spool_max_bytes (past that the oldest
+segment is dropped), so a kill during an outage doesn't lose them (a
+power cut at most what the OS hadn't written yet); without a spool they
+wait in memory, up to max_queued. The spool also takes over when the
+memory queue is full while connected. Spooled messages are replayed in
+order once the memory queue has drained, and close() spools whatever is
+still queued, so a restart doesn't lose them. Messages paho has taken
+but not had acknowledged are its own to resend after a reconnect.
+"""
+
+import base64
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+from prometheus_client import Counter, Gauge
+
+CONNECTED = Gauge('mqtt_connected', 'Whether the publisher is connected to the broker (boolean)', ['broker'])
+INFLIGHT = Gauge('mqtt_inflight_messages', 'Messages handed to the broker and not acknowledged yet', ['broker'])
+QUEUED = Gauge('mqtt_queued_messages', 'Messages waiting to be published', ['broker', 'where'])
+PUBLISHED = Counter('mqtt_published_messages', 'Messages acknowledged by the broker (QoS 1) or sent (QoS 0)', ['broker'])
+DROPPED = Counter('mqtt_dropped_messages', 'Messages dropped because the spool was full or missing', ['broker'])
+RECONNECTS = Counter('mqtt_reconnects', 'Connections to the broker lost', ['broker'])
+
+# Messages per spool segment file
+SEGMENT_MESSAGES = 500
+FIRST_SEGMENT = 1000000
+
+
+def packet_size(topic, payload, qos=1) -> int:
+    """Bytes of the MQTT 3.1.1 PUBLISH packet carrying payload on topic"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    remaining = 2 + len(topic.encode()) + (2 if qos else 0) + len(payload)
+    length = 1
+    while remaining >= 128 ** length:
+        length += 1
+    return 1 + length + remaining
+
+
+class Publisher:
+    def __init__(self, host, port=1883, client_id='', username=None, password=None, tls=False,
+                 qos=1, keepalive=60, max_inflight=20, max_queued=1000, spool_dir=None,
+                 spool_max_bytes=4 * 1024 * 1024):
+        """Publisher to the broker at host:port
+
+        qos is the default for publish(). spool_dir keeps the messages
+        published while the broker is away and those the memory queue has
+        no room for; without it they wait in memory, then are dropped.
+        """
+        import paho.mqtt.client as mqtt
+
+        self.broker = '{}:{}'.format(host, port)
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.keepalive = keepalive
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        else:
+            self.client = mqtt.Client(client_id=client_id)
+        if username is not None:
+            self.client.username_pw_set(username, password)
+        if tls:
+            import ssl
+            self.client.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.reconnect_delay_set(1, 60)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+
+        self.connected = False
+        self._queue = deque()
+        # mids handed to paho, and acknowledged ones not matched to them yet
+        self._inflight = set()
+        self._acked = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._segment = None
+        self._segment_count = 0
+        self._sequence = 0
+        self._spooled = 0
+
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            segments = self._segments()
+            if segments:
+                self._sequence = int(segments[-1].split('.')[0])
+                self._spooled = sum(self._lines(name) for name in segments)
+            else:
+                # Room below for the segments close() puts first
+                self._sequence = FIRST_SEGMENT
+        CONNECTED.labels(self.broker).set(0)
+        PUBLISHED.labels(self.broker)
+        DROPPED.labels(self.broker)
+        RECONNECTS.labels(self.broker)
+        self._update_metrics()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='mqtt-publisher', daemon=True)
+        self._thread.start()
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.client.loop_start()
+        return self
+
+    def close(self, timeout=5):
+        """Wait up to timeout seconds for the queue to go out, then disconnect and spool the rest"""
+        with self._condition:
+            self._condition.wait_for(lambda: not (self.connected and (self._queue or self._spooled or self._inflight)), timeout)
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.client.disconnect()
+        self.client.loop_stop()
+        with self._condition:
+            self._close_segment()
+            if self.spool_dir and self._queue:
+                # Queued messages are older than the spooled ones, so they
+                # go in a segment numbered before the first
+                segments = self._segments()
+                first = int(segments[0].split('.')[0]) if segments else self._sequence + 1
+                self._write(os.path.join(self.spool_dir, '{:012d}.jsonl'.format(first - 1)), [self._encode(message) for message in self._queue])
+                self._spooled += len(self._queue)
+                self._queue.clear()
+            self._update_metrics()
+
+    def publish(self, topic, payload, qos=None, retain=False):
+        """Queue a message; it is sent in order as soon as the broker takes it"""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        message = (topic, payload, self.qos if qos is None else qos, retain)
+        with self._condition:
+            # Behind spooled messages, or to disk while nothing goes out
+            if self._spooled or (self.spool_dir and not self.connected) or len(self._queue) >= self.max_queued:
+                self._spool(message)
+            else:
+                self._queue.append(message)
+            self._update_metrics()
+            self._condition.notify_all()
+
+    def _ready(self) -> bool:
+        self._reap()
+        return not self._running or (self.connected and len(self._inflight) < self.max_inflight and (bool(self._queue) or self._unspool()))
+
+    def _reap(self):
+        done = self._inflight & self._acked
+        if done:
+            self._inflight -= done
+            self._acked -= done
+            PUBLISHED.labels(self.broker).inc(len(done))
+            self._update_metrics()
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(self._ready)
+                if not self._running:
+                    return
+                message = self._queue.popleft()
+            topic, payload, qos, retain = message
+            info = self.client.publish(topic, payload, qos, retain)
+            with self._condition:
+                if info.rc != 0 and qos == 0:
+                    # Lost the connection in the meantime; paho drops QoS 0
+                    # messages then, so keep it for later
+                    self._queue.appendleft(message)
+                else:
+                    # paho keeps QoS 1 and 2 messages and resends them after a reconnect
+                    self._inflight.add(info.mid)
+                self._update_metrics()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code != 0:
+            logging.warning("MQTT broker {} refused the connection: {}".format(self.broker, reason_code))
+            return
+        logging.info("Connected to MQTT broker {}".format(self.broker))
+        with self._condition:
+            self.connected = True
+            CONNECTED.labels(self.broker).set(1)
+            self._condition.notify_all()
+
+    def _on_disconnect(self, client, userdata, *args):
+        with self._condition:
+            if self.connected:
+                logging.warning("Lost the connection to MQTT broker {}".format(self.broker))
+                RECONNECTS.labels(self.broker).inc()
+            self.connected = False
+            CONNECTED.labels(self.broker).set(0)
+            self._condition.notify_all()
+
+    def _on_publish(self, client, userdata, mid, *args):
+        with self._condition:
+            self._acked.add(mid)
+            self._condition.notify_all()
+
+    def _update_metrics(self):
+        INFLIGHT.labels(self.broker).set(len(self._inflight))
+        QUEUED.labels(self.broker, 'memory').set(len(self._queue))
+        QUEUED.labels(self.broker, 'disk').set(self._spooled)
+
+    @staticmethod
+    def _encode(message) -> str:
+        topic, payload, qos, retain = message
+        return json.dumps({'t': topic, 'p': base64.b64encode(payload).decode(), 'q': qos, 'r': retain})
+
+    @staticmethod
+    def _decode(line):
+        message = json.loads(line)
+        return message['t'], base64.b64decode(message['p']), message['q'], message['r']
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.jsonl'))
+
+    def _lines(self, name):
+        with open(os.path.join(self.spool_dir, name)) as f:
+            return sum(1 for _ in f)
+
+    @staticmethod
+    def _write(path, lines):
+        with open(path + '.tmp', 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def _spool(self, message):
+        if not self.spool_dir:
+            DROPPED.labels(self.broker).inc()
+            return
+        if self._segment is None or self._segment_count >= SEGMENT_MESSAGES:
+            self._close_segment()
+            self._sequence += 1
+            self._segment = open(os.path.join(self.spool_dir, '{:012d}.jsonl'.format(self._sequence)), 'a')
+            self._segment_count = 0
+        self._segment.write(self._encode(message) + '\n')
+        # A line at a time: an outage is when the device is most likely to lose power too
+        self._segment.flush()
+        self._segment_count += 1
+        self._spooled += 1
+
+        segments = self._segments()
+        total = sum(os.path.getsize(os.path.join(self.spool_dir, name)) for name in segments)
+        while total > self.spool_max_bytes and len(segments) > 1:
+            oldest = segments.pop(0)
+            path = os.path.join(self.spool_dir, oldest)
+            dropped = self._lines(oldest)
+            total -= os.path.getsize(path)
+            os.remove(path)
+            self._spooled -= dropped
+            DROPPED.labels(self.broker).inc(dropped)
+
+    def _unspool(self) -> bool:
+        """Move the oldest spooled segment to the memory queue; whether anything is queued"""
+        while self._spooled and not self._queue:
+            segments = self._segments()
+            if not segments:
+                self._spooled = 0
+                break
+            path = os.path.join(self.spool_dir, segments[0])
+            if self._segment is not None and self._segment.name == path:
+                self._close_segment()
+            with open(path) as f:
+                lines = f.readlines()
+            os.remove(path)
+            self._spooled = max(0, self._spooled - len(lines))
+            for line in lines:
+                try:
+                    self._queue.append(self._decode(line))
+                except (ValueError, KeyError):
+                    # A line torn by a power cut
+                    DROPPED.labels(self.broker).inc()
+        return bool(self._queue)
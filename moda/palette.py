@@ -0,0 +1,133 @@
+"""7-colour palette quantization for the Inky Impression (UC8159) with NumPy
+
+Inky.set_image() converts every frame to the panel palette with PIL, a
+large part of the CPU time of a refresh on a Pi Zero. A Quantizer does it
+with a lookup table instead: a 64x64x64 table of palette indices, one per
+6-bit RGB cell, indexed by the top 6 bits of each channel. That is the
+resolution of PIL's own palette cache, which maps each cell to the
+palette entry nearest its lower corner, so without dithering the output is
+pixel-identical to PIL's (including the black padding entry 8 the driver
+palette has past its 8 colours). The table is built for a saturation once
+and can be cached to disk as a .npy file.
+
+Ordered dithering adds a tiled Bayer threshold matrix to the image before
+the lookup, as array operations, instead of PIL's Floyd-Steinberg error
+diffusion. Set a quantized "P" image on the driver and it skips its own
+conversion.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+# The Inky UC8159 driver's palettes, blended by saturation
+SATURATED_PALETTE = [
+    [57, 48, 57], [255, 255, 255], [58, 91, 70], [61, 59, 94],
+    [156, 72, 75], [208, 190, 71], [177, 106, 73], [255, 255, 255],
+]
+DESATURATED_PALETTE = [
+    [0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255],
+    [255, 0, 0], [255, 255, 0], [255, 140, 0], [255, 255, 255],
+]
+
+# Top bits of each channel indexing the table
+BITS = 6
+LUT_VERSION = 1
+
+DITHER_NONE = 'none'
+DITHER_ORDERED = 'ordered'
+
+
+def palette_blend(saturation) -> list:
+    """The driver palette for a saturation, as flat RGB bytes: 7 colours then clear (white)"""
+    saturation = float(saturation)
+    palette = []
+    for saturated, desaturated in zip(SATURATED_PALETTE[:7], DESATURATED_PALETTE[:7]):
+        palette += [int(s * saturation + d * (1.0 - saturation)) for s, d in zip(saturated, desaturated)]
+    return palette + [255, 255, 255]
+
+
+def build_lut(saturation) -> np.ndarray:
+    """Palette index nearest the lower corner of every 6-bit RGB cell, flat"""
+    # The driver pads its palette to 256 entries with black; the first of
+    # those can be nearer than any colour, and ties go to the lowest index
+    candidates = np.array(palette_blend(saturation) + [0, 0, 0], dtype=np.int32).reshape(-1, 3)
+    levels = np.arange(0, 256, 1 << (8 - BITS), dtype=np.int32)
+    lut = np.empty(len(levels) ** 3, dtype=np.uint8)
+    # One red plane at a time, to keep the distance array small on a Pi Zero
+    plane = np.stack(np.meshgrid(levels, levels, indexing='ij'), -1).reshape(-1, 2)
+    for i, red in enumerate(levels):
+        distances = (red - candidates[:, 0]) ** 2 + ((plane[:, None, :] - candidates[None, :, 1:]) ** 2).sum(-1)
+        lut[i * len(plane):(i + 1) * len(plane)] = distances.argmin(1)
+    return lut
+
+
+def bayer(order) -> np.ndarray:
+    """order x order Bayer threshold matrix, values in [-0.5, 0.5)"""
+    matrix = np.zeros((1, 1), dtype=np.int32)
+    while len(matrix) < order:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size - 0.5
+
+
+class Quantizer:
+    def __init__(self, saturation=0.5, dither=DITHER_NONE, strength=64, order=8, cache=None):
+        """Map images to the panel palette at saturation
+
+        dither is DITHER_NONE or DITHER_ORDERED, strength the spread of the
+        ordered dither in channel levels and order the size of its matrix.
+        cache is a directory to keep the table in between runs.
+        """
+        if dither not in (DITHER_NONE, DITHER_ORDERED):
+            raise ValueError("dither must be {} or {}".format(DITHER_NONE, DITHER_ORDERED))
+        self.saturation = saturation
+        self.dither = dither
+        self.lut = self._load(cache)
+        self.threshold = np.rint(bayer(order) * strength).astype(np.int16)
+        self._tiles = None
+        self._palette = None
+
+    def _load(self, cache):
+        if cache is None:
+            return build_lut(self.saturation)
+        path = os.path.join(cache, 'uc8159-v{}-{:.4f}.npy'.format(LUT_VERSION, self.saturation))
+        try:
+            lut = np.load(path)
+            if lut.shape == ((1 << BITS) ** 3,) and lut.dtype == np.uint8:
+                return lut
+        except (OSError, ValueError):
+            pass
+        lut = build_lut(self.saturation)
+        try:
+            os.makedirs(cache, exist_ok=True)
+            np.save(path + '.tmp.npy', lut)
+            os.replace(path + '.tmp.npy', path)
+        except OSError as e:
+            logging.warning("Could not cache the palette table in {}: {}".format(cache, e))
+        return lut
+
+    def indices(self, image) -> np.ndarray:
+        """Palette index of every pixel of an RGB(A) image or (rows, cols, 3+) array"""
+        rgb = np.asarray(image)[..., :3]
+        if self.dither == DITHER_ORDERED:
+            rows, cols = rgb.shape[:2]
+            if self._tiles is None or self._tiles.shape[:2] != (rows, cols):
+                order = len(self.threshold)
+                self._tiles = np.tile(self.threshold, (-(-rows // order), -(-cols // order)))[:rows, :cols, None]
+            rgb = np.clip(rgb + self._tiles, 0, 255).astype(np.uint8)
+        shift = 8 - BITS
+        index = (rgb[..., 0] >> shift).astype(np.uint32) << (2 * BITS)
+        index |= (rgb[..., 1] >> shift).astype(np.uint32) << BITS
+        index |= rgb[..., 2] >> shift
+        return self.lut[index]
+
+    def quantize(self, image):
+        """A "P" mode PIL image of image in the panel palette, for Inky.set_image()"""
+        from PIL import Image
+        if self._palette is None:
+            self._palette = palette_blend(self.saturation) + [0, 0, 0] * 248
+        indices = self.indices(image)
+        quantized = Image.frombytes('P', (indices.shape[1], indices.shape[0]), indices.tobytes())
+        quantized.putpalette(self._palette)
+        return quantized
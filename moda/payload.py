@@ -0,0 +1,170 @@
+"""Compact MQTT payloads: a whole snapshot per message, with deadbands
+
+A SnapshotPublisher packs the fields of a snapshot into one message on one
+topic (JSON, CBOR or MessagePack) instead of a message per field, which
+saves the per-message topic and packet overhead on a metered link. With a
+Deadband a field only goes out when it moved more than its threshold since
+it was last sent, so a message carries just the fields that changed and
+nothing is published when none did. Every heartbeat seconds the whole
+snapshot goes out regardless, for subscribers that missed a message or
+just started; they keep the last value of every field they have seen.
+
+Integral floats are packed as integers (a PZEM energy of 1.0 Wh as 1).
+CBOR and MessagePack need cbor2 or msgpack, imported only when chosen.
+
+mqtt_payload_bytes_total counts the PUBLISH packets sent, and
+mqtt_payload_bytes_saved_total how much less that is than the exporter's
+previous layout (its baseline: one topic per field, or the whole snapshot
+as plain JSON) would have sent.
+"""
+
+import json
+import time
+
+from prometheus_client import Counter
+
+from moda.mqtt import packet_size
+
+# topics: a message per field on topic/field, the value as text
+ENCODINGS = ('topics', 'json', 'cbor', 'msgpack')
+
+MESSAGES = Counter('mqtt_payload_snapshots', 'Snapshots handed to the payload packer, by whether anything was sent', ['stream', 'result'])
+FIELDS = Counter('mqtt_payload_fields', 'Snapshot fields, by whether they moved past their deadband', ['stream', 'result'])
+BYTES = Counter('mqtt_payload_bytes', 'Bytes of the PUBLISH packets sent for snapshots', ['stream'])
+BASELINE = Counter('mqtt_payload_baseline_bytes', 'Bytes the previous payload layout would have sent, unfiltered', ['stream'])
+SAVED = Counter('mqtt_payload_bytes_saved', 'Bytes not sent thanks to batching, encoding and deadbands', ['stream'])
+
+
+def encoder(encoding):
+    """Function packing a dict into the bytes of one message"""
+    if encoding == 'json':
+        return lambda values: json.dumps(values, separators=(',', ':')).encode()
+    if encoding == 'cbor':
+        import cbor2
+        # canonical picks the shortest float that keeps the value exactly
+        return lambda values: cbor2.dumps(values, canonical=True)
+    if encoding == 'msgpack':
+        import msgpack
+        return msgpack.packb
+    raise ValueError("encoding must be one of {}".format(", ".join(ENCODINGS)))
+
+
+def compact(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return int(value)
+    return value
+
+
+def parse_deadbands(text):
+    """(thresholds, default) from "pm25=0.5,pm10=1"; an entry without a name is the default"""
+    thresholds, default = {}, 0.0
+    for entry in filter(None, (entry.strip() for entry in (text or '').split(','))):
+        name, _, threshold = entry.rpartition('=')
+        if name:
+            thresholds[name.strip()] = float(threshold)
+        else:
+            default = float(threshold)
+    return thresholds, default
+
+
+class Deadband:
+    def __init__(self, thresholds=None, default=0.0, heartbeat=300):
+        """Pass fields that moved more than their threshold (default) since last sent
+
+        Fields that aren't numbers pass when they change. The whole snapshot
+        passes every heartbeat seconds.
+        """
+        self.thresholds = dict(thresholds or {})
+        self.default = default
+        self.heartbeat = heartbeat
+        self.sent = {}
+        self._keyframe = None
+
+    def _moved(self, name, value) -> bool:
+        if name not in self.sent:
+            return True
+        last = self.sent[name]
+        if isinstance(value, (int, float)) and isinstance(last, (int, float)):
+            return abs(value - last) > self.thresholds.get(name, self.default)
+        return value != last
+
+    def filter(self, values, now=None) -> dict:
+        """The fields of values to send"""
+        now = time.monotonic() if now is None else now
+        if self._keyframe is None or now - self._keyframe >= self.heartbeat:
+            self._keyframe = now
+            passed = dict(values)
+        else:
+            passed = {name: value for name, value in values.items() if self._moved(name, value)}
+        # Against the value last sent, so a slow drift still gets out
+        self.sent.update(passed)
+        return passed
+
+
+class SnapshotPublisher:
+    def __init__(self, publisher, topic, encoding='json', deadband=None, baseline='json', qos=None):
+        """Publish snapshots through a moda.mqtt.Publisher on topic
+
+        encoding is one of ENCODINGS, deadband a Deadband (None sends every
+        field of every snapshot) and baseline the layout bytes saved are
+        counted against, 'topics' or 'json'.
+        """
+        self.publisher = publisher
+        self.topic = topic.rstrip('/')
+        self.encoding = encoding
+        self.encode = None if encoding == 'topics' else encoder(encoding)
+        self.deadband = deadband
+        self.baseline = baseline
+        self.qos = publisher.qos if qos is None else qos
+        # Baseline bytes less bytes sent; SAVED follows it while it grows
+        self._balance = 0
+        self._saved = 0
+        for result in ('sent', 'suppressed'):
+            MESSAGES.labels(self.topic, result)
+            FIELDS.labels(self.topic, result)
+        BYTES.labels(self.topic)
+        BASELINE.labels(self.topic)
+        SAVED.labels(self.topic)
+
+    def _topics(self, values):
+        return [('{}/{}'.format(self.topic, name), str(value)) for name, value in values.items()]
+
+    def _baseline(self, values, meta) -> int:
+        if self.baseline == 'topics':
+            return sum(packet_size(topic, payload, self.qos) for topic, payload in self._topics(values))
+        return packet_size(self.topic, json.dumps(dict(values, **meta)), self.qos)
+
+    def publish(self, values, meta=None) -> bool:
+        """Publish the fields of values that moved; whether a message went out
+
+        meta (a timestamp, a sequence number) goes along with every packed
+        message but never makes one go out by itself.
+        """
+        meta = meta or {}
+        baseline = self._baseline(values, meta)
+        if self.encoding != 'topics':
+            values = {name: compact(value) for name, value in values.items()}
+        passed = values if self.deadband is None else self.deadband.filter(values)
+        FIELDS.labels(self.topic, 'sent').inc(len(passed))
+        FIELDS.labels(self.topic, 'suppressed').inc(len(values) - len(passed))
+
+        if not passed:
+            messages = []
+        elif self.encoding == 'topics':
+            messages = self._topics(passed)
+        else:
+            meta = {name: compact(value) for name, value in meta.items()}
+            messages = [(self.topic, self.encode(dict(passed, **meta)))]
+        sent = 0
+        for topic, payload in messages:
+            self.publisher.publish(topic, payload, self.qos)
+            sent += packet_size(topic, payload, self.qos)
+
+        MESSAGES.labels(self.topic, 'sent' if messages else 'suppressed').inc()
+        BYTES.labels(self.topic).inc(sent)
+        BASELINE.labels(self.topic).inc(baseline)
+        self._balance += baseline - sent
+        if self._balance > self._saved:
+            SAVED.labels(self.topic).inc(self._balance - self._saved)
+            self._saved = self._balance
+        return bool(messages)
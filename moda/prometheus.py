@@ -0,0 +1,151 @@
+"""Minimal Prometheus HTTP API client for scripts that read a few scalars
+
+Uses only the standard library, so a display script doesn't pay for
+prometheus_api_client and pandas (seconds of import time on a Pi Zero)
+to fetch a handful of values.
+
+get_values() fetches every value a display needs in one instant query and
+remembers the last good value of each, optionally in a file across runs,
+so a slow or unreachable Prometheus leaves the previous values on screen
+instead of nothing.
+
+The client keeps its HTTP connection open between queries, so a resident
+display doesn't pay a TCP handshake per refresh.
+"""
+
+import http.client
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+
+def selector(metric, labels=None) -> str:
+    """PromQL instant vector selector for a metric and exact-match labels"""
+    if not labels:
+        return metric
+    matchers = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for key, value in sorted(labels.items()))
+    return '{}{{{}}}'.format(metric, matchers)
+
+
+def union_selector(wanted) -> str:
+    """One selector matching every (metric, labels) of wanted, and then some
+
+    A regex on __name__ and on each label, since an `or` of the selectors
+    would drop series that only differ by metric name.
+    """
+    names = sorted({metric for metric, _ in wanted})
+    matchers = ['__name__=~"{}"'.format('|'.join(re.escape(name) for name in names))]
+    keys = sorted({key for _, labels in wanted for key in (labels or {})})
+    for key in keys:
+        if all(key in (labels or {}) for _, labels in wanted):
+            values = sorted({str(labels[key]) for _, labels in wanted})
+            matchers.append('{}=~"{}"'.format(key, '|'.join(re.escape(value) for value in values).replace('\\', '\\\\').replace('"', '\\"')))
+    return '{{{}}}'.format(','.join(matchers))
+
+
+class PrometheusClient:
+    def __init__(self, url, timeout=10, cache=None):
+        """Client for the Prometheus at url
+
+        cache is a JSON file keeping the last good values of get_values()
+        for the next run of a one-shot script.
+        """
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        parts = urllib.parse.urlsplit(self.url)
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self._prefix = parts.path
+        self._connection = None
+        self._lock = threading.Lock()
+        self.cache = cache
+        # key: (value, time it was fetched)
+        self.last_good = {}
+        if cache and os.path.exists(cache):
+            try:
+                with open(cache) as f:
+                    self.last_good = {key: tuple(entry) for key, entry in json.load(f).items()}
+            except (OSError, ValueError):
+                logging.warning("Ignoring unreadable value cache {}".format(cache))
+
+    def query(self, promql) -> list:
+        """Instant query, returning the result vector"""
+        status, body = self._get('{}/api/v1/query?{}'.format(self._prefix, urllib.parse.urlencode({'query': promql})))
+        try:
+            body = json.loads(body)
+        except ValueError:
+            raise ValueError('Prometheus query {} failed: HTTP {}'.format(promql, status))
+        if body.get('status') != 'success':
+            raise ValueError('Prometheus query {} failed: {}'.format(promql, body.get('error')))
+        return body['data']['result']
+
+    def _get(self, path):
+        """(status, body) of a GET on the kept-alive connection
+
+        A connection the server closed while idle is reopened once.
+        """
+        with self._lock:
+            for _ in range(2):
+                fresh = self._connection is None
+                if fresh:
+                    self._connection = self._connection_class(self._netloc, timeout=self.timeout)
+                try:
+                    self._connection.request('GET', path)
+                    response = self._connection.getresponse()
+                    return response.status, response.read()
+                except (OSError, http.client.HTTPException) as exception:
+                    self.close()
+                    if fresh or isinstance(exception, TimeoutError):
+                        if isinstance(exception, http.client.HTTPException):
+                            raise OSError(exception) from exception
+                        raise
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get_value(self, metric, labels=None) -> str:
+        """Current value of the first series matching metric and labels, as Prometheus formats it"""
+        result = self.query(selector(metric, labels))
+        if not result:
+            raise ValueError('No series for {}'.format(selector(metric, labels)))
+        return result[0]['value'][1]
+
+    def get_values(self, wanted) -> dict:
+        """Current values for a dict of key: (metric, labels), as floats, in one query
+
+        A key without a matching series, or every key when Prometheus
+        can't be reached in time, gets its last good value instead; keys
+        never fetched successfully are left out.
+        """
+        fetched = {}
+        try:
+            result = self.query(union_selector(wanted.values()))
+        except (OSError, ValueError) as exception:
+            logging.warning("Prometheus query failed, using the last good values: {}".format(exception))
+            result = []
+        for key, (metric, labels) in wanted.items():
+            for series in result:
+                names = series['metric']
+                if names.get('__name__') == metric and all(names.get(label) == str(value) for label, value in (labels or {}).items()):
+                    fetched[key] = float(series['value'][1])
+                    break
+
+        if fetched:
+            now = time.time()
+            self.last_good.update((key, (value, now)) for key, value in fetched.items())
+            if self.cache:
+                with open(self.cache + '.tmp', 'w') as f:
+                    json.dump(self.last_good, f)
+                os.replace(self.cache + '.tmp', self.cache)
+        return {key: self.last_good[key][0] for key in wanted if key in self.last_good}
+
+    def age(self, key) -> float:
+        """Seconds since the value of key was last fetched successfully"""
+        return time.time() - self.last_good[key][1]
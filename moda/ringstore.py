@@ -0,0 +1,240 @@
+"""On-device history of the readings in memory-mapped ring files
+
+Each series (a metric name with its labels, e.g. PM25 or
+voltage{slave="1"}) has a fixed-size file holding a small header and
+capacity records of a float64 timestamp and a float32 value. The file is
+sized for the retention once and memory-mapped, so an append is a
+struct.pack_into into the map and a counter update, without allocating or
+growing anything. When the ring is full the oldest records are
+overwritten.
+
+start_http_server() serves /query next to /metrics, for displays and
+scripts to read recent history without Prometheus, and for Prometheus to
+be backfilled from after an outage (format=openmetrics, for promtool tsdb
+create-blocks-from openmetrics):
+
+    /query                                      the series stored
+    /query?metric=PM25&from=-3600&step=60       last hour, 1 minute means
+    /query?metric=PM25&from=1700000000&to=1700086400&step=300&agg=max
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import urllib.parse
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIRequestHandler, WSGIServer
+
+from prometheus_client import REGISTRY, make_wsgi_app
+
+MAGIC = b'MODARING'
+VERSION = 1
+# magic, version, capacity, records appended so far
+HEADER = struct.Struct('<8sIIQ')
+COUNT = struct.Struct('<Q')
+COUNT_OFFSET = 16
+RECORD = struct.Struct('<df')
+
+AGGREGATIONS = ('mean', 'min', 'max', 'last')
+
+
+def series_name(name, labels=None) -> str:
+    """name{label="value",...}, the way Prometheus writes a series"""
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(key, value) for key, value in sorted(labels.items())))
+
+
+class RingFile:
+    def __init__(self, path, capacity):
+        """Open the ring file at path, creating it with room for capacity records
+
+        An existing file keeps the capacity it was created with.
+        """
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < HEADER.size:
+                os.ftruncate(fd, HEADER.size + capacity * RECORD.size)
+                os.pwrite(fd, HEADER.pack(MAGIC, VERSION, capacity, 0), 0)
+            magic, version, self.capacity, _ = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("{} is not a version {} ring file".format(path, VERSION))
+            if self.capacity != capacity:
+                logging.info("{} keeps its capacity of {} records".format(path, self.capacity))
+            self.map = mmap.mmap(fd, HEADER.size + self.capacity * RECORD.size)
+        finally:
+            os.close(fd)
+        self.count = COUNT.unpack_from(self.map, COUNT_OFFSET)[0]
+
+    def append(self, timestamp, value):
+        RECORD.pack_into(self.map, HEADER.size + self.count % self.capacity * RECORD.size, timestamp, value)
+        # The record is in place before the count says so
+        self.count += 1
+        COUNT.pack_into(self.map, COUNT_OFFSET, self.count)
+
+    def records(self):
+        """(timestamps, values) of the records held, oldest first, as NumPy arrays"""
+        import numpy as np
+        dtype = np.dtype([('t', '<f8'), ('v', '<f4')])
+        held = min(self.count, self.capacity)
+        records = np.frombuffer(self.map, dtype, count=held, offset=HEADER.size)
+        # Rotate so the oldest record (the next one to be overwritten) comes first
+        records = np.roll(records, -(self.count % self.capacity)) if self.count > self.capacity else records.copy()
+        return records['t'], records['v']
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+
+
+class RingStore:
+    def __init__(self, directory, retention=7 * 86400, interval=15):
+        """Ring files in directory, each holding retention seconds of readings taken every interval"""
+        self.directory = directory
+        self.retention = retention
+        self.capacity = int(math.ceil(retention / interval))
+        self._files = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, series):
+        return os.path.join(self.directory, urllib.parse.quote(series, safe='') + '.ring')
+
+    def _file(self, series) -> RingFile:
+        ring = self._files.get(series)
+        if ring is None:
+            ring = self._files[series] = RingFile(self._path(series), self.capacity)
+        return ring
+
+    def series(self) -> list:
+        """Every series with a ring file in the directory"""
+        return sorted(urllib.parse.unquote(name[:-len('.ring')]) for name in os.listdir(self.directory) if name.endswith('.ring'))
+
+    def append(self, series, value, timestamp=None):
+        with self._lock:
+            self._file(series).append(time.time() if timestamp is None else timestamp, value)
+
+    def record(self, collectors, timestamp=None):
+        """Append every sample the Prometheus collectors currently expose, and flush"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for collector in collectors:
+                for family in collector.collect():
+                    for sample in family.samples:
+                        if not math.isnan(sample.value):
+                            self._file(series_name(sample.name, sample.labels)).append(timestamp, sample.value)
+            for ring in self._files.values():
+                ring.flush()
+
+    def query(self, series, start, end, step=None, agg='mean'):
+        """(timestamps, values) of series between start and end, in step buckets aggregated with agg
+
+        A bucket is stamped with its start; empty buckets are left out.
+        """
+        import numpy as np
+        if agg not in AGGREGATIONS:
+            raise ValueError("agg must be one of {}".format(', '.join(AGGREGATIONS)))
+        with self._lock:
+            if series not in self._files and not os.path.exists(self._path(series)):
+                raise KeyError(series)
+            times, values = self._file(series).records()
+        start = max(start, time.time() - self.retention)
+        selected = (times >= start) & (times <= end)
+        times, values = times[selected], values[selected].astype(float)
+        if not step or not len(times):
+            return times, values
+
+        buckets = ((times - start) // step).astype(np.int64)
+        firsts = np.flatnonzero(np.diff(buckets, prepend=-1))
+        if agg == 'mean':
+            values = np.add.reduceat(values, firsts) / np.diff(np.append(firsts, len(buckets)))
+        elif agg == 'min':
+            values = np.minimum.reduceat(values, firsts)
+        elif agg == 'max':
+            values = np.maximum.reduceat(values, firsts)
+        else:
+            values = values[np.append(firsts[1:], len(buckets)) - 1]
+        return start + buckets[firsts] * step, values
+
+
+def _number(parameters, name, default, now):
+    """A query parameter as a number, negative ones relative to now"""
+    if name not in parameters:
+        return default
+    value = float(parameters[name][0])
+    if not math.isfinite(value):
+        raise ValueError("{} must be a finite number".format(name))
+    return now + value if value < 0 else value
+
+
+def make_query_app(store, metrics_app):
+    """WSGI app answering /query from store and everything else with metrics_app"""
+    def app(environ, start_response):
+        if environ.get('PATH_INFO') != '/query':
+            return metrics_app(environ, start_response)
+
+        parameters = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+        now = time.time()
+        try:
+            if 'metric' not in parameters:
+                body, content_type = json.dumps({'series': store.series()}), 'application/json'
+            else:
+                series = parameters['metric'][0]
+                start = _number(parameters, 'from', now - 3600, now)
+                end = _number(parameters, 'to', now, now)
+                if start > end:
+                    raise ValueError("from must not be after to")
+                # A length of time, never relative to now
+                step = float(parameters['step'][0]) if 'step' in parameters else None
+                if step is not None and not (step > 0 and math.isfinite(step)):
+                    raise ValueError("step must be a positive number of seconds")
+                agg = parameters.get('agg', ['mean'])[0]
+                times, values = store.query(series, start, end, step, agg)
+                # Values are stored as float32, good for about 7 digits
+                values = [float('{:.7g}'.format(value)) for value in values.tolist()]
+                if parameters.get('format', ['json'])[0] == 'openmetrics':
+                    lines = ['{} {!r} {:.3f}'.format(series, value, timestamp) for timestamp, value in zip(times.tolist(), values)]
+                    body, content_type = '\n'.join(lines + ['# EOF', '']), 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+                else:
+                    body = json.dumps({
+                        'metric': series, 'from': start, 'to': end, 'step': step, 'agg': agg,
+                        'points': [[timestamp, value] for timestamp, value in zip(times.tolist(), values)],
+                    })
+                    content_type = 'application/json'
+        except KeyError:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'No such series\n']
+        except ValueError as exception:
+            start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            return [str(exception).encode() + b'\n']
+        start_response('200 OK', [('Content-Type', content_type)])
+        return [body.encode()]
+    return app
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _SilentHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, addr='0.0.0.0', store=None, registry=REGISTRY):
+    """prometheus_client.start_http_server, plus /query when store is given"""
+    app = make_wsgi_app(registry)
+    if store is not None:
+        app = make_query_app(store, app)
+    server = make_server(addr, port, app, _ThreadingWSGIServer, handler_class=_SilentHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
@@ -0,0 +1,113 @@
+"""Monotonic multi-rate scheduler for sensor polling
+
+Each task runs on its own fixed grid (start + n * interval), so the time a
+read takes never pushes later samples back. A task that falls behind skips
+the ticks it missed instead of running them back to back.
+"""
+
+import logging
+import math
+import threading
+import time
+
+# Longest pause of a stream whose source keeps failing
+MAX_STREAM_BACKOFF = 60
+
+
+class Task:
+    __slots__ = ("name", "function", "interval", "next_run", "lag", "skipped", "missed", "runs", "duration")
+
+    def __init__(self, name, function, interval, next_run):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.next_run = next_run
+        self.lag = 0.0
+        # Ticks skipped just before the latest run, and in total
+        self.skipped = 0
+        self.missed = 0
+        self.runs = 0
+        self.duration = 0.0
+
+    def __repr__(self):
+        return "Task({!r}, interval={})".format(self.name, self.interval)
+
+
+class Scheduler:
+    def __init__(self, observer=None, clock=time.monotonic, sleep=time.sleep):
+        """Run tasks at their own rates
+
+        observer, when set, is called with each task after it has run, from
+        the thread that ran it.
+        """
+        self.tasks = []
+        self.streams = []
+        self.observer = observer
+        self.clock = clock
+        self.sleep = sleep
+
+    def every(self, interval, function, name=None, offset=0.0) -> Task:
+        """Run function every interval seconds, first after offset seconds"""
+        if interval <= 0:
+            raise ValueError("interval must be positive, use stream() for continuous sources")
+        task = Task(name or function.__name__, function, interval, self.clock() + offset)
+        self.tasks.append(task)
+        return task
+
+    def stream(self, function, name=None) -> Task:
+        """Run a blocking source (one that waits for its own data) in a loop on its own thread"""
+        task = Task(name or function.__name__, function, 0, self.clock())
+        self.streams.append(task)
+        return task
+
+    def _run(self, task, now) -> bool:
+        """Run task once, whether it succeeded"""
+        start = self.clock()
+        task.lag = max(0.0, start - now)
+        ok = True
+        try:
+            task.function()
+        except Exception:
+            logging.exception("Scheduled task {} failed".format(task.name))
+            ok = False
+        task.duration = self.clock() - start
+        task.runs += 1
+        if self.observer is not None:
+            self.observer(task)
+        return ok
+
+    def run_pending(self) -> float:
+        """Run every task that is due and return the seconds until the next one"""
+        for task in sorted(self.tasks, key=lambda task: task.next_run):
+            now = self.clock()
+            if task.next_run > now:
+                continue
+            task.next_run += task.interval
+            task.skipped = 0
+            if task.next_run <= now:
+                task.skipped = math.floor((now - task.next_run) / task.interval) + 1
+                task.missed += task.skipped
+                task.next_run += task.skipped * task.interval
+            # Lag is measured from the latest tick this run stands in for
+            self._run(task, task.next_run - task.interval)
+
+        if not self.tasks:
+            return 1.0
+        return max(0.0, min(task.next_run for task in self.tasks) - self.clock())
+
+    def _stream(self, task):
+        failures = 0
+        while True:
+            if self._run(task, self.clock()):
+                failures = 0
+                continue
+            # An unplugged sensor fails straight away: don't spin on it,
+            # 1 s then doubling up to MAX_STREAM_BACKOFF
+            failures += 1
+            self.sleep(min(2 ** (failures - 1), MAX_STREAM_BACKOFF))
+
+    def run_forever(self) -> None:
+        for task in self.streams:
+            threading.Thread(target=self._stream, args=(task,), name=task.name, daemon=True).start()
+        while True:
+            self.sleep(self.run_pending())
@@ -0,0 +1,98 @@
+"""Consistent reading snapshots shared between the poll loop and its sinks
+
+The poll loop writes values into a SnapshotStore as it reads sensors and
+calls publish() once a cycle is complete. publish() freezes the values into
+an immutable Snapshot and swaps it in with a single reference assignment,
+so Prometheus, InfluxDB, Luftdaten, MQTT and debug logging always see every
+field from the same cycle, without locks on the read side.
+"""
+
+import math
+import threading
+import time
+from array import array
+
+from prometheus_client.core import GaugeMetricFamily
+
+NAN = float("nan")
+
+
+class Snapshot:
+    __slots__ = ("index", "values", "sequence", "timestamp")
+
+    def __init__(self, index, values, sequence, timestamp):
+        self.index = index
+        self.values = values
+        self.sequence = sequence
+        self.timestamp = timestamp
+
+    def __getitem__(self, name) -> float:
+        return self.values[self.index[name]]
+
+    def get(self, name, default=None):
+        value = self.values[self.index[name]]
+        return default if math.isnan(value) else value
+
+    def as_dict(self) -> dict:
+        """Every field that has been set, by name"""
+        return {name: self.values[i] for name, i in self.index.items() if not math.isnan(self.values[i])}
+
+    def __repr__(self):
+        return "Snapshot(sequence={}, timestamp={}, {})".format(self.sequence, self.timestamp, self.as_dict())
+
+
+class SnapshotStore:
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self._pending = array("d", [NAN] * len(self.fields))
+        self._lock = threading.Lock()
+        self._latest = Snapshot(self.index, tuple(self._pending), 0, 0.0)
+
+    def update(self, values):
+        """Set every known field present in values at once, ignoring the rest"""
+        with self._lock:
+            for name, value in values.items():
+                i = self.index.get(name)
+                if i is not None:
+                    self._pending[i] = value
+
+    def publish(self, timestamp=None) -> Snapshot:
+        """Make the values set so far visible to readers as one snapshot"""
+        with self._lock:
+            snapshot = Snapshot(
+                self.index,
+                tuple(self._pending),
+                self._latest.sequence + 1,
+                time.time() if timestamp is None else timestamp,
+            )
+            self._latest = snapshot
+        return snapshot
+
+    def snapshot(self) -> Snapshot:
+        return self._latest
+
+
+class SnapshotCollector:
+    def __init__(self, metrics, stores, labelnames=()):
+        """Expose snapshot fields as Prometheus gauges
+
+        metrics is a sequence of (field, metric name, help) tuples. stores
+        is a single SnapshotStore, or a dict of label value tuples to stores
+        when labelnames is given. Fields that were never set are left out.
+        """
+        self.metrics = tuple(metrics)
+        self.stores = stores
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        families = [GaugeMetricFamily(name, documentation, labels=self.labelnames) for _, name, documentation in self.metrics]
+        stores = self.stores.items() if isinstance(self.stores, dict) else [((), self.stores)]
+
+        for labels, store in list(stores):
+            snapshot = store.snapshot()
+            for family, (field, _, _) in zip(families, self.metrics):
+                value = snapshot[field]
+                if not math.isnan(value):
+                    family.add_metric(labels, value)
+        return families
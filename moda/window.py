@@ -0,0 +1,113 @@
+"""Windowed summaries of fast sampled readings
+
+A sensor read several times a second between two Prometheus scrapes
+loses every value but the last one. A WindowBuffer keeps the latest
+readings of a few fields in a fixed NumPy ring (one row per read, NaN for
+the fields a read did not set), and a WindowCollector exports the min,
+max, mean, standard deviation and 95th percentile of each field over the
+last window seconds at every scrape, computed over the whole ring at once.
+Set the window to the scrape interval to see every sample exactly once.
+"""
+
+import threading
+import time
+import warnings
+
+import numpy as np
+from prometheus_client.core import GaugeMetricFamily
+
+STATS = ('min', 'max', 'mean', 'stddev', 'p95')
+
+
+class WindowBuffer:
+    def __init__(self, fields, capacity=1024):
+        """Ring of the last capacity readings of fields
+
+        A window only sees the readings still in the ring: size it for the
+        sample rate times the window.
+        """
+        self.fields = tuple(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.capacity = capacity
+        self.values = np.full((capacity, len(self.fields)), np.nan)
+        self.times = np.full(capacity, -np.inf)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def append(self, values, timestamp=None):
+        """Add one reading: the known fields of the values dict, ignoring the rest"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            row = self.values[self.count % self.capacity]
+            row.fill(np.nan)
+            for name, value in values.items():
+                i = self.index.get(name)
+                if i is not None:
+                    row[i] = value
+            self.times[self.count % self.capacity] = timestamp
+            self.count += 1
+
+    def window(self, since):
+        """Copy of the rows read at or after since, in ring order"""
+        with self._lock:
+            return self.values[self.times >= since]
+
+    def summary(self, since) -> dict:
+        """Per-field samples and STATS since the given time, as arrays in field order"""
+        rows = self.window(since)
+        samples = np.count_nonzero(~np.isnan(rows), axis=0)
+        if not len(rows):
+            empty = np.full(len(self.fields), np.nan)
+            return dict({stat: empty for stat in STATS}, samples=samples)
+        with warnings.catch_warnings():
+            # Fields without a sample in the window come out as NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return {
+                'samples': samples,
+                'min': np.nanmin(rows, axis=0),
+                'max': np.nanmax(rows, axis=0),
+                'mean': np.nanmean(rows, axis=0),
+                'stddev': np.nanstd(rows, axis=0),
+                'p95': np.nanpercentile(rows, 95, axis=0),
+            }
+
+
+class WindowCollector:
+    def __init__(self, metrics, buffers, window=15.0, clock=time.time):
+        """Export windowed STATS of the fields of metrics held by buffers
+
+        metrics is a sequence of (field, metric name, help) tuples, as for
+        SnapshotCollector; each field is exported as <name>_window with a
+        stat label, and <name>_window_samples. Fields no buffer holds are
+        left out.
+        """
+        self.buffers = list(buffers)
+        self.window = window
+        self.clock = clock
+        self.metrics = [
+            (buffer, buffer.index[field], name, documentation)
+            for field, name, documentation in metrics
+            for buffer in self.buffers if field in buffer.index
+        ]
+
+    def describe(self):
+        return self._families()
+
+    def _families(self):
+        families = []
+        for _, _, name, documentation in self.metrics:
+            families.append(GaugeMetricFamily(name + '_window', '{} over the last {:g}s'.format(documentation, self.window), labels=['stat']))
+            families.append(GaugeMetricFamily(name + '_window_samples', 'Samples of {} in the last {:g}s'.format(name, self.window)))
+        return families
+
+    def collect(self):
+        since = self.clock() - self.window
+        summaries = {id(buffer): buffer.summary(since) for buffer in self.buffers}
+        families = self._families()
+        for (buffer, i, _, _), stats, samples in zip(self.metrics, families[::2], families[1::2]):
+            summary = summaries[id(buffer)]
+            samples.add_metric([], summary['samples'][i])
+            if summary['samples'][i]:
+                for stat in STATS:
+                    stats.add_metric([stat], summary[stat][i])
+        return families
@@ -0,0 +1,157 @@
+"""Poll several Modbus meters sharing one RS485 bus from a single process
+
+Every meter on the bus goes through one persistent serial connection. The
+scheduler polls the highest priority meter that is due, oldest deadline
+first, so meters with equal priority and no interval are polled
+round-robin as fast as the bus allows. A due meter gains a step of
+priority every time it is passed over, so a higher priority meter is
+polled ahead of the others but never starves them: with no interval,
+priority 5 against 0 gets five polls for every one of the other. Meters
+that stop answering back off exponentially and only cost their own
+(short) timeout when retried.
+"""
+
+import logging
+import math
+import time
+
+from pzem import PZEM_016
+
+
+class Slave:
+    __slots__ = (
+        "meter",
+        "interval",
+        "timeout",
+        "priority",
+        "next_due",
+        "failures",
+        "missed",
+        "passed_over",
+        "reading",
+        "duration",
+    )
+
+    def __init__(self, meter, interval, timeout, priority):
+        self.meter = meter
+        self.interval = interval
+        self.timeout = timeout
+        self.priority = priority
+        self.next_due = 0.0
+        self.failures = 0
+        self.missed = 0
+        # Polls given to other slaves while this one was due
+        self.passed_over = 0
+        self.reading = None
+        self.duration = 0.0
+
+    @property
+    def address(self) -> int:
+        return self.meter.address
+
+    @property
+    def up(self) -> bool:
+        return self.failures == 0 and self.reading is not None
+
+    def __repr__(self):
+        return "Slave(address={}, interval={}, priority={})".format(
+            self.address, self.interval, self.priority
+        )
+
+
+class Bus:
+    def __init__(self, port, meter_class=PZEM_016, gap=0.005, timeout=0.1, max_backoff=60):
+        """Scheduler for the meters on one serial port
+
+        gap is the idle time enforced between the end of one transaction and
+        the start of the next, on top of the Modbus 3.5 character silence.
+        timeout is the default per-slave response timeout and max_backoff
+        caps how long a dead meter is left alone before it is retried.
+        """
+        self.port = port
+        self.meter_class = meter_class
+        self.gap = gap
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.slaves = {}
+        self._last_frame = 0.0
+
+    def add(self, address, interval=0, timeout=None, priority=0, profile=None) -> Slave:
+        meter = self.meter_class(self.port, address, profile=profile)
+        # minimalmodbus shares one serial instance per port name, keep it open
+        meter.close_port_after_each_call = False
+
+        slave = Slave(meter, interval, timeout or self.timeout, priority)
+        slave.next_due = time.monotonic()
+        self.slaves[address] = slave
+        return slave
+
+    def next_slave(self, now):
+        """Return the slave to poll now, or the time the next one is due"""
+        due = [slave for slave in self.slaves.values() if slave.next_due <= now]
+        if not due:
+            return None, min(slave.next_due for slave in self.slaves.values())
+        chosen = min(due, key=lambda slave: (-slave.priority - slave.passed_over, slave.next_due))
+        for slave in due:
+            slave.passed_over += 1
+        chosen.passed_over = 0
+        return chosen, now
+
+    def poll(self, slave):
+        """Read one slave, rescheduling it and recording the outcome"""
+        wait = self._last_frame + self.gap - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        meter = slave.meter
+        meter.serial.timeout = slave.timeout
+        start = time.monotonic()
+        try:
+            reading = meter.read()
+        except (IOError, ValueError) as exception:
+            reading = None
+            self._failed(slave, exception)
+        finally:
+            end = self._last_frame = time.monotonic()
+            slave.duration = end - start
+        return self._reschedule(slave, reading, end)
+
+    def _failed(self, slave, exception):
+        if slave.failures == 0:
+            logging.warning("Slave {} on {} stopped responding: {}".format(slave.address, self.port, exception))
+        slave.failures += 1
+
+    def _reschedule(self, slave, reading, end):
+        """Record the outcome of a poll that ended at end and set the next deadline"""
+        if reading is None:
+            backoff = max(slave.interval, slave.timeout) * 2 ** min(slave.failures, 16)
+            slave.next_due = end + min(backoff, self.max_backoff)
+            return None
+
+        if slave.failures:
+            logging.info("Slave {} on {} is back after {} failed polls".format(slave.address, self.port, slave.failures))
+        slave.failures = 0
+        slave.reading = reading
+
+        if slave.interval:
+            # Stay on the original grid and skip ticks we were too late for
+            slave.next_due += slave.interval
+            if slave.next_due <= end:
+                missed = math.floor((end - slave.next_due) / slave.interval) + 1
+                slave.missed += missed
+                slave.next_due += missed * slave.interval
+        else:
+            slave.next_due = end
+        return reading
+
+    def run(self, callback) -> None:
+        """Poll forever, calling callback(slave, reading) after every poll
+
+        reading is None when the slave did not answer.
+        """
+        while True:
+            slave, due = self.next_slave(time.monotonic())
+            if slave is None:
+                time.sleep(max(0.0, due - time.monotonic()))
+                continue
+            callback(slave, self.poll(slave))
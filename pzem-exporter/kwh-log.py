@@ -3,10 +3,8 @@
 import sys
 import os
 import logging
+import argparse
 
-from prometheus_api_client import PrometheusConnect,  MetricSnapshotDataFrame
-
-prom = PrometheusConnect(url ='http://192.168.0.103:9090', disable_ssl=True)
 PATH = os.path.dirname(__file__)
 
 # energy{group="environment", instance="192.168.0.137:8002", job="environment", location="pzem-016"}
@@ -18,18 +16,34 @@ logging.basicConfig(
               logging.StreamHandler()],
     datefmt='%Y-%m-%d %H:%M:%S')
 
-kwh_label_config = {'location': 'pzem-016'}
+parser = argparse.ArgumentParser(description="Log the PZEM energy counter")
+parser.add_argument("--device", metavar="DEVICE", help="read the meter directly on this serial port instead of querying Prometheus")
+parser.add_argument("--slave", default=1, type=int, help="modbus slave address of the meter (default: 1)")
+parser.add_argument("--ledger", metavar="DIR", help="log today's kWh from the exporter's energy ledger in DIR instead")
+args = parser.parse_args()
+
+if args.ledger:
+    from moda.energy import EnergyLedger
+
+    # The exporter's own daily total, no meter or Prometheus involved
+    ledger = EnergyLedger(os.path.join(args.ledger, "pzem-{}.json".format(args.slave)))
+    wh = ledger.total('day')
+elif args.device:
+    from pzem import PZEM_016
+
+    # One block read of the input registers, same path as the exporter
+    wh = PZEM_016(args.device, args.slave).read()["energy"]
+else:
+    from moda.prometheus import PrometheusClient
 
-kwh_data = prom.get_current_metric_value(
-    metric_name='energy',
-    label_config=kwh_label_config,
-)
+    prom = PrometheusClient('http://192.168.0.103:9090', timeout=3)
 
-df_kwh= MetricSnapshotDataFrame(kwh_data)
+    kwh_label_config = {'location': 'pzem-016'}
 
-p_kwh = df_kwh.head()
+    wh = float(prom.get_value('energy', kwh_label_config))
 
-kwh = p_kwh['value'].to_string(index=False)
+# The ledger, the register and the gauge all count Wh
+kwh = "{:.3f}".format(wh / 1000)
 
 logging.info(kwh)
 
@@ -1,8 +1,17 @@
 #!/usr/bin/python3
 
-import minimalmodbus
+import argparse
+import logging
 
-pz = minimalmodbus.Instrument('/dev/ttyUSB0', 1)
-pz.serial.baudrate = 9600
+from pzem import PZEM_016
 
-pz._perform_command(66, '')
+parser = argparse.ArgumentParser(description="Zero the PZEM energy counter")
+parser.add_argument("--device", default="/dev/ttyUSB0", help="serial port of the meter (default: /dev/ttyUSB0)")
+parser.add_argument("--slave", default=1, type=int, help="modbus slave address of the meter (default: 1)")
+args = parser.parse_args()
+
+# The exporter's energy ledger sees the counter go back to zero and keeps
+# its totals; stop the exporter first, the meter is on one serial port
+if not PZEM_016(args.device, args.slave).reset_energy():
+    logging.error("The meter did not reset its energy counter")
+    raise SystemExit(1)
@@ -0,0 +1,255 @@
+"""Declarative register maps for RS485 Modbus energy meters
+
+A profile lists the fields a meter exposes with their register address,
+width (in 16-bit registers), scale and signedness. compile_plan() turns a
+profile into a ReadPlan: the fewest block reads that cover every field,
+each with a precompiled struct layout to decode the response bytes.
+"""
+
+import struct
+from collections import namedtuple
+
+HOLDING = 3
+INPUT = 4
+
+# Request: address, function, start (2), count (2), CRC (2)
+REQUEST_BYTES = 8
+# Response: address, function, byte count, CRC (2) plus the register data
+RESPONSE_OVERHEAD = 5
+# Longest register block a single Modbus read may request
+MAX_REGISTERS = 125
+
+# struct codes for registers decoded in one piece, by width and signedness
+_FORMATS = {
+    (1, False): "H", (1, True): "h",
+    (2, False): "I", (2, True): "i",
+    (4, False): "Q", (4, True): "q",
+}
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data) -> int:
+    """Modbus CRC16 of data, sent low byte first"""
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+Field = namedtuple("Field", "name address width scale signed function cast")
+Field.__new__.__defaults__ = (1, 1, False, INPUT, None)
+
+
+class Profile:
+    def __init__(self, name, fields, settings=(), word_order="little", max_gap=0):
+        """Register map of one meter model
+
+        fields are polled on every read, settings are configuration
+        registers that only change when written. word_order is "little" when
+        the low word of a 32-bit value comes first, as on the PZEM range.
+        max_gap is the number of unmapped registers a block may read across,
+        for meters that answer reads over holes in their map.
+        """
+        self.name = name
+        self.fields = tuple(fields)
+        self.settings = tuple(settings)
+        self.word_order = word_order
+        self.max_gap = max_gap
+
+    def __repr__(self):
+        return "Profile({!r})".format(self.name)
+
+
+class Block:
+    __slots__ = ("function", "address", "count", "request", "layout", "fields")
+
+    def __init__(self, function, address, count, layout, fields):
+        self.function = function
+        self.address = address
+        self.count = count
+        self.request = struct.pack(">HH", address, count)
+        self.layout = layout
+        self.fields = fields
+
+    @property
+    def response_bytes(self):
+        return RESPONSE_OVERHEAD + 2 * self.count
+
+    def decode(self, data, reading, offset=0):
+        """Decode the register bytes of this block into reading"""
+        values = self.layout.unpack_from(data, offset)
+        for name, index, words, sign_bit, scale, decimals, cast in self.fields:
+            if words:
+                # Low word first: stitch the registers back together
+                value = 0
+                for word in range(words):
+                    value |= values[index + word] << (16 * word)
+                if sign_bit and value & sign_bit:
+                    value -= sign_bit << 1
+            else:
+                value = values[index]
+
+            if cast is not None:
+                value = cast(value)
+            elif scale != 1:
+                value = round(value * scale, decimals)
+
+            reading[name] = value
+        return reading
+
+    def __repr__(self):
+        return "Block(function={}, address={}, count={})".format(
+            self.function, self.address, self.count
+        )
+
+
+class ReadPlan:
+    def __init__(self, blocks):
+        self.blocks = tuple(blocks)
+
+    @property
+    def transactions(self):
+        return len(self.blocks)
+
+    @property
+    def request_bytes(self):
+        return REQUEST_BYTES * len(self.blocks)
+
+    @property
+    def response_bytes(self):
+        return sum(block.response_bytes for block in self.blocks)
+
+    def wire_time(self, baudrate=9600, bits_per_byte=10):
+        """Lower bound on bus time per poll, including inter-frame gaps"""
+        char_time = bits_per_byte / baudrate
+        frames = 2 * self.transactions
+        return (self.request_bytes + self.response_bytes + 3.5 * frames) * char_time
+
+    def decode(self, responses, offset=0):
+        """Decode one register payload per block into a single reading"""
+        reading = {}
+        for block, data in zip(self.blocks, responses):
+            block.decode(data, reading, offset)
+        return reading
+
+    def __str__(self):
+        return "{} transaction(s), {} bytes out, {} bytes in, {:.1f} ms at 9600 baud".format(
+            self.transactions,
+            self.request_bytes,
+            self.response_bytes,
+            self.wire_time() * 1000,
+        )
+
+
+def _decimals(scale):
+    """Digits needed to show a value at the resolution of its scale"""
+    for decimals in range(10):
+        if round(scale, decimals) == scale:
+            return decimals
+    return 10
+
+
+def _compile_block(function, fields, word_order):
+    address = fields[0].address
+    layout = ">"
+    decoders = []
+    index = 0
+    cursor = address
+    for field in fields:
+        if field.address > cursor:
+            layout += "{}x".format(2 * (field.address - cursor))
+        if field.width == 1 or word_order == "big" and field.width in (2, 4):
+            layout += _FORMATS[field.width, field.signed]
+            decoders.append((field.name, index, 0, 0, field.scale, _decimals(field.scale), field.cast))
+            index += 1
+        else:
+            layout += "H" * field.width
+            sign_bit = 1 << (16 * field.width - 1) if field.signed else 0
+            decoders.append((field.name, index, field.width, sign_bit, field.scale, _decimals(field.scale), field.cast))
+            index += field.width
+        cursor = field.address + field.width
+    return Block(function, address, cursor - address, struct.Struct(layout), tuple(decoders))
+
+
+def compile_plan(fields, word_order="little", max_gap=0, max_registers=MAX_REGISTERS):
+    """Merge fields into as few block reads as the register map allows"""
+    blocks = []
+    for function in sorted({field.function for field in fields}):
+        run = []
+        for field in sorted((f for f in fields if f.function == function), key=lambda f: f.address):
+            if run:
+                end = max(f.address + f.width for f in run)
+                if field.address < end:
+                    raise ValueError("Field {} overlaps {}".format(field.name, run[-1].name))
+                if field.address - end > max_gap or field.address + field.width - run[0].address > max_registers:
+                    blocks.append(_compile_block(function, run, word_order))
+                    run = []
+            run.append(field)
+        if run:
+            blocks.append(_compile_block(function, run, word_order))
+    return ReadPlan(blocks)
+
+
+def plan_for(profile, settings=False):
+    fields = profile.settings if settings else profile.fields
+    return compile_plan(fields, profile.word_order, profile.max_gap)
+
+
+# PZEM-004T v3, PZEM-014 and PZEM-016 share one AC register map
+PZEM_AC_FIELDS = (
+    Field("volts", 0x0000, scale=0.1),
+    Field("amps", 0x0001, width=2, scale=0.001),
+    Field("watts", 0x0003, width=2, scale=0.1),
+    Field("energy", 0x0005, width=2),
+    Field("frequency", 0x0007, scale=0.1),
+    Field("power_factor", 0x0008, scale=0.01),
+    Field("alarm_status", 0x0009, cast=bool),
+)
+
+PZEM_AC_SETTINGS = (
+    Field("alarm_threshold", 0x0001, function=HOLDING),
+    Field("slave_address", 0x0002, function=HOLDING),
+)
+
+# PZEM-003 and PZEM-017 DC meters
+PZEM_DC_FIELDS = (
+    Field("volts", 0x0000, scale=0.01),
+    Field("amps", 0x0001, scale=0.01),
+    Field("watts", 0x0002, width=2, scale=0.1),
+    Field("energy", 0x0004, width=2),
+    Field("high_voltage_alarm", 0x0006, cast=bool),
+    Field("low_voltage_alarm", 0x0007, cast=bool),
+)
+
+PZEM_DC_SETTINGS = (
+    Field("high_voltage_threshold", 0x0000, scale=0.01, function=HOLDING),
+    Field("low_voltage_threshold", 0x0001, scale=0.01, function=HOLDING),
+    Field("slave_address", 0x0002, function=HOLDING),
+    Field("current_range", 0x0003, function=HOLDING),
+)
+
+PROFILES = {
+    "PZEM-004T": Profile("PZEM-004T", PZEM_AC_FIELDS, PZEM_AC_SETTINGS),
+    "PZEM-014": Profile("PZEM-014", PZEM_AC_FIELDS, PZEM_AC_SETTINGS),
+    "PZEM-016": Profile("PZEM-016", PZEM_AC_FIELDS, PZEM_AC_SETTINGS),
+    "PZEM-017": Profile("PZEM-017", PZEM_DC_FIELDS, PZEM_DC_SETTINGS),
+}
+
+
+if __name__ == "__main__":
+    for name, profile in PROFILES.items():
+        print("{}: poll {}".format(name, plan_for(profile)))
+        for block in plan_for(profile).blocks:
+            print("    {!r} layout {}".format(block, block.layout.format))
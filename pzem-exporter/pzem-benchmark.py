@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Measure PZEM read throughput against the pty simulator
+
+Reports readings per second, latency percentiles and Modbus transactions
+per reading for PZEM_016.read(), optionally with faults injected and with
+the legacy one-request-per-field access pattern for comparison.
+
+    python3 pzem-benchmark.py --readings 200
+    python3 pzem-benchmark.py --per-field --close-port
+    python3 pzem-benchmark.py --slaves 1,2,3,4 --bus --timeout-rate 0.1
+
+With --bus, ADDRESS:PRIORITY slaves are polled with that priority and the
+readings per slave are listed; it fails if any slave was never polled, so
+`--slaves 1:5,2 --bus` checks a low priority meter still gets its turn.
+"""
+
+import argparse
+import sys
+import time
+from collections import Counter
+
+from bus import Bus
+from pzem import PZEM_016
+from pzem_simulator import Simulator
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def read_per_field(meter):
+    """One request per field, the way PZEM_016 polled before block reads"""
+    reading = {}
+    for block in meter.plan.blocks:
+        for name, index, words, *_ in block.fields:
+            meter.read_registers(block.address + index, words or 1, block.function)
+    reading.update(meter.read_settings())
+    return reading
+
+
+def run_single(args, simulator):
+    meter = PZEM_016(simulator.port, int(args.slaves.split(",")[0].partition(":")[0]))
+    meter.close_port_after_each_call = args.close_port
+    meter.serial.timeout = args.timeout
+    read = (lambda: read_per_field(meter)) if args.per_field else meter.read
+
+    latencies = []
+    errors = 0
+    for _ in range(args.readings):
+        start = time.monotonic()
+        try:
+            read()
+        except (IOError, ValueError):
+            errors += 1
+            continue
+        latencies.append(time.monotonic() - start)
+    return latencies, errors, False
+
+
+def run_bus(args, simulator):
+    bus = Bus(simulator.port, timeout=args.timeout, gap=args.gap)
+    for slave in args.slaves.split(","):
+        address, _, priority = slave.partition(":")
+        bus.add(int(address), priority=int(priority or 0))
+
+    latencies = []
+    errors = 0
+    polled = Counter()
+    while len(latencies) + errors < args.readings:
+        slave, _ = bus.next_slave(time.monotonic())
+        if slave is None:
+            time.sleep(0.001)
+            continue
+        polled[slave.address] += 1
+        if bus.poll(slave) is None:
+            errors += 1
+        else:
+            latencies.append(slave.duration)
+    print("polls per slave:         {}".format(", ".join(
+        "{}: {}".format(address, polled[address]) for address in bus.slaves)))
+    starved = [address for address in bus.slaves if not polled[address]]
+    if starved:
+        print("never polled:            {}".format(", ".join(str(address) for address in starved)))
+    return latencies, errors, bool(starved)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PZEM reads against the simulator")
+    parser.add_argument("--readings", default=100, type=int, help="number of readings to take (default: 100)")
+    parser.add_argument("--slaves", default="1", help="comma separated slave addresses (default: 1)")
+    parser.add_argument("--baudrate", default=9600, type=int, help="simulated line speed (default: 9600)")
+    parser.add_argument("--turnaround", default=0.01, type=float, help="seconds a meter takes to start answering (default: 0.01)")
+    parser.add_argument("--timeout", default=0.1, type=float, help="response timeout in seconds (default: 0.1)")
+    parser.add_argument("--gap", default=0.005, type=float, help="bus inter-frame gap with --bus (default: 0.005)")
+    parser.add_argument("--bus", action="store_true", help="poll every slave through the bus scheduler")
+    parser.add_argument("--per-field", action="store_true", help="use one request per field instead of block reads")
+    parser.add_argument("--close-port", action="store_true", help="reopen the serial port for every request")
+    parser.add_argument("--timeout-rate", default=0.0, type=float, help="probability a request goes unanswered")
+    parser.add_argument("--bad-crc-rate", default=0.0, type=float, help="probability a response has a bad CRC")
+    parser.add_argument("--garbled-rate", default=0.0, type=float, help="probability a response is garbled")
+    parser.add_argument("--seed", default=0, type=int, help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    simulator = Simulator(
+        [int(slave.partition(":")[0]) for slave in args.slaves.split(",")],
+        baudrate=args.baudrate,
+        turnaround=args.turnaround,
+        seed=args.seed,
+    )
+    simulator.set_faults(timeout=args.timeout_rate, bad_crc=args.bad_crc_rate, garbled=args.garbled_rate)
+
+    with simulator:
+        start = time.monotonic()
+        latencies, errors, starved = run_bus(args, simulator) if args.bus else run_single(args, simulator)
+        elapsed = time.monotonic() - start
+
+    readings = len(latencies)
+    print("mode:                    {}".format(
+        "bus" if args.bus else "per-field" if args.per_field else "block"))
+    print("readings:                {} ok, {} failed in {:.2f} s".format(readings, errors, elapsed))
+    print("readings per second:     {:.1f}".format(readings / elapsed))
+    if latencies:
+        print("latency p50/p90/p99:     {:.1f} / {:.1f} / {:.1f} ms".format(
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.9) * 1000,
+            percentile(latencies, 0.99) * 1000,
+        ))
+    print("transactions per reading: {:.2f}".format(simulator.requests / max(1, readings + errors)))
+    print("injected faults:         {}".format(simulator.faults))
+    sys.exit(1 if starved else 0)
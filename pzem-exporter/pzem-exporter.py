@@ -1,23 +1,20 @@
 import os
+import sys
 import time
-from datetime import datetime
+import signal
 import logging
 import argparse
 
-from pzem import PZEM_016
-from prometheus_client import start_http_server, Gauge, Histogram, Counter
-
-import json
-
-import paho.mqtt.client as mqtt
-import paho.mqtt.publish as publish
-
-try:
-	from smbus2 import SMBus
-except ImportError:
-	from smbus import SMBus
+from bus import Bus
+from moda.energy import EnergyLedger, LedgerCollector
+from moda.mqtt import Publisher
+from moda.payload import Deadband, SnapshotPublisher, parse_deadbands
+from moda.snapshot import SnapshotStore, SnapshotCollector
+from prometheus_client import start_http_server, Gauge, Histogram, Counter, REGISTRY
 
 
+DEFAULT_DEVICE = "/dev/ttyUSB0"
+DEFAULT_SLAVES = "1"
 DEFAULT_MQTT_BROKER_IP = "localhost"
 DEFAULT_MQTT_BROKER_PORT = 1883
 DEFAULT_MQTT_TOPIC = "pzem"
@@ -27,17 +24,6 @@ DEFAULT_USERNAME = None
 DEFAULT_PASSWORD = None
 
 
-# mqtt callbacks
-def on_connect(client, userdata, flags, rc):
-	if rc == 0:
-		print("MQTT Broker - Connected OK")
-	else:
-		print("Bad connection Returned code=", rc)
-
-
-def on_publish(client, userdata, mid):
-   print("mid: " + str(mid))
-
 logging.basicConfig(
 	format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
 	level=logging.INFO,
@@ -48,46 +34,54 @@ logging.basicConfig(
 
 DEBUG = os.getenv('DEBUG', 'false') == 'true'
 
-pzem = PZEM_016("/dev/ttyUSB0")  # Replace with the correct pa>
-
-VOLTS = Gauge('volts','Volts measured (V)')
-AMPS = Gauge('amps','Amps measured in amps (A)')
-WATTS = Gauge ('watts','Power measured (W)')
-ENERGY = Gauge ('energy','Energy consumption measured (W-hr)')
-FREQUENCY = Gauge ('frequency','AC frequency measured (Hz)')
-POWER_FACTOR= Gauge ('power_factor','Power effeciency (%)')
-ALARM = Gauge ('alarm', 'alarm status (boolean)')
-
-def get_readings():
-	reading = pzem.read()
-	volts = "Volts", reading["volts"]
-	amps = "Amps", reading["amps"]
-	watts = "Watts", reading["watts"]
-	energy = "Energy", reading["energy"]
-	frequency = "Frequency", reading["frequency"]
-	power_factor = "Power_Factor", reading["power_factor"]
-	alarm_status = "Alarm_Status", reading["alarm_status"]
-
-	VOLTS.set(reading["volts"])
-	AMPS.set(reading["amps"])
-	WATTS.set(reading["watts"])
-	ENERGY.set(reading["energy"])
-	FREQUENCY.set(reading["frequency"])
-	POWER_FACTOR.set(reading["power_factor"])
-	ALARM.set(reading["alarm_status"])
-	return reading
+# One snapshot store per slave; Prometheus, MQTT and debug logging all
+# read the last published snapshot so a reading is never seen half-updated.
+METRICS = (
+	('volts', 'volts', 'Volts measured (V)'),
+	('amps', 'amps', 'Amps measured in amps (A)'),
+	('watts', 'watts', 'Power measured (W)'),
+	('energy', 'energy', 'Energy consumption measured (W-hr)'),
+	('frequency', 'frequency', 'AC frequency measured (Hz)'),
+	('power_factor', 'power_factor', 'Power effeciency (%)'),
+	('alarm', 'alarm', 'alarm status (boolean)'),
+)
+STORES = {}
+REGISTRY.register(SnapshotCollector(METRICS, STORES, ['slave']))
+# Energy ledger per slave, with --ledger
+LEDGERS = {}
+REGISTRY.register(LedgerCollector(LEDGERS, ['slave']))
+
+UP = Gauge('pzem_up', 'Whether the meter answered its last poll (boolean)', ['slave'])
+POLL_TIME = Histogram('pzem_poll_seconds', 'Time spent polling the meter, including timeouts', ['slave'], buckets=(0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0))
+ERRORS = Counter('pzem_errors', 'Polls the meter did not answer', ['slave'])
+MISSED = Counter('pzem_missed_polls', 'Scheduled polls skipped because the bus was busy', ['slave'])
+# Slave.missed already counted into MISSED, by slave
+MISSED_SEEN = {}
+
+def get_readings(slave, reading):
+	label = str(slave.address)
+	POLL_TIME.labels(label).observe(slave.duration)
+	MISSED.labels(label).inc(slave.missed - MISSED_SEEN.get(label, 0))
+	MISSED_SEEN[label] = slave.missed
+	if reading is None:
+		UP.labels(label).set(0)
+		ERRORS.labels(label).inc()
+		return None
+
+	UP.labels(label).set(1)
+	store = STORES.get((label,))
+	if store is None:
+		store = STORES[(label,)] = SnapshotStore(field for field, _, _ in METRICS)
+	store.update(dict(reading, alarm=reading["alarm_status"]))
+	ledger = LEDGERS.get((label,))
+	if ledger is not None:
+		# The reading's timestamp is whole seconds, too coarse to integrate over
+		ledger.update(time.time(), reading["watts"], reading["energy"])
+	return store.publish(reading["timestamp"])
 
 def collect_all_data():
-	"""Collects all the data ampsly set"""
-	sensor_data = {}
-	sensor_data['volts'] = VOLTS.collect()[0].samples[0].value
-	sensor_data['amps'] = AMPS.collect()[0].samples[0].value
-	sensor_data['watts'] = WATTS.collect()[0].samples[0].value
-	sensor_data['energy'] = ENERGY.collect()[0].samples[0].value
-	sensor_data['frequency'] = FREQUENCY.collect()[0].samples[0].value
-	sensor_data['power_factor'] = POWER_FACTOR.collect()[0].samples[0].value
-	sensor_data['alarm'] = ALARM.collect()[0].samples[0].value
-	return sensor_data
+	"""Collects all the data currently set, keyed by slave address"""
+	return {labels[0]: store.snapshot().as_dict() for labels, store in list(STORES.items())}
 
 def str_to_bool(value):
 	if value.lower() in {'false', 'f', '0', 'no', 'n'}:
@@ -97,15 +91,6 @@ def str_to_bool(value):
 	raise ValueError('{} is not a valid boolean value'.format(value))
 
 
-def main() -> None:
-   
-	while True:
-		reading = pzem.read()
-		timestamp = datetime.utcfromtimestamp(reading["timestamp"])
-		alarm_status = 1 if reading["alarm_status"] else 0
-		time.sleep(1)
-
-
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
 	parser.add_argument(
@@ -127,6 +112,41 @@ if __name__ == "__main__":
 	   type=str_to_bool,
 	   help="Turns on more verbose logging, showing sensor output and post responses [default: false]"
 	)
+	parser.add_argument(
+		"--device",
+		default=DEFAULT_DEVICE,
+		type=str,
+		help="serial port of the RS485 bus [default: /dev/ttyUSB0]"
+	)
+	parser.add_argument(
+		"--slaves",
+		default=DEFAULT_SLAVES,
+		type=str,
+		help="comma separated modbus addresses of the meters on the bus, "
+			 "append :PRIORITY to poll a meter ahead of the others [default: 1]"
+	)
+	parser.add_argument(
+		"--gap",
+		default=0.005,
+		type=float,
+		help="idle seconds between bus transactions [default: 0.005]"
+	)
+	parser.add_argument(
+		"--timeout",
+		default=0.1,
+		type=float,
+		help="seconds to wait for a meter to answer [default: 0.1]"
+	)
+	parser.add_argument(
+		"--asyncio",
+		action='store_true',
+		help="poll the bus from an asyncio event loop with non-blocking serial I/O"
+	)
+	parser.add_argument(
+		"--ledger",
+		metavar='DIR',
+		help="keep hourly, daily and monthly energy totals of each meter in DIR (pzem-SLAVE.json)"
+	)
 	parser.add_argument(
 		"-q", "--mqttbroker",
 		default=DEFAULT_MQTT_BROKER_IP,
@@ -145,8 +165,8 @@ if __name__ == "__main__":
 	parser.add_argument(
 		"--interval",
 		default=DEFAULT_READ_INTERVAL,
-		type=int,
-		help="the read interval in seconds",
+		type=float,
+		help="the read interval per meter in seconds, 0 polls round-robin as fast as the bus allows",
 	)
 	parser.add_argument(
 		"--tls",
@@ -166,6 +186,29 @@ if __name__ == "__main__":
 		type=str,
 		help="mqtt password"
 	)
+	parser.add_argument(
+		"--mqtt-spool",
+		metavar='DIR',
+		help="keep the readings the broker can't take in DIR until it is back, instead of dropping them past 1000"
+	)
+	parser.add_argument(
+		"--mqtt-format",
+		choices=["json", "cbor", "msgpack"],
+		default="json",
+		help="encoding of the message each reading is published as on TOPIC/SLAVE [default: json]"
+	)
+	parser.add_argument(
+		"--mqtt-deadband",
+		metavar='FIELD=DELTA,...',
+		help="only publish a value when it moved more than DELTA since last sent, e.g. 'watts=5,volts=1,energy=0'; "
+			 "a bare DELTA applies to the other values [default: publish every reading]"
+	)
+	parser.add_argument(
+		"--mqtt-heartbeat",
+		default=300,
+		type=float,
+		help="with --mqtt-deadband, publish every value at least this often, in seconds [default: 300]"
+	)
 	args = parser.parse_args()
 	
 	#device_serial_number = get_serial_number()
@@ -177,27 +220,48 @@ if __name__ == "__main__":
 
 	logging.info("Listening on http://{}:{}".format(args.bind, args.port))
 	
-	mqtt_client = mqtt.Client(client_id=device_id)
-	if args.username and args.password:
-		mqtt_client.username_pw_set(args.username, args.password)
-		mqtt_client.on_connect = on_connect
-		mqtt_client.on_publish = on_publish
+	# One connection for good; readings queue up while the broker is away
+	publisher = Publisher(
+		args.mqttbroker, args.mqttport, client_id=device_id,
+		username=args.username, password=args.password, tls=args.tls,
+		spool_dir=args.mqtt_spool).start()
+	thresholds, default = parse_deadbands(args.mqtt_deadband)
+	# Readings packed into one message per slave, each with its own deadband
+	packers = {}
 
-	if args.tls is True:
-		mqtt_client.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
+	if args.asyncio:
+		import asyncio
+		from pzem_async import AsyncBus as Bus
+	bus = Bus(args.device, gap=args.gap, timeout=args.timeout)
+	for slave in args.slaves.split(","):
+		address, _, priority = slave.partition(":")
+		bus.add(int(address), interval=args.interval, priority=int(priority or 0))
+		if args.ledger:
+			os.makedirs(args.ledger, exist_ok=True)
+			LEDGERS[(str(int(address)),)] = EnergyLedger(os.path.join(args.ledger, "pzem-{}.json".format(int(address))))
+	logging.info("Polling slaves {} on {}".format(", ".join(str(a) for a in bus.slaves), args.device))
 
-	if args.username is not None:
-		mqtt_client.username_pw_set(args.username, password=args.password)
-
-	mqtt_client.connect(args.mqttbroker, port=args.mqttport)
-
-	mqtt_client.loop_start()
-
-	while True:
-		prefix = json.dumps(collect_all_data())
-		topic = prefix.strip("/") + "/" + topic
-		mqtt_client.publish(args.topic, str(value)))
-		get_readings()
+	def on_reading(slave, reading):
+		snapshot = get_readings(slave, reading)
+		if snapshot is None:
+			return
+		packer = packers.get(slave.address)
+		if packer is None:
+			deadband = Deadband(thresholds, default, args.mqtt_heartbeat) if args.mqtt_deadband else None
+			topic = "{}/{}".format(args.topic.strip("/"), slave.address)
+			packer = packers[slave.address] = SnapshotPublisher(publisher, topic, args.mqtt_format, deadband)
+		packer.publish(snapshot.as_dict(), {"timestamp": snapshot.timestamp, "sequence": snapshot.sequence})
 		if DEBUG:
 			logging.info('Sensor data: {}'.format(collect_all_data()))
-		time.sleep (args.interval)
+
+	# systemctl stop sends SIGTERM: exit through the finally below
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	try:
+		if args.asyncio:
+			asyncio.run(bus.run(on_reading))
+		else:
+			bus.run(on_reading)
+	finally:
+		publisher.close()
+		for ledger in LEDGERS.values():
+			ledger.close()
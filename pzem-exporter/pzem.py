@@ -2,9 +2,17 @@ import minimalmodbus
 import logging
 import time
 
+from profiles import PROFILES, plan_for
+
+
+def _field(name):
+    return property(lambda self: self.execute(self.plan)[name])
+
 
 class PZEM_016(minimalmodbus.Instrument):
-    def __init__(self, serial_port, slave_addr=1):
+    PROFILE = PROFILES["PZEM-016"]
+
+    def __init__(self, serial_port, slave_addr=1, profile=None):
         minimalmodbus.Instrument.__init__(self, serial_port, slave_addr)
 
         self.serial.baudrate = 9600
@@ -13,35 +21,14 @@ class PZEM_016(minimalmodbus.Instrument):
         self.mode = minimalmodbus.MODE_RTU
         self.close_port_after_each_call = True
 
+        # Measurements are polled through a precompiled read plan, settings
+        # registers are read once and cached until we write them.
+        self.profile = profile or self.PROFILE
+        self.plan = plan_for(self.profile)
+        self.settings_plan = plan_for(self.profile, settings=True)
+        self._settings = None
+
         self.registers = {
-            "volts": {  # 0.1V
-                "address": (0, 1, 4),
-            },
-            "amps": {  # 0.001A
-                "address": (1, 2, 4),
-                "multiplier": 0.1,
-            },
-            "watts": {  # 0.1W
-                "address": (3, 2, 4),
-                "multiplier": 10,
-            },
-            "energy": {  # 1Wh
-                "address": (5, 2, 4),
-                "multiplier": 10,
-            },
-            "frequency": {  # 0.1Hz
-                "address": (7, 1, 4),
-            },
-            "power_factor": {  # 0.01
-                "address": (8, 1, 4),
-                "multiplier": 0.1,
-            },
-            "alarm_status": {  # 0xFFF for alarm
-                "address": (9, 0, 4),
-            },
-            "alarm_threshold": {
-                "address": (1, 0, 3),
-            },
             "set_alarm_threshold": {
                 "address": (1, None, 0, 6),
             },
@@ -49,66 +36,45 @@ class PZEM_016(minimalmodbus.Instrument):
                 "address": (2, None, 0, 6),
             },
             "reset_energy": {
-                "address": (66, ""),
+                # Function 0x42 with no data, not a register write
+                "address": (0x42, b""),
             },
         }
 
-    @property
-    def volts(self) -> float:
-        return self.read_register(*self.registers["volts"]["address"])
-
-    @property
-    def amps(self) -> float:
-        value = self.read_register(*self.registers["amps"]["address"])
-
-        if value:
-            return round(value * self.registers["amps"]["multiplier"], 2)
-
-        return value
+    volts = _field("volts")
+    amps = _field("amps")
+    watts = _field("watts")
+    energy = _field("energy")
+    frequency = _field("frequency")
+    power_factor = _field("power_factor")
 
     @property
-    def watts(self) -> float:
-        value = self.read_register(*self.registers["watts"]["address"])
-
-        if value:
-            return round(value * self.registers["watts"]["multiplier"], 2)
-
-        return value
-
-    @property
-    def energy(self) -> int:
-        value = self.read_register(*self.registers["energy"]["address"])
-
-        if value:
-            return round(value * self.registers["energy"]["multiplier"], 2)
-
-        return value
-
-    @property
-    def frequency(self) -> float:
-        return self.read_register(*self.registers["frequency"]["address"])
+    def has_alarm(self) -> bool:
+        return self.execute(self.plan)["alarm_status"]
 
     @property
-    def power_factor(self) -> float:
-        value = self.read_register(*self.registers["power_factor"]["address"])
-
-        if value:
-            return round(value * self.registers["power_factor"]["multiplier"], 2)
-
-        return value
+    def alarm_threshold(self) -> int:
+        return self.read_settings().get("alarm_threshold")
 
-    @property
-    def has_alarm(self) -> bool:
-        value = self.read_register(*self.registers["alarm_status"]["address"])
+    def execute(self, plan) -> dict:
+        """Run every block read of plan and decode the responses"""
+        reading = {}
+        for block in plan.blocks:
+            payload = self._perform_command(block.function, block.request)
 
-        if value:
-            return True
+            # The payload is a byte count followed by the register data
+            if len(payload) != 1 + 2 * block.count or payload[0] != 2 * block.count:
+                raise minimalmodbus.InvalidResponseError(
+                    "Wrong register payload length for {!r}: {!r}".format(block, payload)
+                )
 
-        return False
+            block.decode(payload, reading, offset=1)
+        return reading
 
-    @property
-    def alarm_threshold(self) -> int:
-        return self.read_register(*self.registers["alarm_threshold"]["address"])
+    def read_settings(self) -> dict:
+        if self._settings is None:
+            self._settings = self.execute(self.settings_plan)
+        return self._settings
 
     def set_alarm_threshold(self, watts: int) -> bool:
         try:
@@ -116,6 +82,8 @@ class PZEM_016(minimalmodbus.Instrument):
             args[1] = watts
 
             self.write_register(*args)
+            if self._settings is not None:
+                self._settings["alarm_threshold"] = watts
 
             return True
         except Exception:
@@ -129,6 +97,7 @@ class PZEM_016(minimalmodbus.Instrument):
             args[1] = slave_address
 
             self.write_register(*args)
+            self._settings = None
 
             return True
         except Exception:
@@ -138,13 +107,11 @@ class PZEM_016(minimalmodbus.Instrument):
 
     def reset_energy(self) -> bool:
         try:
-            args = list(self.registers["reset_energy"]["address"])
-            args[1]= reset_energy
-            self.write_register(*args)
+            self._perform_command(*self.registers["reset_energy"]["address"])
 
             return True
         except Exception:
-            logging.exception("Failed to reset reset energy.")
+            logging.exception("Failed to reset energy.")
 
         return False
 
@@ -155,32 +122,31 @@ class PZEM_016(minimalmodbus.Instrument):
             + "Alarm Status \t| Alarm Threshold (W)"
         )
         while True:
+            reading = self.read()
             print(
-                f"{int(time.time())}\t| "
-                + f"{self.volts}\t| "
-                + f"{self.amps}\t\t| "
-                + f"{self.watts}\t\t| "
-                + f"{self.energy}\t\t| "
-                + f"{self.frequency}\t| "
-                + f"{self.power_factor}\t| "
-                + f"{self.has_alarm}\t\t| "
-                + f"{self.alarm_threshold}"
+                f"{reading['timestamp']}\t| "
+                + f"{reading['volts']}\t| "
+                + f"{reading['amps']}\t\t| "
+                + f"{reading['watts']}\t\t| "
+                + f"{reading['energy']}\t\t| "
+                + f"{reading['frequency']}\t| "
+                + f"{reading['power_factor']}\t| "
+                + f"{reading['alarm_status']}\t\t| "
+                + f"{reading['alarm_threshold']}"
             )
             time.sleep(delay)
 
     def read(self) -> dict:
-        return {
-            "timestamp": int(time.time()),
-            "volts": self.volts,
-            "amps": self.amps,
-            "watts": self.watts,
-            "energy": self.energy,
-            "frequency": self.frequency,
-            "power_factor": self.power_factor,
-            "alarm_status": self.has_alarm,
-            "alarm_threshold": self.alarm_threshold,
-        }
+        reading = {"timestamp": int(time.time())}
+        reading.update(self.execute(self.plan))
+        reading.update(self.read_settings())
+
+        return reading
 
 
 class PZEM_014(PZEM_016):
-    pass
+    PROFILE = PROFILES["PZEM-014"]
+
+
+class PZEM_004T(PZEM_016):
+    PROFILE = PROFILES["PZEM-004T"]
@@ -0,0 +1,123 @@
+"""asyncio Modbus RTU access to PZEM meters
+
+AsyncPZEM reads the same precompiled plans as PZEM_016 over a
+moda.aioserial.SerialPort, and AsyncBus schedules the meters on one port
+exactly like Bus, but every wait (inter-frame gap, response, timeout) is
+an await, so other sensors and coroutines keep running meanwhile.
+"""
+
+import asyncio
+import struct
+import time
+
+from bus import Bus, Slave
+from profiles import PROFILES, crc16, plan_for
+
+from moda.aioserial import SerialPort
+
+
+def frame(address, function, payload) -> bytes:
+    body = bytes([address, function]) + payload
+    return body + struct.pack("<H", crc16(body))
+
+
+class AsyncPZEM:
+    PROFILE = PROFILES["PZEM-016"]
+
+    def __init__(self, port, address=1, profile=None, timeout=0.1):
+        """Meter at address on an open SerialPort, which several meters may share"""
+        self.port = port
+        self.address = address
+        self.timeout = timeout
+        self.profile = profile or self.PROFILE
+        self.plan = plan_for(self.profile)
+        self.settings_plan = plan_for(self.profile, settings=True)
+        self._settings = None
+
+    async def _transaction(self, function, payload) -> bytes:
+        """Send one request and return the response payload after the function code"""
+        self.port.reset_input_buffer()
+        await self.port.write(frame(self.address, function, payload))
+
+        header = await self.port.read(2, self.timeout)
+        if header[0] != self.address:
+            raise IOError("Response from slave {} to a request for {}".format(header[0], self.address))
+        if header[1] == function | 0x80:
+            rest = await self.port.read(3, self.timeout)
+            raise IOError("Slave {} answered with exception code {}".format(self.address, rest[0]))
+        if header[1] != function:
+            raise IOError("Unexpected function code {} from slave {}".format(header[1], self.address))
+
+        count = await self.port.read(1, self.timeout)
+        rest = await self.port.read(count[0] + 2, self.timeout)
+        response = header + count + rest
+        if crc16(response[:-2]) != struct.unpack_from("<H", response, len(response) - 2)[0]:
+            raise IOError("Bad CRC in response from slave {}".format(self.address))
+        return response[2:-2]
+
+    async def execute(self, plan) -> dict:
+        reading = {}
+        for block in plan.blocks:
+            payload = await self._transaction(block.function, block.request)
+            if len(payload) != 1 + 2 * block.count or payload[0] != 2 * block.count:
+                raise ValueError("Wrong register payload length for {!r}: {!r}".format(block, payload))
+            block.decode(payload, reading, offset=1)
+        return reading
+
+    async def read_settings(self) -> dict:
+        if self._settings is None:
+            self._settings = await self.execute(self.settings_plan)
+        return self._settings
+
+    async def read(self) -> dict:
+        """Same reading as PZEM_016.read()"""
+        reading = {"timestamp": int(time.time())}
+        reading.update(await self.execute(self.plan))
+        reading.update(await self.read_settings())
+        return reading
+
+
+class AsyncBus(Bus):
+    def __init__(self, port, meter_class=AsyncPZEM, gap=0.005, timeout=0.1, max_backoff=60, baudrate=9600):
+        super().__init__(port, meter_class, gap, timeout, max_backoff)
+        self.serial = SerialPort(port, baudrate)
+
+    def add(self, address, interval=0, timeout=None, priority=0, profile=None) -> Slave:
+        timeout = timeout or self.timeout
+        meter = self.meter_class(self.serial, address, profile=profile, timeout=timeout)
+        slave = Slave(meter, interval, timeout, priority)
+        slave.next_due = time.monotonic()
+        self.slaves[address] = slave
+        return slave
+
+    async def poll(self, slave):
+        """Read one slave, rescheduling it and recording the outcome"""
+        wait = self._last_frame + self.gap - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        start = time.monotonic()
+        try:
+            reading = await slave.meter.read()
+        except (IOError, ValueError, asyncio.TimeoutError) as exception:
+            reading = None
+            self._failed(slave, str(exception) or "timed out")
+        finally:
+            end = self._last_frame = time.monotonic()
+            slave.duration = end - start
+        return self._reschedule(slave, reading, end)
+
+    async def step(self, callback):
+        """Poll the next slave that is due, or wait until one is"""
+        slave, due = self.next_slave(time.monotonic())
+        if slave is None:
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            return
+        result = callback(slave, await self.poll(slave))
+        if asyncio.iscoroutine(result):
+            await result
+
+    async def run(self, callback) -> None:
+        """Poll forever, calling (or awaiting) callback(slave, reading) after every poll"""
+        while True:
+            await self.step(callback)
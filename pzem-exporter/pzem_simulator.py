@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""Simulated PZEM meters speaking Modbus RTU on a pseudo-terminal
+
+The simulator opens a pty and answers function 0x03/0x04 reads, 0x06
+writes and the 0x42 energy reset for any number of slave addresses, with
+correct CRCs and the frame timing of a real 9600 baud line. Faults can be
+injected per slave: no answer, a bad CRC or a garbled frame.
+
+    python3 pzem_simulator.py --slaves 1,2,3 --timeout-rate 0.05
+    python3 pzem-exporter.py --device /dev/pts/5 --slaves 1,2,3
+"""
+
+import argparse
+import logging
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+from profiles import crc16
+
+# Request length by function code, including address and CRC
+REQUEST_LENGTHS = {0x03: 8, 0x04: 8, 0x06: 8, 0x42: 4}
+
+
+def frame(data) -> bytes:
+    """Append the Modbus CRC (low byte first) to data"""
+    return bytes(data) + struct.pack("<H", crc16(data))
+
+
+class SimulatedMeter:
+    def __init__(self, address, rng, volts=230.0, amps=5.0, power_factor=0.95, frequency=50.0):
+        """A PZEM-016 with slowly wandering readings and a running energy count"""
+        self.address = address
+        self.rng = rng
+        self.volts = volts
+        self.amps = amps
+        self.power_factor = power_factor
+        self.frequency = frequency
+        self.energy = 0.0
+        self.alarm_threshold = 2300
+        self.updated = time.monotonic()
+        # Fault rates, each the probability of that fault on one request
+        self.timeout_rate = 0.0
+        self.bad_crc_rate = 0.0
+        self.garbled_rate = 0.0
+
+    @property
+    def watts(self) -> float:
+        return self.volts * self.amps * self.power_factor
+
+    def update(self):
+        now = time.monotonic()
+        self.energy += self.watts * (now - self.updated) / 3600
+        self.updated = now
+        self.volts = min(250.0, max(210.0, self.volts + self.rng.uniform(-0.5, 0.5)))
+        self.amps = min(100.0, max(0.0, self.amps + self.rng.uniform(-0.05, 0.05)))
+
+    def input_registers(self) -> list:
+        self.update()
+        amps = int(self.amps * 1000)
+        watts = int(self.watts * 10)
+        energy = int(self.energy)
+        alarm = 0xFFFF if self.watts > self.alarm_threshold else 0
+        return [
+            int(self.volts * 10),
+            amps & 0xFFFF, amps >> 16,
+            watts & 0xFFFF, watts >> 16,
+            energy & 0xFFFF, energy >> 16,
+            int(self.frequency * 10),
+            int(self.power_factor * 100),
+            alarm,
+        ]
+
+    def holding_registers(self) -> list:
+        return [0, self.alarm_threshold, self.address, 0]
+
+    def write(self, register, value) -> bool:
+        if register == 1:
+            self.alarm_threshold = value
+        elif register == 2 and 1 <= value <= 0xF7:
+            self.address = value
+        else:
+            return False
+        return True
+
+    def respond(self, request) -> bytes:
+        """Build the response frame for a CRC-checked request"""
+        address, function = request[0], request[1]
+
+        if function == 0x42:
+            self.energy = 0.0
+            return frame(request[:2])
+
+        start, value = struct.unpack(">HH", request[2:6])
+        if function == 0x06:
+            if not self.write(start, value):
+                return frame(bytes([address, function | 0x80, 0x02]))
+            return frame(request[:6])
+
+        registers = self.input_registers() if function == 0x04 else self.holding_registers()
+        if value < 1 or start + value > len(registers):
+            return frame(bytes([address, function | 0x80, 0x02]))
+
+        data = struct.pack(">{}H".format(value), *registers[start:start + value])
+        return frame(bytes([address, function, len(data)]) + data)
+
+
+class Simulator:
+    def __init__(self, addresses=(1,), baudrate=9600, turnaround=0.01, seed=None):
+        """Meters at addresses answering on a fresh pseudo-terminal
+
+        turnaround is how long a meter takes to start answering once a
+        request has arrived, on top of the time the bytes spend on the wire.
+        """
+        self.rng = random.Random(seed)
+        self.meters = {address: SimulatedMeter(address, self.rng) for address in addresses}
+        self.baudrate = baudrate
+        self.turnaround = turnaround
+        self.requests = 0
+        self.responses = 0
+        self.faults = 0
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self._running = False
+        self._thread = None
+
+    @property
+    def char_time(self) -> float:
+        # 8N1: start bit, eight data bits, stop bit
+        return 10 / self.baudrate
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def serve(self):
+        buffer = bytearray()
+        silence = 3.5 * self.char_time
+        while self._running:
+            ready, _, _ = select.select([self.master], [], [], silence if buffer else 0.1)
+            if not ready:
+                # An incomplete frame followed by silence is line noise
+                buffer.clear()
+                continue
+            buffer += os.read(self.master, 256)
+
+            while len(buffer) >= 2:
+                length = REQUEST_LENGTHS.get(buffer[1])
+                if length is None:
+                    buffer.clear()
+                    break
+                if len(buffer) < length:
+                    break
+                request = bytes(buffer[:length])
+                del buffer[:length]
+                self.handle(request)
+
+    def handle(self, request):
+        self.requests += 1
+        # The request itself still has to cross the wire at our baud rate
+        time.sleep(len(request) * self.char_time)
+
+        meter = self.meters.get(request[0])
+        if meter is None or crc16(request[:-2]) != struct.unpack("<H", request[-2:])[0]:
+            return
+
+        response = meter.respond(request)
+        if meter.address != request[0]:
+            self.meters[meter.address] = self.meters.pop(request[0])
+
+        roll = self.rng.random()
+        if roll < meter.timeout_rate:
+            self.faults += 1
+            return
+        roll -= meter.timeout_rate
+        if roll < meter.bad_crc_rate:
+            self.faults += 1
+            response = response[:-1] + bytes([response[-1] ^ 0xFF])
+        elif roll - meter.bad_crc_rate < meter.garbled_rate:
+            self.faults += 1
+            response = bytes(self.rng.getrandbits(8) for _ in range(self.rng.randint(1, len(response))))
+
+        time.sleep(self.turnaround + len(response) * self.char_time)
+        os.write(self.master, response)
+        self.responses += 1
+
+    def set_faults(self, address=None, timeout=0.0, bad_crc=0.0, garbled=0.0):
+        """Set fault rates for one meter, or every meter when address is None"""
+        meters = self.meters.values() if address is None else [self.meters[address]]
+        for meter in meters:
+            meter.timeout_rate = timeout
+            meter.bad_crc_rate = bad_crc
+            meter.garbled_rate = garbled
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate PZEM meters on a pseudo-terminal")
+    parser.add_argument("--slaves", default="1", help="comma separated slave addresses (default: 1)")
+    parser.add_argument("--baudrate", default=9600, type=int, help="simulated line speed (default: 9600)")
+    parser.add_argument("--turnaround", default=0.01, type=float, help="seconds a meter takes to start answering (default: 0.01)")
+    parser.add_argument("--timeout-rate", default=0.0, type=float, help="probability a request goes unanswered")
+    parser.add_argument("--bad-crc-rate", default=0.0, type=float, help="probability a response has a bad CRC")
+    parser.add_argument("--garbled-rate", default=0.0, type=float, help="probability a response is garbled")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    simulator = Simulator(
+        [int(address) for address in args.slaves.split(",")],
+        baudrate=args.baudrate,
+        turnaround=args.turnaround,
+        seed=args.seed,
+    )
+    simulator.set_faults(timeout=args.timeout_rate, bad_crc=args.bad_crc_rate, garbled=args.garbled_rate)
+    simulator.start()
+    logging.info("Simulating slaves {} on {}".format(args.slaves, simulator.port))
+
+    try:
+        while True:
+            time.sleep(10)
+            logging.info("{} requests, {} responses, {} faults".format(simulator.requests, simulator.responses, simulator.faults))
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,132 @@
+"""Duty-cycle planning and active-mode sampling for the SDS011
+
+A cycle wakes the sensor, throws away the frames pushed while the fan and
+laser warm up, averages the frames of a sampling window and hands the
+mean over as soon as the window closes, then switches the laser off until
+the next cycle. Without an off time the sensor runs continuously and every
+window after the first warm-up is reported back to back.
+"""
+
+import asyncio
+import logging
+import time
+
+# Nova rates the SDS011 laser for 8000 hours of operation
+LASER_LIFETIME_HOURS = 8000
+# Fewer frames than this (pushed about once a second) make a poor mean
+MIN_WINDOW = 3
+
+
+class DutyCycle:
+    def __init__(self, warmup=30, window=10, off=0):
+        """warmup, window and off times of one cycle, in seconds"""
+        if window < MIN_WINDOW:
+            raise ValueError("sampling window must be at least {} seconds".format(MIN_WINDOW))
+        if warmup < 0 or off < 0:
+            raise ValueError("warm-up and off time can't be negative")
+        self.warmup = warmup
+        self.window = window
+        self.off = off
+
+    @classmethod
+    def plan(cls, period, duty=1.0, warmup=30, window=None):
+        """Cycle reporting every period seconds with the laser on at most duty of the time
+
+        The laser time left after warm-up goes to the sampling window,
+        unless window is given, in which case the laser is on for less.
+        """
+        if not 0 < duty <= 1:
+            raise ValueError("duty must be in (0, 1]")
+        on = period * duty
+        if on >= period and (window is None or window >= period):
+            # Continuous: warm up once, then one window per period
+            return cls(warmup, period, 0)
+        available = on - warmup
+        if window is None:
+            window = available
+        elif window > available:
+            raise ValueError("a {}s window after {}s warm-up needs a duty of at least {:.2f} over {}s".format(
+                window, warmup, (warmup + window) / period, period))
+        if window < MIN_WINDOW:
+            raise ValueError("a {:.0%} duty over {}s leaves no sampling window after a {}s warm-up".format(duty, period, warmup))
+        return cls(warmup, window, period - warmup - window)
+
+    @property
+    def continuous(self) -> bool:
+        return self.off == 0
+
+    @property
+    def period(self) -> float:
+        """Seconds between two reports"""
+        return self.window if self.continuous else self.warmup + self.window + self.off
+
+    @property
+    def duty(self) -> float:
+        """Fraction of the time the laser is on"""
+        return 1.0 if self.continuous else (self.warmup + self.window) / self.period
+
+    def laser_years(self, lifetime=LASER_LIFETIME_HOURS) -> float:
+        return lifetime / self.duty / (24 * 365)
+
+    def __str__(self):
+        if self.continuous:
+            return "continuous, {}s windows after a {}s warm-up, laser worn out in {:.1f} years".format(
+                self.window, self.warmup, self.laser_years())
+        return "{}s warm-up, {}s window, {}s off: a report every {}s, laser on {:.0%}, worn out in {:.1f} years".format(
+            self.warmup, self.window, self.off, self.period, self.duty, self.laser_years())
+
+
+async def _frames_until(sensor, deadline):
+    """Frames pushed by the sensor until deadline (a monotonic time)"""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        try:
+            yield await asyncio.wait_for(sensor.read(), remaining)
+        except asyncio.TimeoutError:
+            if time.monotonic() >= deadline:
+                return
+            # sensor.read()'s own per-frame timeout: one late frame must not
+            # cut a warm-up or window short
+            logging.warning("SDS011 pushed no frame for {}s".format(sensor.timeout))
+        except IOError as exception:
+            logging.warning("SDS011: {}".format(exception))
+
+
+async def stream(sensor, cycle, on_window):
+    """Run cycle forever on a moda.aiodevices.SDS011, calling on_window(pm25, pm10, frames)
+
+    on_window is called as soon as a window closes, with the mean of its
+    frames.
+    """
+    warm = False
+    while True:
+        try:
+            if not warm:
+                # A sleeping sensor only answers the wake-up command
+                await sensor.sleep(sleep=False)
+                await sensor.set_report_mode(active=True)
+                async for _ in _frames_until(sensor, time.monotonic() + cycle.warmup):
+                    pass
+                warm = cycle.continuous
+
+            pm25 = pm10 = 0.0
+            frames = 0
+            async for frame in _frames_until(sensor, time.monotonic() + cycle.window):
+                pm25 += frame[0]
+                pm10 += frame[1]
+                frames += 1
+            if frames:
+                on_window(round(pm25 / frames, 1), round(pm10 / frames, 1), frames)
+            else:
+                logging.warning("SDS011 pushed no frames in a {}s window".format(cycle.window))
+
+            if not cycle.continuous:
+                await sensor.sleep(sleep=True)
+                await asyncio.sleep(cycle.off)
+        except (IOError, asyncio.TimeoutError) as exception:
+            # Most likely a command went unanswered, start over with a fresh warm-up
+            logging.warning("SDS011 did not answer: {}".format(str(exception) or "timed out"))
+            warm = False
+            await asyncio.sleep(1)
@@ -1,17 +1,20 @@
 #!/usr/bin/python3
 
 import os
+import sys
+import signal
 import argparse
 import datetime
 import time
 import logging
 from collections import deque
 
-import paho.mqtt.publish
-from prometheus_client import start_http_server, Gauge, Histogram
+from prometheus_client import start_http_server, Gauge, Histogram, REGISTRY
+
+from moda.snapshot import SnapshotStore, SnapshotCollector
 
 from sds011 import SDS011
-import aqi
+from moda.airquality import SCALES, POLLUTANT_PM25, POLLUTANT_PM10
 
 logging.basicConfig(
     format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s',
@@ -38,17 +41,37 @@ def parse_args():
     parser.add_argument("--mqtt-hostname", "-n", metavar="IP/HOSTNAME", help="IP address or hostname of the MQTT broker")
     parser.add_argument("--mqtt-port", "-r", default="1883", metavar="PORT", type=int, help="Port number of the MQTT broker (default: '1883')")
     parser.add_argument("--mqtt-base-topic", "-i", default="sds011", metavar="TOPIC", help="Parent MQTT topic to use (default: 'aqi')")
+    parser.add_argument("--mqtt-spool", metavar="DIR", help="keep the messages the MQTT broker can't take in DIR until it is back, instead of dropping them past 1000")
+    parser.add_argument("--mqtt-format", choices=["topics", "json", "cbor", "msgpack"], default="topics", help="'topics' publishes each value on its own topic under the base topic, the others the whole reading as one message on the base topic (default: topics)")
+    parser.add_argument("--mqtt-deadband", metavar="FIELD=DELTA,...", help="only publish a value when it moved more than DELTA since last sent, e.g. 'current_pm25=0.5,current_pm10=1,aqi=1'; a bare DELTA applies to the other values (default: publish every reading)")
+    parser.add_argument("--mqtt-heartbeat", default=900, metavar="SECONDS", type=float, help="with --mqtt-deadband, publish every value at least this often (default: 900)")
     parser.add_argument("--omnia-leds", "-o", action="store_true", help="set Turris Omnia LED colors according to measures (User #1 LED for PM2.5 and User #2 LED for PM10)")
     parser.add_argument("--sensor", "-s", default="/dev/ttyUSB0", metavar="FILE", help="path to the SDS011 sensor (default: '/dev/ttyUSB0')")
     parser.add_argument("--sensor-operation-delay", "-e", default=10, metavar="SECONDS", type=int, help="seconds to let the sensor start (default: 10)")
     parser.add_argument("--sensor-start-delay", "-t", default=1, metavar="SECONDS", type=int, help="seconds to let the sensor perform an operation : taking a measure or going to sleep (default: 1)")
+    parser.add_argument("--store", metavar="DIR", help="keep the readings in ring files in DIR and serve them on /query next to /metrics")
+    parser.add_argument("--retention", default=7, metavar="DAYS", type=float, help="days of readings --store keeps (default: 7)")
+    parser.add_argument("--mode", choices=["query", "stream"], default="query", help="'query' polls the sensor with the delays above, 'stream' reads the frames it pushes in active reporting mode on the duty cycle below (default: query)")
+    parser.add_argument("--warmup", default=30, metavar="SECONDS", type=float, help="stream mode: seconds of frames thrown away after waking the sensor (default: 30)")
+    parser.add_argument("--window", metavar="SECONDS", type=float, help="stream mode: seconds of frames averaged into one reading (default: what --period and --duty leave after the warm-up)")
+    parser.add_argument("--period", default=300, metavar="SECONDS", type=float, help="stream mode: seconds between readings (default: 300)")
+    parser.add_argument("--duty", default=0.25, metavar="FRACTION", type=float, help="stream mode: largest fraction of the time the laser may be on, 1 keeps it on and reports every period (default: 0.25)")
     parser.add_argument("-f", "--debug", metavar='DEBUG', type=str_to_bool, help="Turns on more verbose logging, showing sensor output and post responses [default: false]")
 
     return parser.parse_args()
 
-PM25 = Gauge('PM25', 'Particulate Matter of diameter less than 2.5 microns. Measured in micrograms per cubic metre (ug/m3)')
-PM10 = Gauge('PM10', 'Particulate Matter of diameter less than 10 microns. Measured in micrograms per cubic metre (ug/m3)')
-AQI = Gauge('AQI', 'AQI value')
+METRICS = (
+    ('pm25', 'PM25', 'Particulate Matter of diameter less than 2.5 microns. Measured in micrograms per cubic metre (ug/m3)'),
+    ('pm10', 'PM10', 'Particulate Matter of diameter less than 10 microns. Measured in micrograms per cubic metre (ug/m3)'),
+    ('aqi', 'AQI', 'AQI value'),
+)
+SNAPSHOT = SnapshotStore(field for field, _, _ in METRICS)
+COLLECTOR = SnapshotCollector(METRICS, SNAPSHOT)
+REGISTRY.register(COLLECTOR)
+# moda.ringstore.RingStore keeping the readings on the device, with --store
+STORE = None
+# moda.payload.SnapshotPublisher, with --mqtt-hostname
+PUBLISHER = None
 
 PM25_HIST = Histogram('pm25_measurements', 'Histogram of Particulate Matter of diameter less than 2.5 micron measurements', buckets=(0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100))
 PM10_HIST = Histogram('pm10_measurements', 'Histogram of Particulate Matter of diameter less than 10 micron measurements', buckets=(0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95, 100))
@@ -73,20 +96,28 @@ def get_data(sensor, measures, start_delay, operation_delay):
     # Round the measures as a number with one decimal
     current_pm25 = round(current_pm25/measures, 1)
     current_pm10 = round(current_pm10/measures, 1)
-    current_aqi = aqi.to_aqi([(aqi.POLLUTANT_PM25, current_pm25), (aqi.POLLUTANT_PM10, current_pm10)])
 
     # Put the sensor to sleep
     sensor.sleep(sleep=True)
     time.sleep(operation_delay)
 
-    PM25.set(current_pm25)
-    PM10.set(current_pm10)
-    AQI.set(current_aqi)
+    return publish_reading(current_pm25, current_pm10)
+
+def publish_reading(current_pm25, current_pm10):
+    """Publish one PM2.5/PM10 reading with its AQI as a snapshot"""
+    current_aqi = SCALES[args.country].aqi(current_pm25, current_pm10)
+
+    SNAPSHOT.update({'pm25': current_pm25, 'pm10': current_pm10, 'aqi': current_aqi})
+    snapshot = SNAPSHOT.publish()
 
     PM25_HIST.observe(current_pm25)
     PM10_HIST.observe(current_pm10 - current_pm25)
 
-    return current_pm25, current_pm10, current_aqi
+    return snapshot
+
+def get_aqi_color(scale, pollutant, concentration):
+    """Turris Omnia LED color ("R G B") of the level of one pollutant"""
+    return "{} {} {}".format(*scale.level(scale.iaqi(pollutant, concentration)).color)
 
 def set_turris_omnia_led(user1_color, user2_color):
     if user1_color != "":
@@ -114,20 +145,9 @@ def save_log(logfile, logged_pm25, logged_pm10, logged_aqi):
     except:
         print("[INFO] Failure in logging data") 
 
-def publish_mqtt(mqtt_hostname, mqtt_port, mqtt_messages):
-    try:
-        paho.mqtt.publish.multiple(mqtt_messages, hostname=mqtt_hostname, port=mqtt_port, client_id="get_aqi.py")
-    except:
-        print("[INFO] Failure in publishing to MQTT broker")
-
 def collect_all_data():
     """Collects all the data currently set"""
-    sensor_data = {}
-    sensor_data['pm25'] = PM25.collect()[0].samples[0].value
-    sensor_data['pm10'] = PM10.collect()[0].samples[0].value
-    sensor_data['aqi'] = AQI.collect()[0].samples[0].value
-
-    return sensor_data
+    return SNAPSHOT.snapshot().as_dict()
 
 def str_to_bool(value):
     if value.lower() in {'false', 'f', '0', 'no', 'n'}:
@@ -137,50 +157,85 @@ def str_to_bool(value):
     raise ValueError('{} is not a valid boolean value'.format(value))
 
 args = parse_args()
-sensor = SDS011(args.sensor)
 
 
-# Start up the server to expose the metrics.
-start_http_server(addr=args.bind, port=args.port)
-# Generate some requests.
-logging.info("Listening on http://{}:{}".format(args.bind, args.port))
-
-
-
-while(True):
-    # Retrieve current PM2.5 and PM10 values from the sensor
-    current_pm25, current_pm10, current_aqi = get_data(sensor, args.measures, args.sensor_start_delay, args.sensor_operation_delay)
+def report(snapshot):
+    """Hand a published snapshot to the LEDs, the CSV log and MQTT"""
+    current_pm25, current_pm10, current_aqi = snapshot['pm25'], snapshot['pm10'], snapshot['aqi']
+    scale = SCALES[args.country]
+    aqi_level = scale.level(current_aqi).name
 
     # Set Turris Omnia User #1 and #2 LED colors
     if args.omnia_leds is True:
-        color_aqi_pm25 = get_aqi_color(aqi_level["level"], args.country)
-        color_aqi_pm10 = get_aqi_color(aqi_level["level"], args.country)
+        color_aqi_pm25 = get_aqi_color(scale, POLLUTANT_PM25, current_pm25)
+        color_aqi_pm10 = get_aqi_color(scale, POLLUTANT_PM10, current_pm10)
 
         set_turris_omnia_led(color_aqi_pm25, color_aqi_pm10)
 
+    if STORE is not None:
+        STORE.record([COLLECTOR], snapshot.timestamp)
+
     # Save measured values and AQI level to a log file 
     if args.log is not None:
-        save_log(args.log, current_pm25, current_pm10, aqi)
+        save_log(args.log, current_pm25, current_pm10, current_aqi)
 
     # Publish measured values and AQI level to an MQTT broker
-    if args.mqtt_hostname is not None:
-        # Remove any trailing '/' in topic
-        topic = args.mqtt_base_topic
-        if args.mqtt_base_topic.endswith("/"):
-            topic = args.mqtt_base_topic.rstrip("/")
-
-        # List of messages to publish, list of tuples.
-        # The tuples are of the form ("<topic>", "<payload>", qos, retain).
-        # topic must be present and may not be empty
-        msg_aqi = (topic + "/aqi", str(aqi), 0, False)
-        msg_level = (topic + "/level", str(aqi_level), 0, False)
-        msg_current_pm25 = (topic + "/current_pm25", str(current_pm25), 0, False)
-        msg_current_pm10 = (topic + "/current_pm10", str(current_pm10), 0, False)
-
-        messages = [msg_aqi, msg_level, msg_current_pm25, msg_current_pm10]
-
-        # Publish the messages to the MQTT broker
-        publish_mqtt(args.mqtt_hostname, args.mqtt_port, messages)
-
-    # Wait before taking the next measure with the sensor
-    time.sleep(args.delay)
+    if PUBLISHER is not None:
+        # Queued on the publisher's connection, sent in order once the broker takes them
+        values = {'aqi': current_aqi, 'level': aqi_level, 'current_pm25': current_pm25, 'current_pm10': current_pm10}
+        PUBLISHER.publish(values, {'timestamp': int(snapshot.timestamp)})
+
+
+# Start up the server to expose the metrics.
+if args.store:
+    from moda import ringstore
+    # Sized for a reading every --period (stream) or --delay (query) seconds at most
+    STORE = ringstore.RingStore(args.store, args.retention * 86400, max(1, args.period if args.mode == "stream" else args.delay))
+    ringstore.start_http_server(args.port, args.bind, STORE)
+else:
+    start_http_server(addr=args.bind, port=args.port)
+# Generate some requests.
+logging.info("Listening on http://{}:{}".format(args.bind, args.port))
+
+if args.mqtt_hostname is not None:
+    # Only loaded when --mqtt-hostname is given
+    from moda.mqtt import Publisher
+    from moda.payload import Deadband, SnapshotPublisher, parse_deadbands
+    deadband = None
+    if args.mqtt_deadband:
+        thresholds, default = parse_deadbands(args.mqtt_deadband)
+        deadband = Deadband(thresholds, default, args.mqtt_heartbeat)
+    PUBLISHER = SnapshotPublisher(
+        Publisher(args.mqtt_hostname, args.mqtt_port, client_id="get_aqi.py", spool_dir=args.mqtt_spool).start(),
+        args.mqtt_base_topic, args.mqtt_format, deadband, baseline="topics", qos=0)
+
+# systemctl stop sends SIGTERM: exit through the finally below, which spools
+# what the MQTT broker hasn't taken yet
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+try:
+    if args.mode == "stream":
+        import asyncio
+        from moda.aiodevices import SDS011 as StreamingSDS011
+        from dutycycle import DutyCycle, stream
+
+        cycle = DutyCycle.plan(args.period, args.duty, args.warmup, args.window)
+        logging.info("Streaming from the SDS011: {}".format(cycle))
+
+        def on_window(current_pm25, current_pm10, frames):
+            if DEBUG:
+                logging.info("{} frames: PM2.5 {} PM10 {}".format(frames, current_pm25, current_pm10))
+            report(publish_reading(current_pm25, current_pm10))
+
+        asyncio.run(stream(StreamingSDS011(args.sensor), cycle, on_window))
+    else:
+        # Only in query mode: the stream owns the serial port, even if it ends
+        sensor = SDS011(args.sensor)
+        while(True):
+            # Retrieve current PM2.5 and PM10 values from the sensor
+            report(get_data(sensor, args.measures, args.sensor_start_delay, args.sensor_operation_delay))
+
+            # Wait before taking the next measure with the sensor
+            time.sleep(args.delay)
+finally:
+    if PUBLISHER is not None:
+        PUBLISHER.publisher.close()
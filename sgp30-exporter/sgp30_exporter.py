@@ -2,11 +2,13 @@
 
 import argparse
 from time import sleep
-from prometheus_client import start_http_server, Summary,Gauge
+from prometheus_client import start_http_server, Summary,Gauge, REGISTRY
 import board
 import busio
 import adafruit_sgp30
 
+from moda.collector import ScrapeCollector
+
 i2c_bus = busio.I2C(board.SCL, board.SDA, frequency=100000)
 sgp30 = adafruit_sgp30.Adafruit_SGP30(i2c_bus)
 
@@ -20,25 +22,34 @@ parser.add_argument('--listen', action='store', default='0.0.0.0', help='bind to
 parser.add_argument('--port', action='store', type=int, default=8030, help='bind to port, default: 8030')
 parser.add_argument('--polling_interval', action='store', type=int, default=3, help='sensor polling interval, seconds, default: 1')
 parser.add_argument('--verbose', action="store_true", help='print every poll result to stdout')
+parser.add_argument('--lazy', action="store_true", help='read the sensor when scraped instead of polling it')
+parser.add_argument('--ttl', action='store', type=float, default=1, help='seconds a reading is reused for in --lazy mode, default: 1')
 
 args = parser.parse_args()
 
+METRICS = (
+    ('eco2', 'sgp30_eco2', 'CO2 level, ppm'),
+    ('tvoc', 'sgp30_tvoc', 'Total Volatile Organic Compounds level, ppm'),
+)
 
-co2 = Gauge('sgp30_eco2', 'CO2 level, ppm')
-tvoc = Gauge('sgp30_tvoc', 'Total Volatile Organic Compounds level, ppm')
-
-def get_data():
+def read_sensor():
     #print("CO2: ", ccs.geteCO2(), "ppm, TVOC: ", ccs.getTVOC(), " temp: ", temp)
     eCO2, TVOC = sgp30.iaq_measure()
-    co2_value=eCO2
-    tvoc_value=TVOC
-    co2.set(co2_value)
-    tvoc.set(tvoc_value)
     if args.verbose:
         print("eCO2 = %d ppm \t TVOC = %d ppb" % (eCO2, TVOC))
+    return {'eco2': eCO2, 'tvoc': TVOC}
+
+def get_data():
+    for field, value in read_sensor().items():
+        gauges[field].set(value)
 
 if __name__ == '__main__':
+    if args.lazy:
+        REGISTRY.register(ScrapeCollector('sgp30', read_sensor, METRICS, ttl=args.ttl))
+    else:
+        gauges = {field: Gauge(name, documentation) for field, name, documentation in METRICS}
     start_http_server(args.port, args.listen)
     while True:
-        get_data()
+        if not args.lazy:
+            get_data()
         sleep(args.polling_interval)
@@ -6,13 +6,17 @@ from time import sleep
 import adafruit_ccs811
 import adafruit_bme680
 import adafruit_sgp40
-from prometheus_client import start_http_server, Summary,Gauge
+from prometheus_client import start_http_server, Summary,Gauge, REGISTRY
+
+from moda.collector import ScrapeCollector
 
 parser = argparse.ArgumentParser(description="Prometheus exporter for ccs811 air quality sensor")
 parser.add_argument('--bind', action='store', default='0.0.0.0', help='bind to address, default: 0.0.0.0')
 parser.add_argument('--port', action='store', type=int, default=8002, help='bind to port, default: 8002')
 parser.add_argument('--polling_interval', action='store', type=int, default=2, help='sensor polling interval, seconds, default: 1')
 parser.add_argument('--verbose', action="store_true", help='print every poll result to stdout')
+parser.add_argument('--lazy', action="store_true", help='read the sensor when scraped instead of polling it')
+parser.add_argument('--ttl', action='store', type=float, default=1, help='seconds a reading is reused for in --lazy mode, default: 1')
 args = parser.parse_args()
 
 i2c = board.I2C()  # uses board.SCL and board.SDA
@@ -27,36 +31,48 @@ while not ccs811.data_ready:
 #temp = ccs.calculateTemperature()
 #ccs.tempOffset = temp - 25.0
 
-co2 = Gauge('ccs811_co2', 'CO2 level, ppm')
-tvoc = Gauge('ccs811_tvoc', 'Total Volatile Organic Compounds level, ppm')
-temperature = Gauge('bme680_temp', 'Air Temperature, C')
-humidity = Gauge('bme680_humidity', 'Relative Humidity %')
-voc_index = Gauge('sgp40_voc_index', 'Volatile Organic Compounds Index, int')
-compensated_raw_gas = Gauge('sgp40_raw_gas', 'Compensated voc index resistance readings, ohms')
+METRICS = (
+    ('co2', 'ccs811_co2', 'CO2 level, ppm'),
+    ('tvoc', 'ccs811_tvoc', 'Total Volatile Organic Compounds level, ppm'),
+    ('temperature', 'bme680_temp', 'Air Temperature, C'),
+    ('humidity', 'bme680_humidity', 'Relative Humidity %'),
+    ('voc_index', 'sgp40_voc_index', 'Volatile Organic Compounds Index, int'),
+    ('compensated_raw_gas', 'sgp40_raw_gas', 'Compensated voc index resistance readings, ohms'),
+)
 
 REQUEST_TIME = Summary('request_processing_seconds', 'Time spent processing request')
 
 @REQUEST_TIME.time()
-def get_data():
+def read_sensor():
     co2_value=ccs811.eco2
     tvoc_value=ccs811.tvoc
     temperature_value=bme680.temperature
     humidity_value=bme680.relative_humidity
     voc_index_value=sgp40.measure_index(temperature=temperature_value, relative_humidity=humidity_value)
     compensated_raw_gas_value=sgp40.measure_raw( temperature=temperature_value, relative_humidity=humidity_value)
-    
-    co2.set(co2_value)
-    tvoc.set(tvoc_value)
-    temperature.set(temperature_value)
-    humidity.set(humidity_value)
-    voc_index.set(voc_index_value)
-    compensated_raw_gas.set(compensated_raw_gas_value)
-    
-            #if args.verbose:
-                #print("INFO temperature: ", temperature_value, " co2: ", co2_value, " tvoc: ", tvoc_value)
+
+    #if args.verbose:
+        #print("INFO temperature: ", temperature_value, " co2: ", co2_value, " tvoc: ", tvoc_value)
+    return {
+        'co2': co2_value,
+        'tvoc': tvoc_value,
+        'temperature': temperature_value,
+        'humidity': humidity_value,
+        'voc_index': voc_index_value,
+        'compensated_raw_gas': compensated_raw_gas_value,
+    }
+
+def get_data():
+    for field, value in read_sensor().items():
+        gauges[field].set(value)
 
 if __name__ == '__main__':
+    if args.lazy:
+        REGISTRY.register(ScrapeCollector('stemma', read_sensor, METRICS, ttl=args.ttl))
+    else:
+        gauges = {field: Gauge(name, documentation) for field, name, documentation in METRICS}
     start_http_server(args.port, args.bind)
     while True:
-        get_data()
+        if not args.lazy:
+            get_data()
         sleep(args.polling_interval)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Check moda.airquality against python-aqi and time both
+
+The golden set is every PM2.5 reading a sensor can report (0.0 to 500.4
+in steps of 0.1, as floats, strings and ints), every PM10 reading up to
+604, random floats at full precision and random pairs for to_aqi. Every
+EPA index has to match python-aqi exactly. Then both are timed on a day
+of readings (one every second), and the NumPy batch path on the same day
+as arrays. Needs python-aqi and numpy:
+
+    pip3 install python-aqi numpy
+    python3 testing/aqi-benchmark.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aqi  # noqa: E402
+import numpy as np  # noqa: E402
+
+from moda import airquality  # noqa: E402
+from moda.airquality import EPA, POLLUTANT_PM25, POLLUTANT_PM10  # noqa: E402
+
+PM25_TOP = 5004
+PM10_TOP = 604
+
+
+def golden(rng):
+    """(pollutant, concentration) pairs inside python-aqi's tables"""
+    for tenths in range(PM25_TOP + 1):
+        yield POLLUTANT_PM25, tenths / 10
+        yield POLLUTANT_PM25, '{:.1f}'.format(tenths / 10)
+    for value in range(PM10_TOP + 1):
+        yield POLLUTANT_PM10, value
+        yield POLLUTANT_PM10, value + 0.5
+        yield POLLUTANT_PM10, float(value)
+    for _ in range(20000):
+        yield POLLUTANT_PM25, rng.uniform(0, PM25_TOP / 10)
+        yield POLLUTANT_PM10, rng.uniform(0, PM10_TOP)
+
+
+def check(rng):
+    mismatches = 0
+    count = 0
+    for pollutant, concentration in golden(rng):
+        count += 1
+        expected = aqi.to_iaqi(pollutant, concentration, algo=aqi.ALGO_EPA)
+        found = EPA.iaqi(pollutant, concentration)
+        if found != expected:
+            mismatches += 1
+            if mismatches <= 10:
+                print("  {} {!r}: {} where python-aqi has {}".format(pollutant, concentration, found, expected))
+    for _ in range(20000):
+        pm25 = round(rng.uniform(0, PM25_TOP / 10), rng.choice((1, 2, 6)))
+        pm10 = round(rng.uniform(0, PM10_TOP), 1)
+        count += 1
+        if EPA.aqi(pm25, pm10) != aqi.to_aqi([(aqi.POLLUTANT_PM25, pm25), (aqi.POLLUTANT_PM10, pm10)]):
+            mismatches += 1
+    print("golden: {} of {} indices differ from python-aqi".format(mismatches, count))
+    return mismatches
+
+
+def day(rng):
+    """A day of 1 Hz readings: a slow random walk at the sensor's 0.1 ug/m3 resolution"""
+    pm25 = []
+    level = 8.0
+    for _ in range(86400):
+        level = min(max(level + rng.gauss(0, 0.3), 0), 300)
+        pm25.append(round(level, 1))
+    pm10 = [round(value * 1.6, 1) for value in pm25]
+    return pm25, pm10
+
+
+def main():
+    rng = random.Random(0)
+    failures = check(rng)
+
+    pm25, pm10 = day(rng)
+    pairs = list(zip(pm25, pm10))
+    print("{} readings, {} distinct".format(len(pairs), len(set(pairs))))
+
+    def python_aqi():
+        for a, b in pairs:
+            aqi.to_aqi([(aqi.POLLUTANT_PM25, a), (aqi.POLLUTANT_PM10, b)])
+
+    def cold():
+        airquality._iaqi.cache_clear()
+        for a, b in pairs:
+            EPA.aqi(a, b)
+
+    def warm():
+        for a, b in pairs:
+            EPA.aqi(a, b)
+
+    pm25_array, pm10_array = np.array(pm25), np.array(pm10)
+
+    def batch():
+        EPA.aqi_array(pm25_array, pm10_array)
+
+    expected = np.array([aqi.to_aqi([(aqi.POLLUTANT_PM25, a), (aqi.POLLUTANT_PM10, b)]) for a, b in pairs], dtype=float)
+    if not np.array_equal(EPA.aqi_array(pm25_array, pm10_array), expected):
+        print("batch: differs from python-aqi")
+        failures += 1
+
+    baseline = None
+    for name, function, number in (('python-aqi', python_aqi, 1), ('cold cache', cold, 3), ('warm cache', warm, 3), ('numpy batch', batch, 3)):
+        seconds = min(timeit.repeat(function, number=1, repeat=number))
+        baseline = baseline or seconds
+        print("  {:<12} {:8.3f} s {:8.2f} us/reading {:7.1f}x".format(
+            name, seconds, seconds / len(pairs) * 1e6, baseline / seconds))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
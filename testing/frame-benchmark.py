@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Fuzz and time the SDS011/PMS5003 frame decoders of moda.frames
+
+Replays recorded byte streams (or a generated one) through a decoder in
+random chunk sizes, with random bytes flipped, dropped and inserted, and
+checks that it finds exactly the frames a naive byte-by-byte reference
+decoder finds, however the stream is chunked. Then times both decoders
+on the stream as is and with one byte in 50 mangled. Run it from the checkout:
+
+    python3 testing/frame-benchmark.py pms5003
+    python3 testing/frame-benchmark.py sds011 --seeds 500
+
+Record a stream on the Pi first to replay what a real sensor sends:
+
+    python3 testing/frame-benchmark.py pms5003 --record /dev/ttyAMA0 --seconds 300 --output pms5003.bin
+    python3 testing/frame-benchmark.py pms5003 pms5003.bin
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moda.frames import SDS011Decoder, PMS5003Decoder  # noqa: E402
+
+
+def sds011_frame(rng):
+    body = struct.pack('<HH', rng.randrange(1000), rng.randrange(2000)) + b'\x12\x34'
+    return b'\xaa\xc0' + body + bytes([sum(body) & 0xFF]) + b'\xab'
+
+
+def pms5003_frame(rng):
+    body = b'BM' + struct.pack('>14H', 28, *(rng.randrange(1000) for _ in range(13)))
+    return body + struct.pack('>H', sum(body))
+
+
+SENSORS = {
+    'sds011': (SDS011Decoder, sds011_frame),
+    'pms5003': (PMS5003Decoder, pms5003_frame),
+}
+
+
+def generate(make_frame, frames, seed=0):
+    rng = random.Random(seed)
+    return b''.join(make_frame(rng) for _ in range(frames))
+
+
+def reference(decoder_class, stream):
+    """Frames found by checking every offset of the stream, copying as it goes"""
+    header, size = decoder_class.HEADER, decoder_class.SIZE
+    decoder = decoder_class('reference')
+    frames = []
+    index = 0
+    while index + size <= len(stream):
+        frame = bytes(stream[index:index + size])
+        if frame.startswith(header) and decoder.valid(memoryview(frame), 0):
+            frames.append(decoder.unpack(frame, 0))
+            index += size
+        else:
+            index += 1
+    return frames
+
+
+def chunks(stream, rng, largest=64):
+    index = 0
+    while index < len(stream):
+        size = rng.randint(1, largest)
+        yield stream[index:index + size]
+        index += size
+
+
+def mutate(stream, rng, rate):
+    """Flip, drop and insert bytes at about rate per byte"""
+    data = bytearray(stream)
+    for _ in range(int(len(data) * rate)):
+        index = rng.randrange(len(data))
+        action = rng.random()
+        if action < 0.5:
+            data[index] = rng.randrange(256)
+        elif action < 0.75:
+            del data[index]
+        else:
+            data[index:index] = bytes(rng.randrange(256) for _ in range(rng.randint(1, 8)))
+    return bytes(data)
+
+
+def key(frame):
+    # PMS5003Data compares by identity
+    return getattr(frame, 'data', frame)
+
+
+def fuzz(decoder_class, stream, seeds, rate):
+    failures = 0
+    for seed in range(seeds):
+        rng = random.Random(seed)
+        mutated = mutate(stream, rng, rate)
+        expected = [key(frame) for frame in reference(decoder_class, mutated)]
+        decoder = decoder_class('fuzz')
+        found = []
+        for chunk in chunks(mutated, rng):
+            found.extend(key(frame) for frame in decoder.feed(chunk))
+        if found != expected:
+            failures += 1
+            print("seed {}: {} frames decoded, the reference found {}".format(seed, len(found), len(expected)))
+    return failures
+
+
+def throughput(name, decode, stream, frames, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        found = decode(stream)
+        best = min(best, time.perf_counter() - start)
+    print("  {:<10} {:8.2f} MB/s {:10.0f} frames/s  ({} frames)".format(
+        name, len(stream) / best / 1e6, frames / best, found))
+
+
+def record(device, seconds, output):
+    import serial
+    with serial.Serial(device, 9600, timeout=1) as port, open(output, 'wb') as out:
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            out.write(port.read(max(1, port.in_waiting)))
+    print("Recorded {} bytes from {} to {}".format(os.path.getsize(output), device, output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz and time the UART frame decoders")
+    parser.add_argument('sensor', choices=sorted(SENSORS))
+    parser.add_argument('recordings', nargs='*', metavar='FILE', help="recorded byte streams (default: a generated one)")
+    parser.add_argument('--frames', type=int, default=20000, help="frames in the generated stream (default: 20000)")
+    parser.add_argument('--seeds', type=int, default=200, help="fuzzed variants of each stream (default: 200)")
+    parser.add_argument('--rate', type=float, default=0.002, help="mutations per byte (default: 0.002)")
+    parser.add_argument('--record', metavar='DEVICE', help="record the bytes from DEVICE instead")
+    parser.add_argument('--seconds', type=float, default=60, help="how long to record (default: 60)")
+    parser.add_argument('--output', default='recording.bin', help="file to record to (default: recording.bin)")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.seconds, args.output)
+        return
+
+    decoder_class, make_frame = SENSORS[args.sensor]
+    streams = [(path, open(path, 'rb').read()) for path in args.recordings]
+    if not streams:
+        streams = [('generated', generate(make_frame, args.frames))]
+
+    failures = 0
+    for name, stream in streams:
+        decoder = decoder_class('benchmark')
+        frames = len(decoder.feed(stream))
+        print("{}: {} bytes, {} frames, {} checksum errors, {} resyncs skipping {} bytes".format(
+            name, len(stream), frames, decoder.checksum_errors, decoder.resyncs, decoder.skipped))
+
+        # The fuzz streams are a slice of the recording, so a seed runs in milliseconds
+        fuzzed = stream[:200 * decoder_class.SIZE]
+        failed = fuzz(decoder_class, fuzzed, args.seeds, args.rate)
+        print("  fuzz: {} of {} mutated streams decoded differently from the reference".format(failed, args.seeds))
+        failures += failed
+
+        def chunked(data):
+            decoder = decoder_class('benchmark')
+            return sum(len(decoder.feed(data[index:index + 64])) for index in range(0, len(data), 64))
+
+        # A sensor with a loose wire: one byte in 50 mangled
+        noisy = mutate(stream, random.Random(0), 0.02)
+        noisy_frames = len(decoder_class('benchmark').feed(noisy))
+        for label, data, count in (('clean', stream, frames), ('noisy', noisy, noisy_frames)):
+            print("  {} stream:".format(label))
+            throughput('reference', lambda data: len(reference(decoder_class, data)), data, count)
+            throughput('decoder', lambda data: len(decoder_class('benchmark').feed(data)), data, count)
+            throughput('64B feeds', chunked, data, count)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
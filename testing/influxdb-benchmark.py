@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Compare the Point-per-field InfluxDB payload with moda.lineprotocol
+
+Prints bytes on the wire (plain and gzipped) and CPU time per post for one
+snapshot of the twelve enviroplus fields, and for a batch of snapshots.
+Needs influxdb-client for the Point baseline.
+
+    python3 testing/influxdb-benchmark.py --posts 5000
+"""
+
+import argparse
+import gzip
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from influxdb_client import Point  # noqa: E402
+
+from moda.lineprotocol import LineSerializer  # noqa: E402
+from moda.snapshot import SnapshotStore  # noqa: E402
+
+FIELDS = ('temperature', 'pressure', 'humidity', 'oxidising', 'reducing', 'nh3',
+          'lux', 'proximity', 'pm1', 'pm25', 'pm10', 'aqi')
+LOCATION = 'Adelaide'
+
+
+def make_snapshots(count):
+    store = SnapshotStore(FIELDS)
+    snapshots = []
+    for n in range(count):
+        store.update({
+            'temperature': random.uniform(15, 30),
+            'pressure': random.uniform(990, 1030),
+            'humidity': random.uniform(30, 70),
+            'oxidising': random.uniform(10000, 60000),
+            'reducing': random.uniform(100000, 900000),
+            'nh3': random.uniform(10000, 900000),
+            'lux': random.uniform(0, 800),
+            'proximity': float(random.randint(0, 50)),
+            'pm1': float(random.randint(0, 20)),
+            'pm25': float(random.randint(0, 40)),
+            'pm10': float(random.randint(0, 60)),
+            'aqi': float(random.randint(0, 120)),
+        })
+        snapshots.append(store.publish(1700000000 + 5 * n))
+    return snapshots
+
+
+def points_body(snapshots):
+    """The previous path: one Point per field, serialized by influxdb-client"""
+    lines = []
+    for snapshot in snapshots:
+        sensor_data = snapshot.as_dict()
+        for field_name in sensor_data:
+            point = Point('enviroplus').tag('location', LOCATION).field(field_name, sensor_data[field_name])
+            lines.append(point.time(int(snapshot.timestamp), write_precision='s').to_line_protocol())
+    return '\n'.join(lines)
+
+
+def measure(name, build, snapshots, posts):
+    body = build(snapshots)
+    start = time.process_time()
+    for _ in range(posts):
+        build(snapshots)
+    cpu = (time.process_time() - start) / posts
+    raw = len(body.encode('utf-8'))
+    packed = len(gzip.compress(body.encode('utf-8')))
+    print('{:<22} {:>5} lines {:>8} bytes {:>7} gzipped {:>9.1f} us/post'.format(
+        name, body.count('\n') + 1, raw, packed, cpu * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark InfluxDB line protocol serialization")
+    parser.add_argument("--posts", default=2000, type=int, help="posts to time per case (default: 2000)")
+    parser.add_argument("--batch", default=100, type=int, help="snapshots per batched body (default: 100)")
+    args = parser.parse_args()
+
+    random.seed(0)
+    serializer = LineSerializer('enviroplus', {'location': LOCATION}, FIELDS)
+    single = make_snapshots(1)
+    batch = make_snapshots(args.batch)
+
+    measure('Point per field', points_body, single, args.posts)
+    measure('LineSerializer', serializer.snapshots, single, args.posts)
+    measure('Point per field x{}'.format(args.batch), points_body, batch, max(1, args.posts // args.batch))
+    measure('LineSerializer x{}'.format(args.batch), serializer.snapshots, batch, max(1, args.posts // args.batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Minimal InfluxDB v2 write API stand-in, and a check of moda.influx.InfluxWriter
+
+The stand-in answers POST /api/v2/write with status (204 unless told
+otherwise, like a server that is up), unzips gzipped bodies and records
+every line it accepts. Run it alone to watch what an exporter writes:
+
+    python3 testing/influxdb-standin.py --port 8086
+
+With --check it runs the InfluxWriter through an outage instead: batches
+answered 503 go to the spool and are replayed once writes are taken
+again, every point arriving exactly once; a 400 drops the batch instead
+of spooling it, and a writer stopped during an outage leaves its queue in
+the spool for the next one. Needs requests:
+
+    python3 testing/influxdb-standin.py --check
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Server:
+    def __init__(self, port=0, status=204, verbose=False):
+        self.port = port
+        self.status = status
+        self.verbose = verbose
+        # Lines accepted, in arrival order
+        self.lines = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                status = server.handle(self.path, body.decode())
+                self.send_response(status)
+                if status == 204:
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                else:
+                    code = 'invalid' if status == 400 else 'unavailable'
+                    message = '{{"code":"{}","message":"stand-in"}}'.format(code).encode()
+                    self.send_header('Content-Length', str(len(message)))
+                    self.end_headers()
+                    self.wfile.write(message)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, path, body):
+        with self._lock:
+            self.requests += 1
+            status = self.status
+            if not path.startswith('/api/v2/write'):
+                return 404
+            if status == 204:
+                lines = [line for line in body.split('\n') if line]
+                self.lines.extend(lines)
+                if self.verbose:
+                    print('\n'.join(lines))
+        return status
+
+
+def wait(predicate, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def check():
+    from moda.influx import InfluxWriter, DROPPED, SPOOL_POINTS
+
+    failures = 0
+    spool = tempfile.mkdtemp()
+    server = Server().start()
+    url = 'http://127.0.0.1:{}'.format(server.port)
+
+    def writer():
+        return InfluxWriter(url, 'token', 'org', 'bucket', batch_size=50, flush_interval=0.2,
+                            spool_dir=spool, replay_rate=5000).start()
+
+    expected = []
+
+    def send(count):
+        for _ in range(count):
+            expected.append('standin,check=1 value={}i {}'.format(len(expected), 1700000000 + len(expected)))
+            influx.write(expected[-1])
+
+    def delivered(what):
+        ok = wait(lambda: len(server.lines) >= len(expected) and not os.listdir(spool))
+        # Points carry their timestamps, so replayed batches may land after newer ones
+        if not ok or sorted(server.lines) != sorted(expected):
+            print("  {}: {} of {} points delivered, {} duplicates, {} spooled".format(
+                what, len(set(server.lines) & set(expected)), len(expected),
+                len(server.lines) - len(set(server.lines)), len(os.listdir(spool))))
+            return 1
+        print("{}: all {} points delivered once, spool empty".format(what, len(expected)))
+        return 0
+
+    influx = writer()
+    send(100)
+    failures += delivered("up")
+
+    server.status = 503
+    send(300)
+    wait(lambda: SPOOL_POINTS._value.get() >= 300)
+    print("503: {:.0f} points in {} spooled batches".format(SPOOL_POINTS._value.get(), len(os.listdir(spool))))
+    server.status = 204
+    failures += delivered("after 503")
+
+    server.status = 503
+    send(120)
+    influx.stop()
+    print("stopped during an outage: {:.0f} points spooled".format(SPOOL_POINTS._value.get()))
+    server.status = 204
+    influx = writer()
+    failures += delivered("after a restart")
+
+    server.status = 400
+    rejected = DROPPED.labels('rejected')._value.get()
+    influx.write(['standin,check=1 value=-1i 1700000000'] * 50)
+    wait(lambda: DROPPED.labels('rejected')._value.get() > rejected)
+    dropped = DROPPED.labels('rejected')._value.get() - rejected
+    if dropped != 50 or os.listdir(spool):
+        failures += 1
+        print("  400: {:.0f} of 50 points dropped, {} batches spooled".format(dropped, len(os.listdir(spool))))
+    else:
+        print("400: batch dropped, nothing spooled")
+    influx.stop()
+    server.stop()
+
+    sys.exit(1 if failures else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="InfluxDB v2 write API stand-in")
+    parser.add_argument("--port", default=8086, type=int, help="port to listen on (default: 8086)")
+    parser.add_argument("--status", default=204, type=int, help="status to answer writes with (default: 204)")
+    parser.add_argument("--check", action='store_true', help="check moda.influx.InfluxWriter against it instead")
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+    Server(args.port, args.status, verbose=True).start()
+    while True:
+        time.sleep(60)
+
+
+if __name__ == '__main__':
+    main()
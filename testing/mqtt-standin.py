@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Minimal MQTT 3.1.1 broker stand-in, and a check of moda.mqtt.Publisher
+
+The stand-in takes connections, acknowledges QoS 1 publishes (optionally
+after ack_delay seconds, like a broker across a slow link) and records
+every message; it answers pings and ignores subscriptions. Run it alone
+to watch what an exporter publishes:
+
+    python3 testing/mqtt-standin.py --port 1883
+
+With --check it runs the Publisher through an outage instead: messages
+published while the broker is down go to the spool and come out in
+order once it is back, a publisher closed during an outage leaves
+its queue in the spool for the next one, and pipelined QoS 1 is timed
+against one message in flight. Needs paho-mqtt:
+
+    python3 testing/mqtt-standin.py --check
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 12, 13, 14
+
+
+def read_packet(sock):
+    """(type, flags, body) of the next packet, None at end of stream"""
+    header = sock.recv(1)
+    if not header:
+        return None
+    length, shift = 0, 0
+    while True:
+        byte = sock.recv(1)
+        if not byte:
+            return None
+        length |= (byte[0] & 0x7F) << shift
+        shift += 7
+        if not byte[0] & 0x80:
+            break
+    body = b''
+    while len(body) < length:
+        chunk = sock.recv(length - len(body))
+        if not chunk:
+            return None
+        body += chunk
+    return header[0] >> 4, header[0] & 0x0F, body
+
+
+class Broker:
+    def __init__(self, port=0, ack_delay=0.0, verbose=False):
+        self.port = port
+        self.ack_delay = ack_delay
+        self.verbose = verbose
+        # (topic, payload, qos, dup) in arrival order
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._clients = []
+
+    def start(self):
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', self.port))
+        self.port = self._server.getsockname()[1]
+        self._server.listen()
+        threading.Thread(target=self._accept, args=(self._server,), daemon=True).start()
+        return self
+
+    def stop(self):
+        """Go away: stop listening and drop every connection"""
+        server, self._server = self._server, None
+        # close() alone leaves a thread blocked in accept() holding the port
+        try:
+            server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        server.close()
+        for client in list(self._clients):
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+        self._clients.clear()
+
+    def _accept(self, server):
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            self._clients.append(client)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _send(self, client, data):
+        with self._lock:
+            try:
+                client.sendall(data)
+            except OSError:
+                pass
+
+    def _serve(self, client):
+        try:
+            while True:
+                packet = read_packet(client)
+                if packet is None:
+                    return
+                kind, flags, body = packet
+                if kind == CONNECT:
+                    self.connections += 1
+                    self._send(client, bytes([CONNACK << 4, 2, 0, 0]))
+                elif kind == PUBLISH:
+                    qos = (flags >> 1) & 3
+                    length = struct.unpack('>H', body[:2])[0]
+                    topic = body[2:2 + length].decode()
+                    rest = body[2 + length:]
+                    if qos:
+                        mid, rest = rest[:2], rest[2:]
+                    with self._lock:
+                        self.messages.append((topic, rest, qos, bool(flags & 8)))
+                    if self.verbose:
+                        print("{} {}".format(topic, rest.decode(errors='replace')))
+                    if qos:
+                        puback = bytes([PUBACK << 4, 2]) + mid
+                        if self.ack_delay:
+                            # Latency, not a slow broker: keep reading meanwhile
+                            threading.Timer(self.ack_delay, self._send, (client, puback)).start()
+                        else:
+                            self._send(client, puback)
+                elif kind == SUBSCRIBE:
+                    self._send(client, bytes([SUBACK << 4, 3]) + body[:2] + b'\x00')
+                elif kind == PINGREQ:
+                    self._send(client, bytes([PINGRESP << 4, 0]))
+                elif kind == DISCONNECT:
+                    return
+        except OSError:
+            return
+        finally:
+            client.close()
+
+
+def wait(predicate, timeout=15):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def delivered(broker):
+    """Payloads received, QoS 1 redeliveries counted once"""
+    seen = []
+    for _, payload, _, _ in broker.messages:
+        if payload not in seen[-50:]:
+            seen.append(payload)
+    return seen
+
+
+def check():
+    from moda.mqtt import Publisher, QUEUED
+
+    failures = 0
+    spool = tempfile.mkdtemp()
+    broker = Broker().start()
+    port = broker.port
+    publisher = Publisher('127.0.0.1', port, max_queued=50, spool_dir=spool).start()
+    wait(lambda: publisher.connected)
+
+    expected = []
+
+    def send(count):
+        for _ in range(count):
+            payload = str(len(expected)).encode()
+            expected.append(payload)
+            publisher.publish('standin/check', payload)
+
+    send(100)
+    wait(lambda: len(delivered(broker)) >= 100)
+    print("connected: {} of 100 delivered".format(len(delivered(broker))))
+
+    broker.stop()
+    wait(lambda: not publisher.connected)
+    send(300)
+    memory = QUEUED.labels(publisher.broker, 'memory')._value.get()
+    disk = QUEUED.labels(publisher.broker, 'disk')._value.get()
+    print("outage: {:.0f} queued in memory, {:.0f} spooled".format(memory, disk))
+    broker.port = port
+    broker.start()
+    ok = wait(lambda: len(delivered(broker)) >= len(expected))
+    if not ok or delivered(broker) != expected:
+        failures += 1
+        print("  after the outage {} of {} delivered, in order: {}".format(len(delivered(broker)), len(expected), delivered(broker) == expected[:len(delivered(broker))]))
+    else:
+        print("after outage: all {} delivered in order, {} connections".format(len(expected), broker.connections))
+
+    broker.stop()
+    wait(lambda: not publisher.connected)
+    send(120)
+    publisher.close(timeout=0.5)
+    print("closed during an outage: {} spool segments".format(len(os.listdir(spool))))
+    broker.port = port
+    broker.start()
+    publisher = Publisher('127.0.0.1', port, max_queued=50, spool_dir=spool).start()
+    ok = wait(lambda: len(delivered(broker)) >= len(expected))
+    if not ok or delivered(broker) != expected:
+        failures += 1
+        print("  after a restart {} of {} delivered".format(len(delivered(broker)), len(expected)))
+    else:
+        print("after restart: all {} delivered in order".format(len(expected)))
+    publisher.close()
+    broker.stop()
+
+    # A broker 10 ms of acknowledgement away
+    for inflight in (1, 20):
+        broker = Broker(ack_delay=0.01).start()
+        publisher = Publisher('127.0.0.1', broker.port, max_inflight=inflight).start()
+        wait(lambda: publisher.connected)
+        start = time.perf_counter()
+        for i in range(200):
+            publisher.publish('standin/timing', str(i))
+        wait(lambda: len(broker.messages) >= 200)
+        print("  {:2d} in flight: {:6.1f} messages/s".format(inflight, 200 / (time.perf_counter() - start)))
+        publisher.close()
+        broker.stop()
+
+    sys.exit(1 if failures else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT broker stand-in")
+    parser.add_argument("--port", default=1883, type=int, help="port to listen on (default: 1883)")
+    parser.add_argument("--ack-delay", default=0.0, type=float, help="seconds before acknowledging a QoS 1 publish")
+    parser.add_argument("--check", action='store_true', help="check moda.mqtt.Publisher against it instead")
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+    Broker(args.port, args.ack_delay, verbose=True).start()
+    while True:
+        time.sleep(60)
+
+
+if __name__ == '__main__':
+    main()
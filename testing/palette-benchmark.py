@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Check moda.palette against PIL's palette conversion and time both
+
+Draws a frame of each inky-what layout (600x448, with sample values) and
+quantizes it to the panel palette at a few saturations the way the Inky
+driver does (PIL, Floyd-Steinberg) and without dithering (PIL, none), and
+with the lookup table (none and ordered). Without dithering the table has
+to give PIL's output pixel for pixel; random images are checked too. Also
+times building the table and loading it from the disk cache. Needs numpy
+and pillow:
+
+    python3 testing/palette-benchmark.py
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'inky-what'))
+
+import numpy as np  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from moda.palette import DITHER_NONE, DITHER_ORDERED, Quantizer, build_lut, palette_blend  # noqa: E402
+from layouts import FIELDS, LAYOUTS  # noqa: E402
+
+SATURATIONS = (0.0, 0.5, 1.0)
+SAMPLE = {'aqi': '51', 'pm1': '3', 'pm25': '12.3', 'pm10': '20', 'co2': '415', 'voc': '12', 'tf_in': '70.7', 'tf_out': '52.2'}
+
+
+def frames():
+    """(name, image) of a frame of every layout background"""
+    try:
+        font = ImageFont.load_default(74)
+    except TypeError:
+        # Pillow before 10.1 has only the small bitmap font
+        font = ImageFont.load_default()
+    for name, layout in LAYOUTS.items():
+        image = Image.open(os.path.join(ROOT, 'inky-what', 'resources', layout.background))
+        image.load()
+        draw = ImageDraw.Draw(image)
+        for field, position in FIELDS.items():
+            draw.text(position, SAMPLE[field], layout.fills.get(field), font=font)
+        yield name, image
+
+
+def pil_convert(image, saturation, dither):
+    """The Inky driver's conversion, with or without its dithering"""
+    palette = Image.new('P', (1, 1))
+    palette.putpalette(palette_blend(saturation) + [0, 0, 0] * 248)
+    image.load()
+    return image._new(image.im.convert('P', dither, palette.im))
+
+
+def check(images):
+    failures = 0
+    for saturation in SATURATIONS:
+        quantizer = Quantizer(saturation)
+        for name, image in images:
+            expected = np.asarray(pil_convert(image, saturation, 0))
+            found = quantizer.indices(image)
+            if not np.array_equal(found, expected):
+                failures += 1
+                print("  {} at saturation {}: {} pixels differ from PIL".format(name, saturation, np.count_nonzero(found != expected)))
+    print("exact: {} of {} images differ from PIL".format(failures, len(SATURATIONS) * len(images)))
+    return failures
+
+
+def main():
+    rng = np.random.default_rng(0)
+    images = list(frames())
+    images += [('random {}'.format(i), Image.fromarray(rng.integers(0, 256, (448, 600, 3), dtype=np.uint8))) for i in range(3)]
+    failures = check(images)
+
+    saturation = 0.5
+    seconds = min(timeit.repeat(lambda: build_lut(saturation), number=1, repeat=3))
+    print("  build table     {:8.1f} ms".format(seconds * 1e3))
+    with tempfile.TemporaryDirectory() as cache:
+        Quantizer(saturation, cache=cache)
+        seconds = min(timeit.repeat(lambda: Quantizer(saturation, cache=cache), number=1, repeat=5))
+        print("  cached table    {:8.1f} ms".format(seconds * 1e3))
+
+    plain = Quantizer(saturation)
+    ordered = Quantizer(saturation, DITHER_ORDERED)
+    assert plain.dither == DITHER_NONE
+    for name, image in images[:len(LAYOUTS)]:
+        print(name)
+        baseline = None
+        for method, function in (
+                ('PIL dithered', lambda: pil_convert(image, saturation, 1)),
+                ('PIL none', lambda: pil_convert(image, saturation, 0)),
+                ('table none', lambda: plain.quantize(image)),
+                ('table ordered', lambda: ordered.quantize(image))):
+            seconds = min(timeit.repeat(function, number=5, repeat=3)) / 5
+            baseline = baseline or seconds
+            print("  {:<15} {:8.2f} ms/frame {:6.1f}x".format(method, seconds * 1e3, baseline / seconds))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Bytes on the wire for each moda.payload layout, over a synthetic day
+
+Replays a day of PZEM readings (every 5 s, a noisy mains voltage and a
+load switching between a few levels) and of SDS011 readings (every 5
+minutes) through SnapshotPublisher with every encoding, with and without
+deadbands, and prints the PUBLISH bytes against each exporter's previous
+layout. A subscriber merging the messages must hold every field within its
+deadband of the latest reading. CBOR and MessagePack are skipped unless cbor2 and msgpack are installed:
+
+    python3 testing/payload-benchmark.py
+"""
+
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moda.mqtt import packet_size  # noqa: E402
+from moda.payload import ENCODINGS, Deadband, SnapshotPublisher, encoder  # noqa: E402
+
+DAY = 86400
+PZEM_DEADBANDS = ({'watts': 5, 'amps': 0.02, 'volts': 1, 'frequency': 0.1, 'power_factor': 0.02}, 0.0)
+SDS011_DEADBANDS = ({'current_pm25': 1, 'current_pm10': 2, 'aqi': 2}, 0.0)
+
+
+def pzem_day(rng):
+    energy, watts = 0.0, 300.0
+    for step in range(DAY // 5):
+        if rng.random() < 0.01:
+            watts = rng.choice((5.0, 60.0, 300.0, 1100.0, 2000.0))
+        volts = round(230 + rng.gauss(0, 0.4), 1)
+        power = round(max(0.0, watts + rng.gauss(0, 1.5)), 1)
+        energy += power * 5 / 3600
+        yield step * 5, {
+            'volts': volts, 'amps': round(power / volts, 3), 'watts': power, 'energy': float(int(energy)),
+            'frequency': round(50 + rng.gauss(0, 0.02), 1), 'power_factor': 0.95, 'alarm': 0.0,
+        }
+
+
+def sds011_day(rng):
+    pm25 = 8.0
+    for step in range(DAY // 300):
+        pm25 = max(0.0, pm25 + rng.gauss(0, 0.6))
+        values = {'current_pm25': round(pm25, 1), 'current_pm10': round(pm25 * 1.6 + rng.gauss(0, 0.5), 1)}
+        aqi = round(pm25 * 4.2)
+        values = dict({'aqi': aqi, 'level': 'Good' if aqi <= 50 else 'Moderate'}, **values)
+        yield step * 300, values
+
+
+class Recorder:
+    """Stands in for moda.mqtt.Publisher, keeping what would be published"""
+    qos = 1
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload, qos=None, retain=False):
+        self.messages.append((topic, payload if isinstance(payload, bytes) else payload.encode()))
+
+
+def decoder(encoding):
+    if encoding == 'cbor':
+        import cbor2
+        return cbor2.loads
+    if encoding == 'msgpack':
+        import msgpack
+        return msgpack.unpackb
+    return json.loads
+
+
+def off(got, value, threshold) -> bool:
+    """Whether the subscriber's got is further than threshold from value"""
+    if got is None:
+        return True
+    if isinstance(value, str):
+        return got != value
+    return abs(float(got) - value) > threshold + 1e-9
+
+
+def replay(readings, topic, encoding, deadbands, heartbeat, baseline, qos):
+    """(bytes sent, baseline bytes, messages, fields off at the subscriber)"""
+    recorder = Recorder()
+    deadband = Deadband(*deadbands, heartbeat=heartbeat) if deadbands else None
+    packer = SnapshotPublisher(recorder, topic, encoding, deadband, baseline, qos)
+    decode = None if encoding == 'topics' else decoder(encoding)
+    thresholds, default = deadbands or ({}, 0.0)
+    seen, errors = {}, 0
+    for timestamp, values in readings:
+        start = len(recorder.messages)
+        packer.publish(values, {'timestamp': timestamp})
+        for message_topic, payload in recorder.messages[start:]:
+            if decode is None:
+                seen[message_topic.rsplit('/', 1)[1]] = payload.decode()
+            else:
+                seen.update(decode(payload))
+        errors += sum(off(seen.get(name), value, thresholds.get(name, default)) for name, value in values.items())
+    sent = sum(packet_size(message_topic, payload, qos) for message_topic, payload in recorder.messages)
+    # The packer keeps baseline less sent
+    return sent, sent + packer._balance, len(recorder.messages), errors
+
+
+def main():
+    encodings = []
+    for encoding in ENCODINGS:
+        try:
+            decoder(encoding)
+            if encoding != 'topics':
+                encoder(encoding)
+            encodings.append(encoding)
+        except ImportError:
+            print("{}: not installed, skipped".format(encoding))
+
+    failures = 0
+    for name, readings, topic, deadbands, heartbeat, baseline, qos in (
+            ('pzem, one meter, 5 s', list(pzem_day(random.Random(1))), 'pzem/1', PZEM_DEADBANDS, 300, 'json', 1),
+            ('sds011, 5 min', list(sds011_day(random.Random(2))), 'sds011', SDS011_DEADBANDS, 900, 'topics', 0)):
+        print(name)
+        for encoding in encodings:
+            for filtered in (None, deadbands):
+                sent, base, messages, errors = replay(readings, topic, encoding, filtered, heartbeat, baseline, qos)
+                failures += errors
+                print("  {:<8} {:<9} {:6d} messages {:9d} bytes {:5.1f}% of the {} baseline{}".format(
+                    encoding, 'deadband' if filtered else 'all', messages, sent, 100.0 * sent / base, baseline,
+                    ", {} fields off at the subscriber".format(errors) if errors else ""))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
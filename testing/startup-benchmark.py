@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Measure how fast each exporter is serving again after a (re)start
+
+For every entry point, starts it under `python3 -X importtime`, polls its
+/metrics until the first successful scrape, then stops it and reports the
+time spent importing modules, the time from exec to first scrape and the
+peak RSS. Run it on the Pi with the sensors attached, from the checkout:
+
+    python3 testing/startup-benchmark.py
+    python3 testing/startup-benchmark.py enviroplus enviroplus-sinks --runs 5
+    python3 testing/startup-benchmark.py agent --agent-config /etc/moda/agent.ini
+"""
+
+import argparse
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: (working directory, arguments after python3, with {port} and {config} filled in)
+ENTRY_POINTS = {
+    # The floor: an interpreter serving an empty registry
+    'baseline': ('.', ['-c', 'import time, prometheus_client; prometheus_client.start_http_server({port}); time.sleep(1e9)']),
+    'enviroplus': ('enviroplus-exporter', ['enviroplus_exporter.py', '--port', '{port}']),
+    'enviroplus-sinks': ('enviroplus-exporter', ['enviroplus_exporter.py', '--port', '{port}', '--influxdb', 'true', '--luftdaten', 'true']),
+    'sds011': ('sds011-exporter', ['sds011-exporter.py', '--port', '{port}']),
+    'pzem': ('pzem-exporter', ['pzem-exporter.py', '--port', '{port}']),
+    'sgp30': ('sgp30-exporter', ['sgp30_exporter.py', '--port', '{port}']),
+    'bmp390': ('bmp390-exporter', ['bmp390_exporter.py', '--port', '{port}']),
+    'stemma': ('stemma-exporter', ['stemma_exporter.py', '--port', '{port}']),
+    'apds9960': ('testing/apds9960_exporter', ['apds9960_exporter.py', '--port', '{port}']),
+    'agent': ('.', ['-m', 'moda.agent', '--config', '{config}', '--port', '{port}']),
+}
+DEFAULT = ('baseline', 'enviroplus', 'sds011', 'pzem', 'sgp30', 'bmp390', 'stemma', 'agent')
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def import_seconds(stderr):
+    """Sum of the cumulative import time of top-level imports"""
+    total = 0
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        # Nested imports are indented by two spaces per level
+        if match and len(match.group(3)) == 1:
+            total += int(match.group(2))
+    return total / 1e6
+
+
+def scrape(port):
+    try:
+        with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def run_once(name, args):
+    directory, argv = ENTRY_POINTS[name]
+    argv = [arg.format(port=args.port, config=args.agent_config) for arg in argv]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    with tempfile.TemporaryFile() as stderr:
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, '-X', 'importtime'] + argv, cwd=os.path.join(ROOT, directory),
+                                   env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        first_scrape = None
+        while time.monotonic() - start < args.timeout:
+            if process.poll() is not None:
+                break
+            if scrape(args.port):
+                first_scrape = time.monotonic() - start
+                break
+            time.sleep(0.01)
+
+        # Reap the child with wait4, which gives its own rusage (Popen.wait would discard it)
+        peak_rss = float('nan')
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+            deadline = time.monotonic() + 5
+            pid = 0
+            while not pid and time.monotonic() < deadline:
+                time.sleep(0.01)
+                pid, _, usage = os.wait4(process.pid, os.WNOHANG)
+            if not pid:
+                process.kill()
+                _, _, usage = os.wait4(process.pid, 0)
+            process.returncode = 0  # reaped above, keep Popen from waiting again
+            # ru_maxrss is in kilobytes on Linux
+            peak_rss = usage.ru_maxrss / 1024
+
+        stderr.seek(0)
+        output = stderr.read().decode('utf-8', 'replace')
+
+    if first_scrape is None:
+        errors = [line for line in output.splitlines() if not line.startswith('import time:')]
+        print('{}: no scrape within {}s, exit code {}\n    {}'.format(
+            name, args.timeout, process.returncode, '\n    '.join(errors[-5:])), file=sys.stderr)
+        return None
+    return import_seconds(output), first_scrape, peak_rss
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark exporter startup: import time, time to first scrape, peak RSS")
+    parser.add_argument("names", nargs='*', metavar='NAME',
+                        help="entry points to start: {} (default: {})".format(', '.join(ENTRY_POINTS), ' '.join(DEFAULT)))
+    parser.add_argument("--runs", default=3, type=int, help="starts per entry point, the median is reported (default: 3)")
+    parser.add_argument("--port", default=9399, type=int, help="port the exporters are started on (default: 9399)")
+    parser.add_argument("--timeout", default=120, type=float, help="seconds to wait for the first scrape (default: 120)")
+    parser.add_argument("--agent-config", default='/etc/moda/agent.ini', help="config for the agent (default: /etc/moda/agent.ini)")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in ENTRY_POINTS:
+            parser.error('unknown entry point {}, choose from {}'.format(name, ', '.join(ENTRY_POINTS)))
+
+    print('{:<18} {:>10} {:>14} {:>12}'.format('entry point', 'imports s', 'first scrape s', 'peak RSS MB'))
+    for name in args.names or DEFAULT:
+        results = [result for result in (run_once(name, args) for _ in range(args.runs)) if result is not None]
+        if not results:
+            continue
+        imports, first_scrape, peak_rss = (statistics.median(column) for column in zip(*results))
+        print('{:<18} {:>10.3f} {:>14.3f} {:>12.1f}'.format(name, imports, first_scrape, peak_rss))